@@ -14,6 +14,7 @@ from backend.models import (
     ProductInfo,
     ProductParameter,
     Shop,
+    ShopImportState,
 )
 
 
@@ -113,9 +114,33 @@ class ShopAdmin(admin.ModelAdmin):
     list_filter = ["state"]
     search_fields = ["name", "user__email"]
     fieldsets = [
-        (None, {"fields": ["name", "url", "state"]}),
+        (None, {"fields": ["name", "url", "state", "catalog_version"]}),
         ("Пользователь", {"fields": ["user"]}),
     ]
+    readonly_fields = ["catalog_version"]
+
+
+@admin.register(ShopImportState)
+class ShopImportStateAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "shop",
+        "url",
+        "imported_at",
+        "next_import_at",
+        "failures",
+        "content_hash",
+    ]
+    search_fields = ["shop__name", "url"]
+    readonly_fields = [
+        "etag",
+        "last_modified",
+        "content_hash",
+        "imported_at",
+        "scheduled_at",
+        "failures",
+        "last_error",
+    ]
 
 
 @admin.register(Category)
@@ -161,6 +186,7 @@ class ProductAdmin(admin.ModelAdmin):
 class ProductParameterInline(admin.TabularInline):
     model = ProductParameter
     extra = 1
+    readonly_fields = ["value_number", "unit"]
 
 
 @admin.register(ProductInfo)
@@ -174,12 +200,14 @@ class ProductInfoAdmin(admin.ModelAdmin):
         "quantity",
         "price",
         "price_rrp",
+        "catalog_version",
     ]
     search_fields = ["product__name", "shop__name", "model"]
     list_filter = ["shop"]
+    readonly_fields = ["catalog_version"]
 
     fieldsets = [
-        (None, {"fields": ["product", "shop"]}),
+        (None, {"fields": ["product", "shop", "catalog_version"]}),
         (
             "Основная информация",
             {"fields": ["model", "external_id", "quantity"]},
@@ -189,6 +217,21 @@ class ProductInfoAdmin(admin.ModelAdmin):
 
     inlines = [ProductParameterInline]
 
+    def save_model(self, request, obj, form, change):
+        # Новый товар добавляется в активную версию каталога магазина
+        if not change:
+            obj.catalog_version = obj.shop.catalog_version
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.sync_parameters()
+        form.instance.shop.touch_catalog()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        obj.shop.touch_catalog()
+
 
 @admin.register(Parameter)
 class ParameterAdmin(admin.ModelAdmin):
@@ -198,7 +241,8 @@ class ParameterAdmin(admin.ModelAdmin):
 
 @admin.register(ProductParameter)
 class ProductParameterAdmin(admin.ModelAdmin):
-    list_display = ["id", "product_info", "parameter", "value"]
+    list_display = ["id", "product_info", "parameter", "value", "value_number", "unit"]
+    readonly_fields = ["value_number", "unit"]
     search_fields = ["product_info__product__name", "parameter__name"]
     list_filter = [
         "product_info__shop__name",
@@ -206,6 +250,26 @@ class ProductParameterAdmin(admin.ModelAdmin):
         "product_info__product__category__name",
     ]
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        obj.product_info.sync_parameters()
+        obj.product_info.shop.touch_catalog()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        obj.product_info.sync_parameters()
+        obj.product_info.shop.touch_catalog()
+
+    def delete_queryset(self, request, queryset):
+        products_info = ProductInfo.objects.filter(
+            id__in=queryset.values("product_info_id")
+        ).select_related("shop")
+        products_info = list(products_info)
+        super().delete_queryset(request, queryset)
+        for product_info in products_info:
+            product_info.sync_parameters()
+            product_info.shop.touch_catalog()
+
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -0,0 +1,163 @@
+import posixpath
+from gzip import GzipFile
+from tempfile import TemporaryFile
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils.crypto import salted_hmac
+from ujson import dumps as dump_json
+from yaml import dump as dump_yaml
+
+from backend.importer import ImportProgress, batched
+from backend.models import ProductInfo
+from retail_order_api import settings
+
+try:
+    # Генератор на C из libyaml в разы быстрее реализации на Python
+    from yaml import CSafeDumper as FeedDumper
+except ImportError:  # pragma: no cover
+    from yaml import SafeDumper as FeedDumper
+
+EXPORT_CONTENT_TYPES = {
+    "yaml": "application/x-yaml",
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def iter_catalog(shop, chunk_size=None):
+    """
+    Возвращает товары активной версии каталога магазина в формате прайс-листа.
+
+    Товары вместе с параметрами (ProductInfo.parameters) читаются курсором
+    на стороне сервера (в PostgreSQL) частями по chunk_size. Цены
+    выгружаются строками, чтобы не терять точность при повторном импорте.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    rows = (
+        ProductInfo.objects.filter(shop=shop, catalog_version=shop.catalog_version)
+        .order_by("external_id")
+        .values_list(
+            "external_id",
+            "product__category__name",
+            "product__name",
+            "model",
+            "price",
+            "price_rrp",
+            "quantity",
+            "parameters",
+        )
+        .iterator(chunk_size=chunk_size)
+    )
+    for external_id, category, name, model, price, price_rrp, quantity, params in rows:
+        yield {
+            "id": external_id,
+            "category": category,
+            "name": name,
+            "model": model,
+            "price": str(price),
+            "price_rrp": str(price_rrp),
+            "quantity": quantity,
+            "parameters": params,
+        }
+
+
+def export_catalog(shop, feed_format):
+    """
+    Выгружает каталог магазина в формате yaml, json или ndjson.
+    Возвращает генератор частей файла в UTF-8, который можно загрузить
+    обратно через импорт прайс-листа.
+    """
+    header = {
+        "shop_name": shop.name,
+        "categories": list(shop.categories.values_list("name", flat=True)),
+    }
+    goods = batched(iter_catalog(shop), settings.EXPORT_CHUNK_SIZE)
+    if feed_format == "ndjson":
+        yield dump_json(header, ensure_ascii=False).encode() + b"\n"
+        for chunk in goods:
+            yield "".join(
+                dump_json(item, ensure_ascii=False) + "\n" for item in chunk
+            ).encode()
+        return
+    if feed_format == "json":
+        # Словарь заголовка без закрывающей скобки, далее список goods
+        yield dump_json(header, ensure_ascii=False)[:-1].encode() + b',"goods":['
+        separator = ""
+        for chunk in goods:
+            yield (
+                separator
+                + ",".join(dump_json(item, ensure_ascii=False) for item in chunk)
+            ).encode()
+            separator = ","
+        yield b"]}"
+        return
+
+    yield _dump_yaml(header)
+    empty = True
+    for chunk in goods:
+        if empty:
+            yield b"goods:\n"
+            empty = False
+        yield _dump_yaml(chunk)
+    if empty:
+        yield b"goods: []\n"
+
+
+def _dump_yaml(data):
+    return dump_yaml(
+        data, Dumper=FeedDumper, allow_unicode=True, sort_keys=False
+    ).encode()
+
+
+def export_path(shop, feed_format):
+    """
+    Путь сжатой выгрузки каталога в хранилище файлов.
+
+    Имя файла - подпись состояния каталога (версия, время изменения товаров,
+    название и категории магазина) ключом SECRET_KEY: оно меняется вместе
+    с каталогом и не может быть подобрано по id магазина.
+    """
+    state = ":".join(
+        map(
+            str,
+            (
+                shop.id,
+                shop.catalog_version,
+                shop.catalog_updated_at,
+                shop.name,
+                sorted(shop.categories.values_list("id", flat=True)),
+                feed_format,
+            ),
+        )
+    )
+    token = salted_hmac("backend.exports", state).hexdigest()[:32]
+    return f"{settings.EXPORT_DIR}/shop_{shop.id}/{token}.{feed_format}.gz"
+
+
+def build_export(shop, feed_format, progress=None):
+    """
+    Сохраняет выгрузку каталога, сжатую gzip, в хранилище файлов
+    по умолчанию. Если каталог не изменился с прошлой выгрузки, используется
+    сохраненный файл. Возвращает (путь к файлу, создан ли файл).
+    """
+    path = export_path(shop, feed_format)
+    if default_storage.exists(path):
+        return path, False
+
+    progress = progress or ImportProgress()
+    progress.start("export")
+    with TemporaryFile() as file:
+        with GzipFile(fileobj=file, mode="wb") as archive:
+            for chunk in export_catalog(shop, feed_format):
+                archive.write(chunk)
+                progress.advance(len(chunk))
+        file.seek(0)
+        path = default_storage.save(path, File(file))
+
+    # Удаление устаревших выгрузок магазина в этом формате
+    directory, name = posixpath.split(path)
+    for old_name in default_storage.listdir(directory)[1]:
+        if old_name != name and old_name.endswith(f".{feed_format}.gz"):
+            default_storage.delete(posixpath.join(directory, old_name))
+    return path, True
@@ -0,0 +1,787 @@
+import logging
+import os
+import pickle
+from csv import DictReader
+from csv import Error as CsvError
+from hashlib import sha256
+from io import TextIOWrapper
+from os.path import splitext
+from struct import Struct
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from time import monotonic
+from urllib.parse import urlsplit
+
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+from ujson import loads as load_json
+from urllib3.util import Retry
+from yaml import (
+    AliasEvent,
+    MappingEndEvent,
+    MappingNode,
+    MappingStartEvent,
+    ScalarEvent,
+    ScalarNode,
+    SequenceEndEvent,
+    SequenceNode,
+    SequenceStartEvent,
+    StreamEndEvent,
+)
+from yaml.composer import ComposerError
+
+from backend.importer import ImportDataError, ImportProgress
+from retail_order_api import settings
+
+logger = logging.getLogger(__name__)
+
+# Смещение сводки (заголовок и количество товаров) в конце файла FeedCache
+CACHE_FOOTER = Struct("<Q")
+
+try:
+    # Загрузчик на C из libyaml в разы быстрее реализации на Python
+    from yaml import CSafeLoader as FeedLoader
+except ImportError:  # pragma: no cover
+    from yaml import SafeLoader as FeedLoader
+
+
+class YamlFeedReader:
+    """
+    Потоковое чтение прайс-листа в формате YAML.
+
+    Файл разбирается по событиям парсера: заголовок (shop_name, categories)
+    читается сразу, а товары из списка goods строятся по одному при итерации
+    по goods(). В памяти одновременно находится только текущий товар.
+
+    Если список goods расположен в файле раньше categories, товары загружаются
+    целиком, так как для их записи нужны категории. Ключи после goods
+    (например, shop_name при сортировке ключей) попадают в header после
+    завершения итерации по товарам.
+    """
+
+    def __init__(self, stream):
+        self.loader = FeedLoader(stream)
+        self.header = {}
+        self._anchors = {}
+        self._goods = iter(())
+        self._read_header()
+
+    def goods(self):
+        """Возвращает итератор по товарам прайс-листа."""
+        return self._goods
+
+    def _read_header(self):
+        loader = self.loader
+        loader.get_event()  # Начало потока
+        if loader.check_event(StreamEndEvent):
+            self._close()
+            return
+        loader.get_event()  # Начало документа
+        if not loader.check_event(MappingStartEvent):
+            self._close()
+            raise ImportDataError("Файл YAML должен содержать словарь.")
+        loader.get_event()
+
+        while not loader.check_event(MappingEndEvent):
+            key = self._construct(self._compose_node())
+            if key != "goods":
+                self.header[key] = self._construct(self._compose_node())
+            elif "categories" in self.header:
+                self._goods = self._iter_goods()
+                return
+            else:
+                self._goods = iter(self._construct(self._compose_node()) or [])
+        self._read_tail()
+
+    def _iter_goods(self):
+        loader = self.loader
+        if loader.check_event(SequenceStartEvent):
+            loader.get_event()
+            while not loader.check_event(SequenceEndEvent):
+                yield self._construct(self._compose_node())
+            loader.get_event()
+        elif self._construct(self._compose_node()) is not None:
+            raise ImportDataError("goods должен быть списком товаров.")
+
+        while not loader.check_event(MappingEndEvent):
+            key = self._construct(self._compose_node())
+            self.header[key] = self._construct(self._compose_node())
+        self._read_tail()
+
+    def _read_tail(self):
+        """Дочитывает конец документа и освобождает парсер."""
+        self.loader.get_event()  # Конец словаря
+        self.loader.get_event()  # Конец документа
+        self._close()
+
+    def _close(self):
+        self.loader.dispose()
+        self._anchors.clear()
+
+    def _construct(self, node):
+        return self.loader.construct_document(node)
+
+    def _compose_node(self):
+        """
+        Строит узел YAML из событий парсера.
+
+        Аналог Composer.compose_node, которого нет у загрузчика на C.
+        """
+        loader = self.loader
+        event = loader.get_event()
+        if isinstance(event, AliasEvent):
+            if event.anchor not in self._anchors:
+                raise ComposerError(
+                    None,
+                    None,
+                    f"found undefined alias {event.anchor!r}",
+                    event.start_mark,
+                )
+            return self._anchors[event.anchor]
+
+        if isinstance(event, ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = loader.resolve(ScalarNode, event.value, event.implicit)
+            node = ScalarNode(
+                tag, event.value, event.start_mark, event.end_mark, style=event.style
+            )
+        elif isinstance(event, SequenceStartEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = loader.resolve(SequenceNode, None, event.implicit)
+            node = SequenceNode(
+                tag, [], event.start_mark, None, flow_style=event.flow_style
+            )
+            if event.anchor is not None:
+                self._anchors[event.anchor] = node
+            while not loader.check_event(SequenceEndEvent):
+                node.value.append(self._compose_node())
+            node.end_mark = loader.get_event().end_mark
+        else:
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = loader.resolve(MappingNode, None, event.implicit)
+            node = MappingNode(
+                tag, [], event.start_mark, None, flow_style=event.flow_style
+            )
+            if event.anchor is not None:
+                self._anchors[event.anchor] = node
+            while not loader.check_event(MappingEndEvent):
+                item_key = self._compose_node()
+                node.value.append((item_key, self._compose_node()))
+            node.end_mark = loader.get_event().end_mark
+
+        if event.anchor is not None:
+            self._anchors[event.anchor] = node
+        return node
+
+
+class JsonFeedReader:
+    """
+    Чтение прайс-листа в формате JSON.
+
+    Структура совпадает с YAML: словарь с ключами shop_name, categories
+    и goods. Документ разбирается целиком с помощью ujson.
+    """
+
+    def __init__(self, stream):
+        try:
+            data = load_json(stream.read())
+        except ValueError as error:
+            raise ImportDataError(f"Ошибка при разборе файла JSON: {error}.")
+        if not isinstance(data, dict):
+            raise ImportDataError("Файл JSON должен содержать словарь.")
+        self._goods = iter(data.pop("goods", None) or [])
+        self.header = data
+
+    def goods(self):
+        return self._goods
+
+
+class NdjsonFeedReader:
+    """
+    Потоковое чтение прайс-листа в формате NDJSON.
+
+    Каждая строка - отдельный объект JSON. Объекты с полем id считаются
+    товарами, остальные дополняют заголовок (shop_name, categories).
+    Заголовок с categories должен предшествовать товарам.
+    """
+
+    def __init__(self, stream):
+        self._lines = (line for line in stream if line.strip())
+        self.header = {}
+        self._first_item = None
+        for line in self._lines:
+            item = self._parse(line)
+            if "id" in item:
+                self._first_item = item
+                break
+            self.header.update(item)
+
+    def goods(self):
+        if self._first_item is not None:
+            yield self._first_item
+        for line in self._lines:
+            item = self._parse(line)
+            if "id" in item:
+                yield item
+            else:
+                self.header.update(item)
+
+    @staticmethod
+    def _parse(line):
+        try:
+            item = load_json(line)
+        except ValueError as error:
+            raise ImportDataError(f"Ошибка при разборе строки NDJSON: {error}.")
+        if not isinstance(item, dict):
+            raise ImportDataError("Каждая строка NDJSON должна содержать объект.")
+        return item
+
+
+class CsvFeedReader:
+    """
+    Чтение прайс-листа в формате CSV (UTF-8, разделитель - запятая).
+
+    Обязательные колонки: id, category, name, price, price_rrp, quantity;
+    необязательные: model и shop_name. Остальные колонки считаются
+    параметрами товара, пустые значения параметров пропускаются.
+    Список категорий и название магазина собираются первым проходом
+    по файлу, товары читаются вторым.
+    """
+
+    item_fields = ("id", "category", "name", "model", "price", "price_rrp", "quantity")
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.header = {"categories": []}
+        categories = {}
+        for row in self._rows():
+            categories.setdefault(row.get("category"), None)
+            if row.get("shop_name"):
+                self.header["shop_name"] = row["shop_name"]
+        self.header["categories"] = [name for name in categories if name]
+
+    def goods(self):
+        for row in self._rows():
+            item = {field: row.pop(field, None) or None for field in self.item_fields}
+            row.pop("shop_name", None)
+            item["parameters"] = {
+                name: value for name, value in row.items() if name and value
+            }
+            yield item
+
+    def _rows(self):
+        self.stream.seek(0)
+        text = TextIOWrapper(self.stream, encoding="utf-8-sig", newline="")
+        try:
+            yield from DictReader(text)
+        except (CsvError, UnicodeDecodeError) as error:
+            raise ImportDataError(f"Ошибка при разборе файла CSV: {error}.")
+        finally:
+            text.detach()
+
+
+FEED_READERS = {
+    "yaml": YamlFeedReader,
+    "json": JsonFeedReader,
+    "ndjson": NdjsonFeedReader,
+    "csv": CsvFeedReader,
+}
+FEED_CONTENT_TYPES = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv",
+    "application/yaml": "yaml",
+    "application/x-yaml": "yaml",
+    "text/yaml": "yaml",
+    "text/x-yaml": "yaml",
+}
+FEED_EXTENSIONS = {
+    ".json": "json",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".csv": "csv",
+    ".yaml": "yaml",
+    ".yml": "yaml",
+}
+
+
+def detect_feed_format(url, content_type=""):
+    """
+    Определяет формат прайс-листа по заголовку Content-Type,
+    а если он неинформативен - по расширению файла в URL.
+    По умолчанию используется YAML.
+    """
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in FEED_CONTENT_TYPES:
+        return FEED_CONTENT_TYPES[media_type]
+    extension = splitext(urlsplit(url).path)[1].lower()
+    return FEED_EXTENSIONS.get(extension, "yaml")
+
+
+def open_feed(download, url, feed_format=None):
+    """
+    Возвращает объект чтения загруженного прайс-листа в нужном формате.
+    Если прайс-лист с тем же содержимым уже разбирался, он берется из кэша.
+    """
+    feed_format = feed_format or detect_feed_format(url, download.content_type)
+    cache = FeedCache()
+    if cache.enabled and download.content_hash:
+        feed = cache.get(download.content_hash, feed_format)
+        if feed is not None:
+            return feed
+        if download.metrics["bytes"] <= cache.max_feed_size:
+            return CachingFeedReader(
+                FEED_READERS[feed_format](download.file),
+                cache,
+                download.content_hash,
+                feed_format,
+            )
+    return FEED_READERS[feed_format](download.file)
+
+
+class ParsedFeed:
+    """
+    Полностью прочитанный прайс-лист с интерфейсом объектов чтения
+    (header и goods()). Передается между процессами.
+    """
+
+    def __init__(self, header, goods):
+        self.header = header
+        self._goods = goods
+
+    def __len__(self):
+        return len(self._goods)
+
+    def goods(self):
+        return iter(self._goods)
+
+
+def parse_feed_file(path, url, content_type="", feed_format=None):
+    """
+    Разбирает прайс-лист из файла целиком и возвращает ParsedFeed.
+    Используется для разбора в пуле процессов, поэтому принимает путь
+    к файлу, а не открытый поток.
+    """
+    feed_format = feed_format or detect_feed_format(url, content_type)
+    with open(path, "rb") as file:
+        feed = FEED_READERS[feed_format](file)
+        goods = list(feed.goods())
+    return ParsedFeed(feed.header, goods)
+
+
+class FeedCache:
+    """
+    Кэш разобранных прайс-листов в каталоге IMPORT_CACHE_DIR.
+
+    Прайс-лист сохраняется под хэшем содержимого и форматом, поэтому
+    повторный импорт или проверка того же файла обходится без разбора.
+    Файл содержит товары, сериализованные в pickle (протокол 5) по одному,
+    за ними сводку с заголовком и количеством товаров и смещение сводки,
+    поэтому товары записываются и читаются потоком. При чтении обновляется
+    время изменения файла, и при превышении IMPORT_CACHE_MAX_SIZE_MB
+    удаляются файлы, которые дольше всего не использовались. Каталог должен
+    быть доступен только приложению: файлы pickle не загружаются
+    из недоверенных источников.
+    """
+
+    suffix = ".pickle"
+
+    def __init__(self, directory=None):
+        self.directory = directory or settings.IMPORT_CACHE_DIR
+        self.max_size = settings.IMPORT_CACHE_MAX_SIZE_MB * 1024 * 1024
+        self.max_feed_size = settings.IMPORT_CACHE_MAX_FEED_SIZE_MB * 1024 * 1024
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.max_size > 0
+
+    def path(self, content_hash, feed_format):
+        return os.path.join(
+            self.directory, f"{content_hash}.{feed_format}{self.suffix}"
+        )
+
+    def get(self, content_hash, feed_format):
+        """Возвращает CachedFeed из кэша или None."""
+        path = self.path(content_hash, feed_format)
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            file.seek(-CACHE_FOOTER.size, os.SEEK_END)
+            (end,) = CACHE_FOOTER.unpack(file.read(CACHE_FOOTER.size))
+            file.seek(end)
+            summary = pickle.load(file)
+            os.utime(path)
+        except Exception as error:
+            file.close()
+            logger.warning("Поврежденный файл кэша прайс-листа %s: %s", path, error)
+            self._remove(path)
+            return None
+        logger.info("Прайс-лист %s загружен из кэша", content_hash)
+        # Файл остается открытым, поэтому его удаление из кэша
+        # не прерывает чтение товаров
+        return CachedFeed(file, summary["header"], summary["count"], end)
+
+    def writer(self, content_hash, feed_format):
+        """Возвращает FeedCacheWriter для потоковой записи прайс-листа."""
+        return FeedCacheWriter(self, content_hash, feed_format)
+
+    def put(self, content_hash, feed_format, feed):
+        """Сохраняет прочитанный прайс-лист в кэш и удаляет старые файлы."""
+        writer = self.writer(content_hash, feed_format)
+        for item in feed.goods():
+            writer.write(item)
+        writer.commit(feed.header)
+
+    def evict(self):
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(self.suffix):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class FeedCacheWriter:
+    """
+    Потоковая запись прайс-листа в FeedCache.
+
+    Товары сериализуются во временный файл по мере чтения, после записи
+    сводки файл переименовывается, чтобы параллельные импорты не прочитали
+    его частично. Если файл превысил IMPORT_CACHE_MAX_FEED_SIZE_MB или
+    произошла ошибка записи, прайс-лист не кэшируется.
+    """
+
+    def __init__(self, cache, content_hash, feed_format):
+        self.cache = cache
+        self.path = cache.path(content_hash, feed_format)
+        self.count = 0
+        self.file = None
+        try:
+            os.makedirs(cache.directory, exist_ok=True)
+            self.file = NamedTemporaryFile(
+                dir=cache.directory, suffix=".tmp", delete=False
+            )
+        except OSError as error:
+            self._fail(error)
+
+    def write(self, item):
+        if self.file is None:
+            return
+        try:
+            pickle.dump(item, self.file, protocol=5)
+        except OSError as error:
+            self._fail(error)
+            return
+        self.count += 1
+        if self.file.tell() > self.cache.max_feed_size:
+            self.abort()
+
+    def commit(self, header):
+        """Записывает сводку и сохраняет файл в кэше."""
+        if self.file is None:
+            return
+        try:
+            end = self.file.tell()
+            pickle.dump({"header": header, "count": self.count}, self.file, protocol=5)
+            self.file.write(CACHE_FOOTER.pack(end))
+            self.file.close()
+            os.replace(self.file.name, self.path)
+            self.file = None
+            self.cache.evict()
+        except OSError as error:
+            self._fail(error)
+
+    def abort(self):
+        """Удаляет недописанный временный файл."""
+        if self.file is None:
+            return
+        self.file.close()
+        self.cache._remove(self.file.name)
+        self.file = None
+
+    def _fail(self, error):
+        logger.warning("Не удалось сохранить прайс-лист в кэш: %s", error)
+        self.abort()
+
+
+class CachedFeed:
+    """
+    Прайс-лист из FeedCache с интерфейсом объектов чтения (header и goods()).
+    Товары читаются из файла по одному.
+    """
+
+    def __init__(self, file, header, count, end):
+        self.file = file
+        self.header = header
+        self.count = count
+        self.end = end
+
+    def __len__(self):
+        return self.count
+
+    def goods(self):
+        self.file.seek(0)
+        while self.file.tell() < self.end:
+            yield pickle.load(self.file)
+
+
+class CachingFeedReader:
+    """
+    Обертка объекта чтения прайс-листа, которая по мере итерации записывает
+    прочитанные товары в FeedCache и после ее завершения сохраняет файл кэша.
+    Прайс-лист, прочитанный не до конца, в кэш не попадает.
+    """
+
+    def __init__(self, reader, cache, content_hash, feed_format):
+        self.reader = reader
+        self.cache = cache
+        self.content_hash = content_hash
+        self.feed_format = feed_format
+
+    @property
+    def header(self):
+        return self.reader.header
+
+    def goods(self):
+        return self._iter_goods()
+
+    def _iter_goods(self):
+        writer = self.cache.writer(self.content_hash, self.feed_format)
+        try:
+            for item in self.reader.goods():
+                writer.write(item)
+                yield item
+        except BaseException:
+            # Ошибка разбора или итерация прервана (GeneratorExit)
+            writer.abort()
+            raise
+        writer.commit(self.reader.header)
+
+
+def write_feed_chunks(goods, size, directory=None):
+    """
+    Записывает товары в файл частей для импорта в режиме parallel.
+
+    Товары сериализуются в pickle по одному, поэтому в памяти находится
+    только текущий товар. Возвращает путь к файлу и список частей
+    (смещение первого товара, количество товаров) не более size товаров,
+    через брокер Celery передаются только эти ссылки.
+    """
+    directory = directory or settings.IMPORT_PARALLEL_DIR
+    os.makedirs(directory, exist_ok=True)
+    chunks = []
+    with NamedTemporaryFile(dir=directory, suffix=".chunks", delete=False) as file:
+        try:
+            for index, item in enumerate(goods):
+                if index % size == 0:
+                    chunks.append([file.tell(), 0])
+                pickle.dump(item, file, protocol=5)
+                chunks[-1][1] += 1
+        except BaseException:
+            file.close()
+            remove_feed_chunks(file.name)
+            raise
+    return file.name, [tuple(chunk) for chunk in chunks]
+
+
+def read_feed_chunk(path, offset, count):
+    """Возвращает список товаров части, записанной write_feed_chunks."""
+    with open(path, "rb") as file:
+        file.seek(offset)
+        return [pickle.load(file) for _ in range(count)]
+
+
+def remove_feed_chunks(path):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class FeedDownload:
+    """
+    Результат загрузки прайс-листа.
+
+    Тело ответа сохраняется во временный файл (в памяти до
+    IMPORT_SPOOL_MAX_SIZE байт, далее на диске), одновременно вычисляется
+    хэш содержимого. При ответе 304 Not Modified файл не создается.
+    """
+
+    def __init__(self, status_code, etag="", last_modified="", content_type=""):
+        self.status_code = status_code
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_type = content_type
+        self.file = None
+        self.content_hash = ""
+        self.metrics = {"status": status_code, "bytes": 0, "duration": None}
+
+    @property
+    def not_modified(self):
+        return self.status_code == 304
+
+    @property
+    def fingerprint(self):
+        """Отпечаток содержимого для сохранения в ShopImportState."""
+        return {
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "content_hash": self.content_hash,
+        }
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class FeedFetcher:
+    """
+    Загрузка прайс-листов магазинов по HTTP.
+
+    Все загрузки процесса используют общую сессию с пулом соединений
+    и повторными попытками с экспоненциальной задержкой. Ограничены время
+    установки соединения, ожидания данных и всей загрузки, а также размер
+    тела ответа, который проверяется по мере чтения. Поддерживается сжатие
+    gzip/deflate.
+    """
+
+    _session = None
+
+    def __init__(self):
+        self.max_size = settings.IMPORT_FETCH_MAX_SIZE_MB * 1024 * 1024
+        self.timeout = (
+            settings.IMPORT_FETCH_CONNECT_TIMEOUT,
+            settings.IMPORT_FETCH_READ_TIMEOUT,
+        )
+
+    @classmethod
+    def get_session(cls):
+        """Возвращает общую для процесса сессию с пулом соединений."""
+        if cls._session is None:
+            retry = Retry(
+                total=settings.IMPORT_FETCH_RETRIES,
+                backoff_factor=settings.IMPORT_FETCH_BACKOFF,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=("GET",),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=settings.IMPORT_FETCH_POOL_SIZE,
+                pool_maxsize=settings.IMPORT_FETCH_POOL_SIZE,
+                max_retries=retry,
+            )
+            session = Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["Accept-Encoding"] = "gzip, deflate"
+            cls._session = session
+        return cls._session
+
+    def fetch(self, url, etag="", last_modified="", progress=None):
+        """
+        Загружает прайс-лист по URL условным GET-запросом.
+
+        Заголовки If-None-Match и If-Modified-Since отправляются, если известны
+        ETag и Last-Modified предыдущего импорта. Статус ответа, количество
+        байт и длительность загрузки сохраняются в FeedDownload.metrics.
+        """
+        progress = progress or ImportProgress()
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        started_at = monotonic()
+        try:
+            download = self._fetch(url, headers, progress, started_at)
+        except RequestException as error:
+            raise ImportDataError(f"Ошибка при загрузке файла: {error}")
+        download.metrics["duration"] = round(monotonic() - started_at, 3)
+        logger.info("Загрузка прайс-листа %s: %s", url, download.metrics)
+        return download
+
+    def _fetch(self, url, headers, progress, started_at):
+        response = self.get_session().get(
+            url, headers=headers, stream=True, timeout=self.timeout
+        )
+        with response:
+            download = FeedDownload(
+                response.status_code,
+                etag=response.headers.get("ETag", ""),
+                last_modified=response.headers.get("Last-Modified", ""),
+                content_type=response.headers.get("Content-Type", ""),
+            )
+            if download.not_modified:
+                return download
+            if response.status_code >= 400:
+                raise ImportDataError(
+                    f"Ошибка при загрузке файла: HTTP {response.status_code}."
+                )
+
+            try:
+                content_length = int(response.headers["Content-Length"])
+            except (KeyError, ValueError):
+                # Неверный заголовок не учитывается: размер проверяется
+                # при чтении ответа
+                content_length = None
+            if content_length is not None and content_length < 0:
+                content_length = None
+            if content_length and content_length > self.max_size:
+                raise ImportDataError(self._too_large_message())
+
+            progress.start("fetch", content_length)
+            file = SpooledTemporaryFile(max_size=settings.IMPORT_SPOOL_MAX_SIZE)
+            digest = sha256()
+            size = 0
+            try:
+                for chunk in response.iter_content(
+                    chunk_size=settings.IMPORT_CHUNK_BYTES
+                ):
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise ImportDataError(self._too_large_message())
+                    if monotonic() - started_at > settings.IMPORT_FETCH_MAX_DURATION:
+                        raise ImportDataError(
+                            "Превышено время загрузки прайс-листа "
+                            f"{settings.IMPORT_FETCH_MAX_DURATION} с."
+                        )
+                    digest.update(chunk)
+                    file.write(chunk)
+                    progress.advance(len(chunk))
+            except Exception:
+                file.close()
+                raise
+            file.seek(0)
+
+        download.file = file
+        download.content_hash = digest.hexdigest()
+        download.metrics["bytes"] = size
+        return download
+
+    @staticmethod
+    def _too_large_message():
+        return (
+            "Размер прайс-листа превышает " f"{settings.IMPORT_FETCH_MAX_SIZE_MB} МБ."
+        )
@@ -1,11 +1,19 @@
+import re
+
 import django_filters
+from django.db import connection
+from django.db.models import Count, Q
 
-from backend.models import Product
+from backend.importer import parameter_names
+from backend.models import Product, ProductParameter
+from backend.search import search_products
+from backend.utils import parse_numeric_value
+from retail_order_api import settings
 
 
 class ProductFilter(django_filters.FilterSet):
     product = django_filters.CharFilter(
-        field_name="name", lookup_expr="icontains", label="Название продукта"
+        method="search_product", label="Название продукта"
     )
     category = django_filters.CharFilter(
         field_name="category__name", lookup_expr="icontains", label="Название категории"
@@ -14,3 +22,100 @@ class ProductFilter(django_filters.FilterSet):
     class Meta:
         model = Product
         fields = ["product", "category"]
+
+    def search_product(self, queryset, name, value):
+        """Поиск по названию продукта с сортировкой по релевантности."""
+        return search_products(queryset, value)
+
+
+PARAMETER_FILTER_PATTERN = re.compile(r"^param\[([^\]]+)\](?:\[(min|max)\])?$")
+PARAMETER_RANGE_LOOKUPS = {"min": "value_number__gte", "max": "value_number__lte"}
+
+
+def parse_parameter_filters(query_params):
+    """
+    Возвращает фильтры по параметрам товаров из GET-параметров в виде
+    словаря {название: {lookup: значение}}:
+    - param[<название>]=<значение> - значение параметра, повторение
+    параметра задает несколько допустимых значений;
+    - param[<название>][min]=<число>, param[<название>][max]=<число> -
+    диапазон числового значения параметра (включительно).
+    При неверном числе вызывает ValueError.
+    """
+    filters = {}
+    for key in query_params:
+        match = PARAMETER_FILTER_PATTERN.match(key)
+        if not match:
+            continue
+        name, bound = match.groups()
+        if bound is None:
+            values = [value for value in query_params.getlist(key) if value]
+            if values:
+                filters.setdefault(name, {})["value__in"] = values
+            continue
+        value = query_params.get(key)
+        if not value:
+            continue
+        number, unit = parse_numeric_value(value)
+        if number is None or unit:
+            raise ValueError(f"Неверное число в {key}: {value}.")
+        filters.setdefault(name, {})[PARAMETER_RANGE_LOOKUPS[bound]] = number
+    return filters
+
+
+def filter_by_parameters(queryset, filters):
+    """
+    Оставляет в queryset ProductInfo товары, параметры которых
+    соответствуют всем условиям filters (см. parse_parameter_filters).
+
+    Значения параметров проверяются по вхождению в ProductInfo.parameters
+    (GIN-индекс), если СУБД поддерживает такой поиск, иначе, как
+    и диапазоны, - подзапросом по индексу (parameter_id, value,
+    product_info_id) или (parameter_id, value_number, product_info_id)
+    без соединения таблиц.
+    """
+    if not filters:
+        return queryset
+    name_to_id = parameter_names.resolve(filters, create=False)
+    if len(name_to_id) < len(filters):
+        # Неизвестный параметр: подходящих товаров нет
+        return queryset.none()
+    contains = connection.features.supports_json_field_contains
+    for name, lookups in filters.items():
+        if contains and "value__in" in lookups:
+            lookups = lookups.copy()
+            condition = Q()
+            for value in lookups.pop("value__in"):
+                condition |= Q(parameters__contains={name: value})
+            queryset = queryset.filter(condition)
+            if not lookups:
+                continue
+        queryset = queryset.filter(
+            id__in=ProductParameter.objects.filter(
+                parameter_id=name_to_id[name], **lookups
+            ).values("product_info_id")
+        )
+    return queryset
+
+
+def parameter_facets(queryset):
+    """
+    Считает товары queryset ProductInfo по значениям параметров.
+    Возвращает {название параметра: {значение: количество}}, значения
+    упорядочены по убыванию количества, не более FACETS_MAX_VALUES
+    значений для параметра.
+    """
+    rows = (
+        ProductParameter.objects.filter(
+            product_info_id__in=queryset.order_by().values("id")
+        )
+        .values("parameter_id", "parameter__name", "value")
+        .annotate(count=Count("product_info_id"))
+        .order_by("parameter__name", "-count", "value")
+    )
+    facets = {}
+    for row in rows:
+        values = facets.setdefault(row["parameter__name"], {})
+        if len(values) < settings.FACETS_MAX_VALUES:
+            values[row["value"]] = row["count"]
+    return facets
@@ -0,0 +1,1048 @@
+from decimal import Decimal
+from functools import partial
+from itertools import islice
+from threading import Lock
+from time import monotonic, time_ns
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.validators import EMPTY_VALUES
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from pytils.translit import slugify
+
+from backend.models import (
+    Category,
+    OrderItem,
+    Parameter,
+    Product,
+    ProductInfo,
+    ProductParameter,
+    Shop,
+    ShopImportState,
+)
+from backend.staging import CopyLoader
+from retail_order_api import settings
+
+
+class ImportDataError(Exception):
+    """Ошибка в данных прайс-листа, из-за которой импорт невозможен."""
+
+
+def batched(iterable, size):
+    """Разбивает итерируемый объект на списки длиной не более size."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def resolve_names(model, names, create=True):
+    """
+    Возвращает словарь {name: id} для объектов модели с указанными именами.
+
+    Недостающие объекты создаются через bulk_create, если create=True.
+    Запросы выполняются пачками по IMPORT_BATCH_SIZE имен.
+    """
+    names = set(names)
+    name_to_id = {}
+    for chunk in batched(names, settings.IMPORT_BATCH_SIZE):
+        name_to_id.update(
+            model.objects.filter(name__in=chunk).values_list("name", "id")
+        )
+
+    missing = names - name_to_id.keys()
+    if create and missing:
+        model.objects.bulk_create(
+            [model(name=name) for name in missing],
+            batch_size=settings.IMPORT_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        name_to_id.update(resolve_names(model, missing, create=False))
+    return name_to_id
+
+
+class NameCache:
+    """
+    Общий для процесса словарь {name: id} небольшой, почти неизменной
+    модели (Category, Parameter).
+
+    Имена, которых нет в словаре, находятся или создаются через
+    resolve_names и запоминаются после фиксации транзакции, чтобы
+    в словарь не попали id откатанных строк. Версия словаря хранится
+    в общем кэше Django (Redis в рабочем окружении): при переименовании
+    или удалении объектов сигналы вызывают invalidate(), и словари всех
+    процессов очищаются при следующем обращении.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.version_key = f"names:version:{model._meta.label_lower}"
+        self._lock = Lock()
+        self._version = None
+        self._name_to_id = {}
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            # Новая версия после очистки кэша отличается от прежних
+            cache.add(self.version_key, time_ns(), None)
+            version = cache.get(self.version_key)
+        return version
+
+    def invalidate(self):
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.add(self.version_key, time_ns(), None)
+
+    def resolve(self, names, create=True):
+        """Возвращает словарь {name: id}, аналогично resolve_names."""
+        names = set(names)
+        version = self.get_version()
+        with self._lock:
+            if self._version != version:
+                self._version = version
+                self._name_to_id = {}
+            name_to_id = {
+                name: self._name_to_id[name]
+                for name in names
+                if name in self._name_to_id
+            }
+
+        missing = names - name_to_id.keys()
+        if missing:
+            found = resolve_names(self.model, missing, create)
+            transaction.on_commit(partial(self._remember, version, found))
+            name_to_id.update(found)
+        return name_to_id
+
+    def _remember(self, version, name_to_id):
+        with self._lock:
+            if self._version == version:
+                self._name_to_id.update(name_to_id)
+
+
+category_names = NameCache(Category)
+parameter_names = NameCache(Parameter)
+
+
+class ImportProgress:
+    """
+    Публикация хода импорта через пользовательское состояние задачи Celery.
+
+    Состояние PROGRESS содержит этап (fetch, parse, categories, goods,
+    parameters), количество обработанных элементов, их общее количество
+    (None, если неизвестно) и скорость обработки в элементах в секунду.
+    На этапах fetch и export элементами считаются байты. Обновления отправляются
+    не чаще одного раза в IMPORT_PROGRESS_INTERVAL секунд.
+    """
+
+    state = "PROGRESS"
+
+    def __init__(self, task=None):
+        self.task = task
+        self.phase = None
+        self.done = 0
+        self.total = None
+        self.started_at = self.published_at = monotonic()
+
+    @property
+    def meta(self):
+        elapsed = monotonic() - self.started_at
+        return {
+            "phase": self.phase,
+            "done": self.done,
+            "total": self.total,
+            "items_per_second": round(self.done / elapsed, 1) if elapsed else None,
+        }
+
+    def start(self, phase, total=None):
+        """Начинает новый этап с обнулением счетчика."""
+        self.phase, self.done, self.total = phase, 0, total
+        self.started_at = monotonic()
+        self.publish(force=True)
+
+    def set_phase(self, phase):
+        """Меняет название этапа без обнуления счетчика."""
+        self.phase = phase
+        self.publish()
+
+    def advance(self, count):
+        self.done += count
+        self.publish()
+
+    def publish(self, force=False):
+        if self.task is None or not self.task.request.id:
+            return
+        now = monotonic()
+        if not force and now - self.published_at < settings.IMPORT_PROGRESS_INTERVAL:
+            return
+        self.published_at = now
+        self.task.update_state(state=self.state, meta=self.meta)
+
+
+PRODUCT_INFO_FIELDS = (
+    "product_id",
+    "model",
+    "price",
+    "price_rrp",
+    "quantity",
+    "parameters",
+)
+STAGE_FIELDS = ("external_id", *PRODUCT_INFO_FIELDS)
+PRODUCT_PARAMETER_FIELDS = ("value", "value_number", "unit")
+
+
+class CatalogWriter:
+    """
+    Пакетная запись товаров магазина в БД.
+
+    Категории, продукты и параметры сопоставляются по названию через словари
+    в памяти, недостающие записи создаются через bulk_create. Информация о
+    товарах и их параметры вставляются пачками, поэтому количество запросов
+    зависит от числа пачек, а не от числа товаров. В PostgreSQL пачки
+    загружаются через COPY во временные таблицы и переносятся в основные
+    таблицы в flush (см. CopyLoader).
+
+    Режимы:
+    - replace - товары записываются в новую версию каталога магазина
+    небольшими транзакциями, после чего activate переключает на нее
+    Shop.catalog_version одной короткой транзакцией. Старые версии удаляются
+    в фоне (collect_catalog_versions);
+    - upsert - товары активной версии сопоставляются по (shop, external_id),
+    изменяются только отличающиеся записи, удаляются только отсутствующие
+    в прайс-листе.
+    """
+
+    def __init__(
+        self,
+        shop,
+        mode=None,
+        batch_size=None,
+        category_name_to_id=None,
+        progress=None,
+        version=None,
+    ):
+        self.shop = shop
+        self.version = version
+        self.progress = progress or ImportProgress()
+        self.mode = mode or settings.IMPORT_DEFAULT_MODE
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.category_name_to_id = category_name_to_id or {}
+        self.parameter_name_to_id = {}
+        self.linked_category_ids = set()
+        self.existing = {}  # {external_id: (id, product_id, model, ...)}
+        self.seen_external_ids = set()
+        self.stats = {"inserted": 0, "updated": 0, "unchanged": 0, "removed": 0}
+        self.loader = None
+        self.validator = FieldValidator()
+
+    def start(self, external_ids=None):
+        """
+        Подготавливает товары магазина к записи.
+
+        В режиме upsert можно передать external_ids, чтобы загрузить
+        только товары, которые будут записаны (при импорте частями).
+        В режиме replace выбирается номер новой версии каталога, товары
+        незавершенных импортов удаляются.
+        """
+        products_info = ProductInfo.objects.filter(shop_id=self.shop.id)
+        if self.mode == "upsert":
+            self.version = self.shop.catalog_version
+            if CopyLoader.is_supported():
+                # Текущие товары сравниваются с прайс-листом в БД при слиянии
+                self.loader = CopyLoader(self.shop.id, self.version, self.mode)
+                return
+            products_info = products_info.filter(catalog_version=self.version)
+            if external_ids is not None:
+                products_info = products_info.filter(external_id__in=external_ids)
+            self.existing = {
+                row[1]: row
+                for row in products_info.values_list(
+                    "id", "external_id", *PRODUCT_INFO_FIELDS
+                )
+            }
+        else:
+            products_info.filter(catalog_version__gt=self.shop.catalog_version).delete()
+            self.version = self.shop.catalog_version + 1
+
+    def finish(self):
+        """
+        Удаляет товары, которых не оказалось в прайс-листе (режим upsert),
+        или переключает магазин на записанную версию каталога (режим replace).
+        """
+        copied = self.flush()
+        if self.mode != "upsert":
+            self.activate()
+            return
+        if copied:
+            return
+        stale_ids = [
+            row[0]
+            for external_id, row in self.existing.items()
+            if external_id not in self.seen_external_ids
+        ]
+        for chunk in batched(stale_ids, self.batch_size):
+            ProductInfo.objects.filter(id__in=chunk).delete()
+        self.stats["removed"] = len(stale_ids)
+
+    def flush(self):
+        """
+        Переносит загруженные через COPY товары в основные таблицы.
+        Возвращает True, если товары загружались через COPY.
+        """
+        if self.loader is None:
+            return False
+        loader, self.loader = self.loader, None
+        if self.mode == "upsert":
+            external_id = loader.duplicate_external_id()
+            if external_id is not None:
+                loader.close()
+                raise ImportDataError(f"Повторяющийся id товара {external_id}.")
+        self.progress.set_phase("merge")
+        for key, value in loader.merge().items():
+            self.stats[key] += value
+        return True
+
+    def activate(self):
+        """
+        Делает записанную версию каталога активной одной транзакцией,
+        в той же транзакции позиции корзин переносятся на товары новой версии.
+        """
+        with transaction.atomic():
+            self.stats["removed"] = ProductInfo.objects.filter(
+                shop_id=self.shop.id, catalog_version=self.shop.catalog_version
+            ).count()
+            self.shop.categories.clear()  # Удаление существующих категорий
+            self._create_category_links(self.linked_category_ids)
+            Shop.objects.filter(id=self.shop.id).update(catalog_version=self.version)
+            self.shop.catalog_version = self.version
+            move_basket_items(self.shop, self.batch_size)
+
+    def discard(self):
+        """Удаляет товары версии каталога, которая не стала активной."""
+        if self.mode == "upsert" or self.version is None:
+            return
+        self.shop.refresh_from_db(fields=["catalog_version"])
+        if self.version == self.shop.catalog_version:
+            return
+        ProductInfo.objects.filter(
+            shop_id=self.shop.id, catalog_version=self.version
+        ).delete()
+
+    def write_categories(self, categories):
+        """
+        Заменяет категории магазина категориями из прайс-листа.
+        В режиме replace связи заменяются при переключении версии каталога.
+        """
+        if self.mode == "upsert":
+            self.shop.categories.clear()  # Удаление существующих категорий
+        self.category_name_to_id = category_names.resolve(
+            self._name(Category, name) for name in categories
+        )
+        self._link_categories(self.category_name_to_id.values())
+
+    def write_goods(self, goods):
+        """Записывает товары пачками по batch_size, возвращает их количество."""
+        count = 0
+        for batch in batched(goods, self.batch_size):
+            self.progress.set_phase("goods")
+            self._write_batch(batch)
+            count += len(batch)
+            self.progress.advance(len(batch))
+        return count
+
+    def _link_categories(self, category_ids):
+        """
+        Связывает категории с магазином одним запросом. В режиме replace
+        категории запоминаются до переключения версии каталога.
+        """
+        new_ids = set(category_ids) - self.linked_category_ids
+        if not new_ids:
+            return
+        if self.mode == "upsert":
+            self._create_category_links(new_ids)
+        self.linked_category_ids |= new_ids
+
+    def _create_category_links(self, category_ids):
+        through = Category.shops.through
+        through.objects.bulk_create(
+            [through(category_id=pk, shop_id=self.shop.id) for pk in category_ids],
+            ignore_conflicts=True,
+        )
+
+    def _name(self, model, name):
+        """
+        Название категории, продукта или параметра из прайс-листа в виде,
+        в котором оно хранится в БД (например, число 2024 - строка "2024").
+        """
+        if name is None:
+            return None
+        return self.validator.validate(model, "name", name)
+
+    def _resolve_products(self, batch):
+        """Возвращает {название продукта: id}, создавая недостающие продукты."""
+        names = {
+            self._name(Product, product_data.get("name")) for product_data in batch
+        }
+        product_name_to_id = {}
+        existing_category_ids = set()
+        for chunk in batched(names, self.batch_size):
+            for name, pk, category_id in Product.objects.filter(
+                name__in=chunk
+            ).values_list("name", "id", "category_id"):
+                product_name_to_id[name] = pk
+                existing_category_ids.add(category_id)
+
+        # Связь категорий существующих продуктов с магазином
+        self._link_categories(existing_category_ids)
+
+        new_products = {}
+        for product_data in batch:
+            name = self._name(Product, product_data.get("name"))
+            if name in product_name_to_id or name in new_products:
+                continue
+            category_id = self.category_name_to_id.get(
+                self._name(Category, product_data.get("category"))
+            )
+            if name is None or category_id is None:
+                raise ImportDataError(
+                    "Не указаны название или категория товара "
+                    f"{product_data.get('id')}."
+                )
+            # bulk_create не вызывает Product.save, поэтому слаг задается здесь
+            new_products[name] = Product(
+                name=name, slug=slugify(name), category_id=category_id
+            )
+
+        if new_products:
+            Product.objects.bulk_create(
+                new_products.values(), batch_size=self.batch_size, ignore_conflicts=True
+            )
+            created = resolve_names(Product, new_products, create=False)
+            if len(created) != len(new_products):
+                raise ImportDataError(
+                    "Не удалось создать продукты: "
+                    f"{', '.join(sorted(new_products.keys() - created.keys()))}."
+                )
+            product_name_to_id.update(created)
+        return product_name_to_id
+
+    def _resolve_parameters(self, batch):
+        """Дополняет словарь параметров названиями из пачки товаров."""
+        names = {
+            self._name(Parameter, name)
+            for product_data in batch
+            for name in (product_data.get("parameters") or {})
+        }
+        missing = names - self.parameter_name_to_id.keys()
+        if missing:
+            self.parameter_name_to_id.update(parameter_names.resolve(missing))
+
+    def _build_product_info(self, product_data, product_name_to_id):
+        """
+        Создает ProductInfo по данным товара. Значения проверяются
+        валидаторами полей, ошибки вызывают ImportDataError.
+        """
+        validate = self.validator.validate
+        return ProductInfo(
+            product_id=product_name_to_id[
+                self._name(Product, product_data.get("name"))
+            ],
+            shop_id=self.shop.id,
+            external_id=validate(ProductInfo, "external_id", product_data.get("id")),
+            model=validate(ProductInfo, "model", product_data.get("model")),
+            price=validate(ProductInfo, "price", product_data.get("price")),
+            price_rrp=validate(ProductInfo, "price_rrp", product_data.get("price_rrp")),
+            quantity=validate(ProductInfo, "quantity", product_data.get("quantity")),
+            catalog_version=self.version,
+            parameters=self._parameter_map(product_data),
+        )
+
+    def _parameter_map(self, product_data):
+        """Параметры товара для ProductInfo.parameters, как в ProductParameter."""
+        return {
+            self._name(Parameter, name): self.validator.validate(
+                ProductParameter, "value", value
+            )
+            for name, value in (product_data.get("parameters") or {}).items()
+        }
+
+    def _build_parameters(self, product_info_id, product_data):
+        parameters = {}
+        for param_name, param_value in self._parameter_map(product_data).items():
+            product_parameter = ProductParameter(
+                product_info_id=product_info_id,
+                parameter_id=self.parameter_name_to_id[param_name],
+                value=param_value,
+            )
+            product_parameter.set_numeric_value()
+            parameters[product_parameter.parameter_id] = product_parameter
+        return parameters
+
+    def _write_batch(self, batch):
+        product_name_to_id = self._resolve_products(batch)
+        self._resolve_parameters(batch)
+
+        if self.loader is None and CopyLoader.is_supported():
+            self.loader = CopyLoader(self.shop.id, self.version, self.mode)
+        if self.loader is not None:
+            self._stage_batch(batch, product_name_to_id)
+            return
+
+        if self.mode == "upsert":
+            self._upsert_batch(batch, product_name_to_id)
+            return
+
+        with transaction.atomic():
+            products_info = ProductInfo.objects.bulk_create(
+                [
+                    self._build_product_info(product_data, product_name_to_id)
+                    for product_data in batch
+                ],
+                batch_size=self.batch_size,
+            )
+            self.progress.set_phase("parameters")
+            ProductParameter.objects.bulk_create(
+                [
+                    product_parameter
+                    for product_info, product_data in zip(products_info, batch)
+                    for product_parameter in self._build_parameters(
+                        product_info.id, product_data
+                    ).values()
+                ],
+                batch_size=self.batch_size,
+            )
+        self.stats["inserted"] += len(products_info)
+
+    def _stage_batch(self, batch, product_name_to_id):
+        """Копирует пачку товаров и их параметров во временные таблицы."""
+        info_rows, parameter_rows = [], []
+        for product_data in batch:
+            product_info = self._build_product_info(product_data, product_name_to_id)
+            row = [self._clean(product_info, field) for field in STAGE_FIELDS]
+            info_rows.append(row)
+            parameter_rows.extend(
+                (
+                    row[0],
+                    row[1],
+                    parameter_id,
+                    self._clean(product_parameter, "value"),
+                    product_parameter.value_number,
+                    product_parameter.unit,
+                )
+                for parameter_id, product_parameter in self._build_parameters(
+                    None, product_data
+                ).items()
+            )
+        self.loader.stage(info_rows, parameter_rows)
+
+    def _upsert_batch(self, batch, product_name_to_id):
+        """Сопоставляет пачку с текущими товарами магазина по external_id."""
+        to_create, to_update, existing_in_batch = [], [], []
+        for product_data in batch:
+            product_info = self._build_product_info(product_data, product_name_to_id)
+            external_id = self._clean(product_info, "external_id")
+            if external_id in self.seen_external_ids:
+                raise ImportDataError(f"Повторяющийся id товара {external_id}.")
+            self.seen_external_ids.add(external_id)
+
+            row = self.existing.get(external_id)
+            if row is None:
+                to_create.append((product_info, product_data))
+                continue
+            product_info.id = row[0]
+            changed = any(
+                self._clean(product_info, field) != old_value
+                for field, old_value in zip(PRODUCT_INFO_FIELDS, row[2:])
+            )
+            if changed:
+                to_update.append(product_info)
+            existing_in_batch.append((product_info, product_data, changed))
+
+        created = ProductInfo.objects.bulk_create(
+            [product_info for product_info, _ in to_create],
+            batch_size=self.batch_size,
+        )
+        if to_update:
+            ProductInfo.objects.bulk_update(
+                to_update, PRODUCT_INFO_FIELDS, batch_size=self.batch_size
+            )
+
+        # Параметры новых товаров создаются целиком, у существующих
+        # сравниваются с текущими значениями
+        self.progress.set_phase("parameters")
+        parameters_to_create = [
+            product_parameter
+            for product_info, (_, product_data) in zip(created, to_create)
+            for product_parameter in self._build_parameters(
+                product_info.id, product_data
+            ).values()
+        ]
+        parameters_to_update, parameters_to_delete = [], []
+        current_parameters = {}
+        for row in ProductParameter.objects.filter(
+            product_info_id__in=[item[0].id for item in existing_in_batch]
+        ).values_list("product_info_id", "parameter_id", "id", "value"):
+            current_parameters.setdefault(row[0], {})[row[1]] = row[2:]
+
+        for product_info, product_data, changed in existing_in_batch:
+            new = self._build_parameters(product_info.id, product_data)
+            current = current_parameters.get(product_info.id, {})
+            parameters_changed = False
+            for parameter_id, product_parameter in new.items():
+                if parameter_id not in current:
+                    parameters_to_create.append(product_parameter)
+                    parameters_changed = True
+                elif (
+                    self._clean(product_parameter, "value") != current[parameter_id][1]
+                ):
+                    product_parameter.id = current[parameter_id][0]
+                    parameters_to_update.append(product_parameter)
+                    parameters_changed = True
+            for parameter_id in current.keys() - new.keys():
+                parameters_to_delete.append(current[parameter_id][0])
+                parameters_changed = True
+
+            if changed or parameters_changed:
+                self.stats["updated"] += 1
+            else:
+                self.stats["unchanged"] += 1
+
+        ProductParameter.objects.bulk_create(
+            parameters_to_create, batch_size=self.batch_size
+        )
+        if parameters_to_update:
+            ProductParameter.objects.bulk_update(
+                parameters_to_update,
+                PRODUCT_PARAMETER_FIELDS,
+                batch_size=self.batch_size,
+            )
+        if parameters_to_delete:
+            ProductParameter.objects.filter(id__in=parameters_to_delete).delete()
+        self.stats["inserted"] += len(created)
+
+    @staticmethod
+    def _clean(instance, field_name):
+        """Приводит значение поля к типу, в котором оно хранится в БД."""
+        field = instance._meta.get_field(field_name)
+        try:
+            return field.to_python(getattr(instance, field.attname))
+        except ValidationError:
+            raise ImportDataError(
+                f"Неверное значение поля {field_name}: "
+                f"{getattr(instance, field.attname)!r}."
+            )
+
+
+def move_basket_items(shop, batch_size=None):
+    """
+    Переносит позиции корзин с товаров неактивных версий каталога магазина
+    на товары активной версии с тем же продуктом и external_id.
+    Позиции без такого товара остаются на старом товаре.
+    Возвращает количество перенесенных позиций.
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    baskets = OrderItem.objects.filter(
+        order__state="basket", product_info__shop_id=shop.id
+    )
+    old_items = list(
+        baskets.filter(
+            product_info__catalog_version__lt=shop.catalog_version
+        ).values_list(
+            "id", "order_id", "product_info__product_id", "product_info__external_id"
+        )
+    )
+    if not old_items:
+        return 0
+
+    # Товары активной версии читаются только для продуктов из корзин
+    active = ProductInfo.objects.filter(
+        shop_id=shop.id, catalog_version=shop.catalog_version
+    )
+    keys = {(product_id, external_id) for _, _, product_id, external_id in old_items}
+    active_ids = {}
+    for chunk in batched(keys, batch_size):
+        for pk, product_id, external_id in active.filter(
+            product_id__in={product_id for product_id, _ in chunk},
+            external_id__in={external_id for _, external_id in chunk},
+        ).values_list("id", "product_id", "external_id"):
+            active_ids[(product_id, external_id)] = pk
+
+    taken = set(
+        baskets.filter(
+            product_info__catalog_version=shop.catalog_version,
+            order_id__in={order_id for _, order_id, _, _ in old_items},
+        ).values_list("order_id", "product_info_id")
+    )
+    moved_items = []
+    for item_id, order_id, product_id, external_id in old_items:
+        product_info_id = active_ids.get((product_id, external_id))
+        if product_info_id is None or (order_id, product_info_id) in taken:
+            continue
+        taken.add((order_id, product_info_id))
+        moved_items.append(OrderItem(id=item_id, product_info_id=product_info_id))
+    OrderItem.objects.bulk_update(moved_items, ["product_info"], batch_size=batch_size)
+    return len(moved_items)
+
+
+def collect_catalog_versions(shop, batch_size=None):
+    """
+    Удаляет товары неактивных версий каталога магазина.
+
+    Позиции корзин переносятся на товары активной версии (move_basket_items),
+    позиции без такого товара удаляются вместе со старым товаром. Товары из
+    оформленных заказов сохраняются для истории заказов.
+    Возвращает количество удаленных товаров.
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    move_basket_items(shop, batch_size)
+    old_products_info = ProductInfo.objects.filter(
+        shop_id=shop.id, catalog_version__lt=shop.catalog_version
+    )
+
+    ordered_ids = set(
+        OrderItem.objects.filter(product_info__in=old_products_info)
+        .exclude(order__state="basket")
+        .values_list("product_info_id", flat=True)
+    )
+    stale_ids = [
+        pk
+        for pk in old_products_info.values_list("id", flat=True)
+        if pk not in ordered_ids
+    ]
+    for chunk in batched(stale_ids, batch_size):
+        ProductInfo.objects.filter(id__in=chunk).delete()
+    return len(stale_ids)
+
+
+class FieldValidator:
+    """
+    Проверка значений валидаторами полей моделей.
+
+    В отличие от Field.clean поле и его валидаторы определяются один раз
+    для всех проверяемых значений.
+    """
+
+    def __init__(self):
+        self._fields = {}  # {(модель, поле): (to_python, валидаторы, blank)}
+
+    def validate(self, model, field_name, value):
+        """Возвращает приведенное значение или вызывает ImportDataError."""
+        key = (model, field_name)
+        if key not in self._fields:
+            field = model._meta.get_field(field_name)
+            self._fields[key] = (field.to_python, field.validators, field.blank)
+        to_python, validators, blank = self._fields[key]
+        try:
+            value = to_python(value)
+            if value in EMPTY_VALUES:
+                if not blank:
+                    raise ValidationError("Обязательное поле.")
+                return value
+            for validator in validators:
+                validator(value)
+        except ValidationError as error:
+            raise ImportDataError(
+                f"Неверное значение поля {field_name}: {value!r}. "
+                f"{' '.join(error.messages)}"
+            )
+        return value
+
+
+DIFF_FIELDS = ("name", "model", "price", "price_rrp", "quantity")
+
+
+class CatalogDiff:
+    """
+    Сравнение прайс-листа с текущими товарами магазина без записи в БД.
+
+    Текущие товары и их параметры загружаются двумя запросами в словари по
+    external_id, новые, удаленные и общие товары определяются операциями над
+    множествами ключей. Товары проверяются валидаторами полей моделей,
+    ошибки собираются в список errors, а не прерывают проверку.
+    """
+
+    summary_keys = {"insert": "inserted", "update": "updated", "delete": "removed"}
+
+    def __init__(self, shop=None, progress=None):
+        self.shop = shop
+        self.progress = progress or ImportProgress()
+        self.errors = []
+        self.validator = FieldValidator()
+        self.summary = {
+            "inserted": 0,
+            "updated": 0,
+            "unchanged": 0,
+            "removed": 0,
+            "errors": 0,
+        }
+
+    def compute(self, categories, goods):
+        """Возвращает список изменений, отсортированный по id товара."""
+        current = self._load_current()
+        incoming = self._load_incoming(goods)
+        self._check_categories(categories, incoming, current)
+
+        inserted = incoming.keys() - current.keys()
+        removed = current.keys() - incoming.keys()
+        changes = []
+        for external_id in sorted(incoming.keys() | current.keys()):
+            if external_id in inserted:
+                action, fields = "insert", self._compare({}, incoming[external_id])
+            elif external_id in removed:
+                action, fields = "delete", {}
+            else:
+                fields = self._compare(current[external_id], incoming[external_id])
+                action = "update" if fields else None
+            if action is None:
+                self.summary["unchanged"] += 1
+                continue
+            self.summary[self.summary_keys[action]] += 1
+            record = incoming.get(external_id) or current[external_id]
+            changes.append(
+                {
+                    "id": external_id,
+                    "action": action,
+                    "name": record["name"],
+                    "fields": fields,
+                }
+            )
+        self.summary["errors"] = len(self.errors)
+        return changes
+
+    def _load_current(self):
+        """Загружает товары магазина в словарь {external_id: данные товара}."""
+        if self.shop is None:
+            return {}
+        current = {
+            row[0]: {**dict(zip(DIFF_FIELDS, row[1:])), "parameters": {}}
+            for row in ProductInfo.objects.filter(
+                shop_id=self.shop.id, catalog_version=self.shop.catalog_version
+            ).values_list("external_id", "product__name", *DIFF_FIELDS[1:])
+        }
+        for external_id, name, value in ProductParameter.objects.filter(
+            product_info__shop_id=self.shop.id,
+            product_info__catalog_version=self.shop.catalog_version,
+        ).values_list("product_info__external_id", "parameter__name", "value"):
+            if external_id in current:
+                current[external_id]["parameters"][name] = value
+        return current
+
+    def _load_incoming(self, goods):
+        """Проверяет товары прайс-листа и приводит их значения к типам БД."""
+        incoming = {}
+        self.progress.start("diff")
+        for batch in batched(goods, settings.IMPORT_BATCH_SIZE):
+            for product_data in batch:
+                try:
+                    record = self._validate_item(product_data)
+                except ImportDataError as error:
+                    self._add_error(product_data, error)
+                    continue
+                if record["id"] in incoming:
+                    self._add_error(
+                        product_data,
+                        ImportDataError(f"Повторяющийся id товара {record['id']}."),
+                    )
+                    continue
+                incoming[record["id"]] = record
+            self.progress.advance(len(batch))
+        return incoming
+
+    def _check_categories(self, categories, incoming, current):
+        """
+        Проверяет, что для продуктов, которых еще нет в БД,
+        указана категория из списка категорий прайс-листа.
+        """
+        known_names = {record["name"] for record in current.values()}
+        names = {record["name"] for record in incoming.values()} - known_names
+        known_names |= resolve_names(Product, names, create=False).keys()
+        categories = set(categories)
+        for external_id, record in list(incoming.items()):
+            if record["name"] in known_names or record["category"] in categories:
+                continue
+            self._add_error(
+                {"id": external_id},
+                ImportDataError(f"Неизвестная категория {record['category']!r}."),
+            )
+            del incoming[external_id]
+
+    def _validate_item(self, product_data):
+        if not isinstance(product_data, dict):
+            raise ImportDataError("Товар должен быть объектом.")
+        record = {
+            "id": self.validator.validate(
+                ProductInfo, "external_id", product_data.get("id")
+            ),
+            "name": self.validator.validate(Product, "name", product_data.get("name")),
+            "category": product_data.get("category"),
+            "parameters": {},
+        }
+        for field in DIFF_FIELDS[1:]:
+            record[field] = self.validator.validate(
+                ProductInfo, field, product_data.get(field)
+            )
+        parameters = product_data.get("parameters") or {}
+        if not isinstance(parameters, dict):
+            raise ImportDataError("Параметры товара должны быть объектом.")
+        for name, value in parameters.items():
+            name = self.validator.validate(Parameter, "name", name)
+            record["parameters"][name] = self.validator.validate(
+                ProductParameter, "value", value
+            )
+        return record
+
+    def _add_error(self, product_data, error):
+        external_id = product_data.get("id") if isinstance(product_data, dict) else None
+        self.errors.append({"id": external_id, "error": str(error)})
+
+    @classmethod
+    def _compare(cls, old, new):
+        """Возвращает {поле: {"old": ..., "new": ...}} для отличающихся полей."""
+        fields = {
+            field: {
+                "old": cls._json_value(old.get(field)),
+                "new": cls._json_value(new[field]),
+            }
+            for field in DIFF_FIELDS
+            if old.get(field) != new[field]
+        }
+        old_parameters = old.get("parameters", {})
+        new_parameters = new["parameters"]
+        parameters = {
+            name: {
+                "old": old_parameters.get(name),
+                "new": new_parameters.get(name),
+            }
+            for name in old_parameters.keys() | new_parameters.keys()
+            if old_parameters.get(name) != new_parameters.get(name)
+        }
+        if parameters:
+            fields["parameters"] = parameters
+        return fields
+
+    @staticmethod
+    def _json_value(value):
+        return str(value) if isinstance(value, Decimal) else value
+
+
+STOCK_FIELDS = ("quantity", "price", "price_rrp")
+
+
+class StockUpdater:
+    """
+    Изменение остатков и цен товаров активной версии каталога магазина
+    без полного импорта прайс-листа.
+
+    Записи {"external_id": ..., "quantity": ..., "price": ..., "price_rrp": ...}
+    (поля, кроме external_id, необязательны) проверяются валидаторами полей
+    ProductInfo и применяются пачками по batch_size: на пачку выполняются
+    один SELECT ... FOR UPDATE по (магазин, external_id) и один UPDATE
+    с CASE по id товара. Для каждой записи возвращается результат со статусом
+    updated, unchanged, not_found или error.
+    """
+
+    def __init__(self, shop, batch_size=None):
+        self.shop = shop
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.validator = FieldValidator()
+        self.summary = {"updated": 0, "unchanged": 0, "not_found": 0, "errors": 0}
+
+    def apply(self, records):
+        """Применяет записи и возвращает список результатов в порядке записей."""
+        results = [None] * len(records)
+        valid = {}  # {external_id: (номер записи, {поле: значение})}
+        for index, record in enumerate(records):
+            try:
+                external_id, values = self._validate_record(record)
+                if external_id in valid:
+                    raise ImportDataError(f"Повторяющийся id товара {external_id}.")
+            except ImportDataError as error:
+                external_id = (
+                    record.get("external_id") if isinstance(record, dict) else None
+                )
+                results[index] = self._result(external_id, "error", error=str(error))
+                continue
+            valid[external_id] = (index, values)
+
+        for batch in batched(valid.items(), self.batch_size):
+            with transaction.atomic():
+                self._apply_batch(batch, results)
+
+        if self.summary["updated"]:
+            # Следующий импорт не должен пропускаться как неизмененный
+            ShopImportState.objects.filter(shop=self.shop).update(
+                etag="", last_modified="", content_hash=""
+            )
+            self.shop.touch_catalog()
+        return results
+
+    def _validate_record(self, record):
+        if not isinstance(record, dict):
+            raise ImportDataError("Запись должна быть объектом.")
+        external_id = self.validator.validate(
+            ProductInfo, "external_id", record.get("external_id")
+        )
+        values = {
+            field: self.validator.validate(ProductInfo, field, record[field])
+            for field in STOCK_FIELDS
+            if field in record
+        }
+        if not values:
+            raise ImportDataError(
+                f"Не указано ни одно из полей: {', '.join(STOCK_FIELDS)}."
+            )
+        return external_id, values
+
+    def _apply_batch(self, batch, results):
+        rows = {
+            row["external_id"]: row
+            for row in ProductInfo.objects.select_for_update()
+            .filter(
+                shop=self.shop,
+                catalog_version=self.shop.catalog_version,
+                external_id__in=[external_id for external_id, _ in batch],
+            )
+            .values("id", "external_id", *STOCK_FIELDS)
+        }
+        changed = {}  # {id: {поле: значение}}
+        for external_id, (index, values) in batch:
+            row = rows.get(external_id)
+            if row is None:
+                results[index] = self._result(external_id, "not_found")
+                continue
+            values = {
+                field: value for field, value in values.items() if row[field] != value
+            }
+            if values:
+                changed[row["id"]] = values
+                results[index] = self._result(external_id, "updated", fields=values)
+            else:
+                results[index] = self._result(external_id, "unchanged")
+
+        fields = {field for values in changed.values() for field in values}
+        if changed:
+            ProductInfo.objects.filter(id__in=changed).update(
+                **{
+                    field: Case(
+                        *[
+                            When(id=pk, then=Value(values[field]))
+                            for pk, values in changed.items()
+                            if field in values
+                        ],
+                        default=F(field),
+                        output_field=ProductInfo._meta.get_field(field),
+                    )
+                    for field in fields
+                }
+            )
+
+    def _result(self, external_id, status, error=None, fields=None):
+        self.summary["errors" if status == "error" else status] += 1
+        result = {"external_id": external_id, "status": status}
+        if error is not None:
+            result["error"] = error
+        if fields is not None:
+            result["fields"] = sorted(fields)
+        return result
@@ -0,0 +1,132 @@
+import threading
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+from retail_order_api import settings
+
+# Время жизни мьютекса передачи блокировки, с. Операции под мьютексом -
+# несколько обращений к кэшу, таймаут нужен только при падении процесса
+MUTEX_TIMEOUT = 10
+
+# Мьютекс для кэшей без общего хранилища (LocMemCache): кэш и блокировка
+# действуют в пределах процесса
+_local_mutex = threading.Lock()
+
+
+class ImportLock:
+    """
+    Блокировка импорта товаров магазина в общем кэше.
+
+    Ключ lock хранит выполняющийся импорт, ключ pending - единственный
+    отложенный импорт, который запускается после завершения текущего.
+    Записи имеют вид {"task_id": ..., "params": {...}}, где params -
+    аргументы задачи do_import_celery. Блокировка снимается автоматически
+    через IMPORT_LOCK_TIMEOUT секунд, если задача завершилась аварийно.
+
+    Постановка в очередь (enqueue, set_pending) и снятие блокировки (release)
+    читают и меняют оба ключа, поэтому выполняются под общим мьютексом
+    магазина: иначе отложенный импорт, записанный между чтением pending и
+    удалением lock в release, теряется.
+    """
+
+    def __init__(self, user_id):
+        self.lock_key = f"import:lock:{user_id}"
+        self.pending_key = f"import:pending:{user_id}"
+        self.mutex_key = f"import:mutex:{user_id}"
+
+    @property
+    def current(self):
+        return cache.get(self.lock_key)
+
+    @property
+    def pending(self):
+        return cache.get(self.pending_key)
+
+    @contextmanager
+    def mutex(self):
+        """
+        Мьютекс магазина: блокировка Redis для RedisCache, блокировка
+        процесса для остальных кэшей.
+        """
+        backend = getattr(cache, "_cache", None)
+        if hasattr(backend, "get_client"):
+            key = cache.make_and_validate_key(self.mutex_key)
+            client = backend.get_client(key, write=True)
+            with client.lock(key, timeout=MUTEX_TIMEOUT):
+                yield
+        else:
+            with _local_mutex:
+                yield
+
+    def acquire(self, task_id, params):
+        """Захватывает блокировку, если она свободна."""
+        return cache.add(
+            self.lock_key,
+            {"task_id": task_id, "params": params},
+            settings.IMPORT_LOCK_TIMEOUT,
+        )
+
+    def claim(self, task_id, params):
+        """Проверяет, что блокировка принадлежит задаче, или захватывает ее."""
+        current = self.current
+        if current is None:
+            return self.acquire(task_id, params)
+        return current["task_id"] == task_id
+
+    def enqueue(self, task_id, params):
+        """
+        Захватывает блокировку для задачи task_id или откладывает импорт.
+
+        Возвращает (task_id, status), где status - started, joined или
+        queued (см. enqueue_import). Отложенный импорт сохраняет task_id
+        ранее отложенного запроса.
+        """
+        with self.mutex():
+            current = None
+            while current is None:
+                if self.acquire(task_id, params):
+                    return task_id, "started"
+                current = self.current  # None - блокировка снята между проверками
+            if current["params"] == params:
+                return current["task_id"], "joined"
+            pending = self.pending
+            if pending is not None:
+                task_id = pending["task_id"]
+            self._set_pending(task_id, params)
+            return task_id, "queued"
+
+    def set_pending(self, task_id, params):
+        with self.mutex():
+            self._set_pending(task_id, params)
+
+    def _set_pending(self, task_id, params):
+        cache.set(
+            self.pending_key,
+            {"task_id": task_id, "params": params},
+            settings.IMPORT_LOCK_TIMEOUT,
+        )
+
+    def release(self, task_id):
+        """
+        Снимает блокировку задачи task_id. Если есть отложенный импорт,
+        блокировка передается ему, и возвращается его запись.
+        """
+        with self.mutex():
+            current = self.current
+            if current is not None and current["task_id"] != task_id:
+                return None
+            pending = self.pending
+            if pending is None:
+                cache.delete(self.lock_key)
+                # Повторная проверка после удаления: отложенный импорт мог
+                # быть записан в обход мьютекса, например после его истечения
+                pending = self.pending
+                if pending is None or not self.acquire(
+                    pending["task_id"], pending["params"]
+                ):
+                    return None
+            else:
+                cache.set(self.lock_key, pending, settings.IMPORT_LOCK_TIMEOUT)
+            cache.delete(self.pending_key)
+            return pending
@@ -0,0 +1,285 @@
+import os
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from multiprocessing import get_context
+from shutil import copyfileobj
+from tempfile import NamedTemporaryFile
+from time import monotonic
+
+import django
+from celery import uuid
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from yaml import YAMLError, safe_load
+
+from backend.feeds import FeedCache, detect_feed_format, parse_feed_file
+from backend.locks import ImportLock
+from backend.models import CustomUser
+from backend.tasks import (
+    IMPORT_ERRORS,
+    fetch_feed,
+    import_error_result,
+    import_params,
+    release_import,
+    write_feed,
+)
+from retail_order_api import settings
+
+BATCH_IMPORT_MODES = ("replace", "upsert")
+
+
+def parse_feed(path, feed_format, content_hash, cache_directory):
+    """
+    Разбирает прайс-лист в процессе пула и сохраняет его в FeedCache.
+    Возвращает (ParsedFeed или None, длительность, результат ошибки или None).
+    """
+    started_at = monotonic()
+    try:
+        feed = parse_feed_file(path, "", feed_format=feed_format)
+    except IMPORT_ERRORS as error:
+        return None, monotonic() - started_at, import_error_result(error)
+    cache = FeedCache(cache_directory)
+    if cache.enabled and os.path.getsize(path) <= cache.max_feed_size:
+        cache.put(content_hash, feed_format, feed)
+    return feed, monotonic() - started_at, None
+
+
+class ShopJob:
+    """Импорт одного магазина из манифеста."""
+
+    def __init__(self, user, url, mode=None, feed_format=None):
+        self.user = user
+        self.url = url
+        self.mode = mode
+        self.feed_format = feed_format
+        self.lock_task_id = f"import_shops-{uuid()}"
+        self.path = None
+        self.download = None
+        self.goods = 0
+        self.timings = {"fetch": 0, "parse": 0, "write": 0}
+        self.result = None
+
+    @property
+    def params(self):
+        return import_params(self.url, self.user.id, self.mode, False, self.feed_format)
+
+
+class Command(BaseCommand):
+    help = (
+        "Пакетный импорт прайс-листов магазинов по манифесту. "
+        "Манифест - файл YAML или JSON со списком записей "
+        "{user: email или id пользователя, url: ..., mode: replace|upsert, "
+        "feed_format: yaml|json|ndjson|csv}. Прайс-листы загружаются "
+        "параллельно, разбираются в пуле процессов и записываются в базу "
+        "данных ограниченным числом потоков."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("manifest", help="Путь к файлу манифеста")
+        parser.add_argument(
+            "--fetch-workers",
+            type=int,
+            default=settings.IMPORT_BATCH_FETCH_WORKERS,
+            help="Количество параллельных загрузок",
+        )
+        parser.add_argument(
+            "--parse-workers",
+            type=int,
+            default=settings.IMPORT_BATCH_PARSE_WORKERS,
+            help="Количество процессов разбора (по умолчанию - по числу CPU)",
+        )
+        parser.add_argument(
+            "--db-workers",
+            type=int,
+            default=settings.IMPORT_BATCH_DB_WORKERS,
+            help="Количество параллельных записей в базу данных",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Импортировать прайс-листы, даже если они не изменились",
+        )
+
+    def handle(self, *args, **options):
+        jobs = self.load_manifest(options["manifest"])
+        self.force = options["force"]
+        self.cache = cache = FeedCache()
+        started_at = monotonic()
+
+        fetch_pool = ThreadPoolExecutor(options["fetch_workers"])
+        db_pool = ThreadPoolExecutor(options["db_workers"])
+        parse_pool = ProcessPoolExecutor(
+            options["parse_workers"],
+            # fork небезопасен при открытых соединениях и потоках
+            mp_context=get_context("spawn"),
+            initializer=django.setup,
+        )
+        with fetch_pool, parse_pool, db_pool:
+            pending = {}
+            for job in jobs:
+                if ImportLock(job.user.id).acquire(job.lock_task_id, job.params):
+                    pending[fetch_pool.submit(self.fetch, job)] = ("fetch", job)
+                else:
+                    job.result = {
+                        "Status": False,
+                        "Errors": "Импорт магазина уже выполняется.",
+                    }
+                    self.report(job)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, job = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as error:
+                        self.finish(job, {"Status": False, "Errors": str(error)})
+                        continue
+
+                    if stage == "fetch" and job.result is not None:
+                        self.finish(job)
+                        continue
+                    if stage == "fetch" and result is None:
+                        pending[
+                            parse_pool.submit(
+                                parse_feed,
+                                job.path,
+                                job.feed_format,
+                                job.download.content_hash,
+                                cache.directory if cache.enabled else "",
+                            )
+                        ] = ("parse", job)
+                    elif stage in ("fetch", "parse"):
+                        if stage == "fetch":
+                            feed = result  # Прайс-лист из кэша
+                        else:
+                            feed, job.timings["parse"], error = result
+                            if error is not None:
+                                self.finish(job, error)
+                                continue
+                        job.goods = len(feed)
+                        pending[db_pool.submit(self.write, job, feed)] = ("write", job)
+                    else:
+                        self.finish(job, result)
+
+        self.report_total(jobs, monotonic() - started_at)
+
+    def load_manifest(self, path):
+        try:
+            with open(path, "rb") as file:
+                entries = safe_load(file)
+        except (OSError, YAMLError) as error:
+            raise CommandError(f"Ошибка чтения манифеста: {error}")
+        if not isinstance(entries, list):
+            raise CommandError("Манифест должен содержать список магазинов.")
+
+        jobs = []
+        for number, entry in enumerate(entries, 1):
+            if (
+                not isinstance(entry, dict)
+                or not entry.get("user")
+                or not entry.get("url")
+            ):
+                raise CommandError(f"Запись {number}: не указаны user и url.")
+            user = CustomUser.objects.filter(
+                **(
+                    {"id": entry["user"]}
+                    if str(entry["user"]).isdigit()
+                    else {"email": entry["user"]}
+                ),
+                type="shop",
+            ).first()
+            if user is None:
+                raise CommandError(
+                    f"Запись {number}: пользователь-магазин {entry['user']} не найден."
+                )
+            mode = entry.get("mode") or settings.IMPORT_DEFAULT_MODE
+            if mode not in BATCH_IMPORT_MODES:
+                raise CommandError(f"Запись {number}: неверный режим {mode}.")
+            jobs.append(ShopJob(user, entry["url"], mode, entry.get("feed_format")))
+        return jobs
+
+    def fetch(self, job):
+        """
+        Загружает прайс-лист. Возвращает ParsedFeed, если прайс-лист
+        есть в кэше, иначе сохраняет его во временный файл для разбора.
+        """
+        started_at = monotonic()
+        try:
+            download, unchanged = fetch_feed(job.url, job.user.id, self.force)
+            job.download = download
+            if unchanged:
+                job.result = {
+                    "Status": True,
+                    "Message": "Прайс-лист не изменился.",
+                    "Unchanged": True,
+                }
+                return None
+            job.feed_format = job.feed_format or detect_feed_format(
+                job.url, download.content_type
+            )
+            if self.cache.enabled:
+                feed = self.cache.get(download.content_hash, job.feed_format)
+                if feed is not None:
+                    download.close()
+                    return feed
+            with download.file, NamedTemporaryFile(delete=False) as file:
+                copyfileobj(download.file, file)
+                job.path = file.name
+        except IMPORT_ERRORS as error:
+            job.result = import_error_result(error)
+        finally:
+            job.timings["fetch"] = monotonic() - started_at
+            connections.close_all()
+
+    def write(self, job, feed):
+        started_at = monotonic()
+        try:
+            return write_feed(
+                feed, job.url, job.user.id, job.download.fingerprint, job.mode
+            )
+        finally:
+            job.timings["write"] = monotonic() - started_at
+            connections.close_all()
+
+    def finish(self, job, result=None):
+        """Завершает импорт магазина: удаляет файл и снимает блокировку."""
+        if result is not None:
+            job.result = result
+        if job.path is not None:
+            os.remove(job.path)
+            job.path = None
+        release_import(job.user.id, job.lock_task_id)
+        self.report(job)
+
+    def report(self, job):
+        result = job.result
+        message = result.get("Message") if result["Status"] else result["Errors"]
+        timings = ", ".join(
+            f"{stage} {seconds:.2f} с" for stage, seconds in job.timings.items()
+        )
+        line = (
+            f"{job.user.email} {job.url}: {message} "
+            f"Товаров: {job.goods}; {timings}."
+        )
+        self.stdout.write(
+            self.style.SUCCESS(line) if result["Status"] else self.style.ERROR(line)
+        )
+
+    def report_total(self, jobs, duration):
+        imported = [job for job in jobs if job.result["Status"]]
+        goods = sum(job.goods for job in imported)
+        size = sum(
+            job.download.metrics["bytes"] for job in jobs if job.download is not None
+        )
+        duration = max(duration, 1e-6)
+        self.stdout.write(
+            f"Итого: магазинов {len(imported)} из {len(jobs)}, "
+            f"товаров {goods} за {duration:.2f} с "
+            f"({goods / duration:.0f} товаров/с, "
+            f"{size / 1024 / 1024 / duration:.2f} МБ/с)."
+        )
@@ -0,0 +1,66 @@
+# Generated by Django 5.0.3 on 2026-10-16 23:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ShopImportState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("url", models.URLField(verbose_name="Ссылка на прайс-лист")),
+                (
+                    "etag",
+                    models.CharField(blank=True, max_length=255, verbose_name="ETag"),
+                ),
+                (
+                    "last_modified",
+                    models.CharField(
+                        blank=True, max_length=64, verbose_name="Last-Modified"
+                    ),
+                ),
+                (
+                    "content_hash",
+                    models.CharField(
+                        blank=True,
+                        max_length=64,
+                        verbose_name="Хэш содержимого (SHA-256)",
+                    ),
+                ),
+                (
+                    "imported_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Дата и время импорта"
+                    ),
+                ),
+                (
+                    "shop",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="import_state",
+                        to="backend.shop",
+                        verbose_name="Магазин",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Состояние импорта магазина",
+                "verbose_name_plural": "Список состояний импорта магазинов",
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.3 on 2026-10-16 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend", "0002_shopimportstate"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="productinfo",
+            name="unique_product_info",
+        ),
+        migrations.AddField(
+            model_name="productinfo",
+            name="catalog_version",
+            field=models.PositiveIntegerField(
+                default=0, verbose_name="Версия каталога"
+            ),
+        ),
+        migrations.AddField(
+            model_name="shop",
+            name="catalog_version",
+            field=models.PositiveIntegerField(
+                default=0, verbose_name="Активная версия каталога"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="productinfo",
+            index=models.Index(
+                fields=["shop", "catalog_version"], name="product_info_version_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="productinfo",
+            constraint=models.UniqueConstraint(
+                fields=("product", "shop", "external_id", "catalog_version"),
+                name="unique_product_info",
+            ),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.0.3 on 2026-10-16 23:57
+
+from django.db import migrations, models
+
+
+def create_import_states(apps, schema_editor):
+    """
+    Состояния импорта для магазинов с прайс-листом, которые еще не
+    импортировались, чтобы они попали в импорт по расписанию.
+    """
+    shop = apps.get_model("backend", "Shop")
+    shop_import_state = apps.get_model("backend", "ShopImportState")
+    shop_import_state.objects.bulk_create(
+        shop_import_state(shop_id=shop_id, url=url)
+        for shop_id, url in shop.objects.filter(
+            url__isnull=False, import_state__isnull=True
+        )
+        .exclude(url="")
+        .values_list("id", "url")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend", "0003_catalog_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="shopimportstate",
+            name="failures",
+            field=models.PositiveIntegerField(
+                default=0, verbose_name="Ошибок импорта подряд"
+            ),
+        ),
+        migrations.AddField(
+            model_name="shopimportstate",
+            name="last_error",
+            field=models.TextField(blank=True, verbose_name="Последняя ошибка импорта"),
+        ),
+        migrations.AddField(
+            model_name="shopimportstate",
+            name="next_import_at",
+            field=models.DateTimeField(
+                blank=True,
+                db_index=True,
+                null=True,
+                verbose_name="Следующий импорт по расписанию",
+            ),
+        ),
+        migrations.AddField(
+            model_name="shopimportstate",
+            name="refresh_interval",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Пусто - интервал по умолчанию, 0 - без обновления по расписанию",
+                null=True,
+                verbose_name="Интервал обновления, мин",
+            ),
+        ),
+        migrations.AddField(
+            model_name="shopimportstate",
+            name="scheduled_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Импорт по расписанию запущен"
+            ),
+        ),
+        migrations.RunPython(create_import_states, migrations.RunPython.noop),
+    ]
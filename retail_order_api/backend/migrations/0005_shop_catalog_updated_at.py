@@ -0,0 +1,20 @@
+# Generated by Django 5.0.3 on 2026-10-17 00:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend", "0004_shop_import_schedule"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="shop",
+            name="catalog_updated_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Дата и время изменения каталога"
+            ),
+        ),
+    ]
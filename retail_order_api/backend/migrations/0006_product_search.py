@@ -0,0 +1,114 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector
+from django.db import OperationalError, migrations, models
+from django.db.models.functions import Cast, Upper
+
+FTS_TABLE = "backend_product_fts"
+
+
+def postgresql_indexes(apps):
+    """GIN-индексы для поиска по названиям продуктов и категорий."""
+    product = apps.get_model("backend", "Product")
+    category = apps.get_model("backend", "Category")
+    indexes = [
+        (
+            product,
+            GinIndex(
+                SearchVector("name", config="russian"),
+                name="product_name_search_idx",
+            ),
+        )
+    ]
+    for model, prefix in ((product, "product"), (category, "category")):
+        indexes += [
+            # Поиск подстроки: icontains в PostgreSQL - UPPER(name) LIKE
+            (
+                model,
+                GinIndex(
+                    OpClass(
+                        Upper(Cast("name", models.TextField())), name="gin_trgm_ops"
+                    ),
+                    name=f"{prefix}_name_upper_trgm_idx",
+                ),
+            ),
+            # Поиск похожих слов (trigram_word_similar)
+            (
+                model,
+                GinIndex(
+                    OpClass("name", name="gin_trgm_ops"),
+                    name=f"{prefix}_name_trgm_idx",
+                ),
+            ),
+        ]
+    return indexes
+
+
+def has_trigram(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def create_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        # Без pg_trgm поиск работает только по tsvector и подстроке
+        trigram = has_trigram(schema_editor)
+        if trigram:
+            schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for model, index in postgresql_indexes(apps):
+            if trigram or "trgm" not in index.name:
+                schema_editor.add_index(model, index)
+    elif vendor == "sqlite":
+        # Таблица FTS5 с внешним содержимым хранит только индекс названий.
+        # Без FTS5 или токенизатора trigram (SQLite < 3.34) поиск работает
+        # по подстроке
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                "name, content='backend_product', content_rowid='id', "
+                "tokenize='trigram')"
+            )
+        except OperationalError:
+            return
+        schema_editor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON backend_product "
+            f"BEGIN INSERT INTO {FTS_TABLE} (rowid, name) "
+            "VALUES (new.id, new.name); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON backend_product "
+            f"BEGIN INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name) "
+            "VALUES ('delete', old.id, old.name); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF name "
+            f"ON backend_product BEGIN INSERT INTO {FTS_TABLE} "
+            f"({FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name); "
+            f"INSERT INTO {FTS_TABLE} (rowid, name) VALUES (new.id, new.name); END"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"
+        )
+
+
+def drop_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        for model, index in postgresql_indexes(apps):
+            schema_editor.execute(f"DROP INDEX IF EXISTS {index.name}")
+    elif vendor == "sqlite":
+        for trigger in ("insert", "delete", "update"):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend", "0005_shop_catalog_updated_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search, drop_search),
+    ]
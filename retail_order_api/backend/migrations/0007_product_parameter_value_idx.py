@@ -0,0 +1,20 @@
+# Generated by Django 5.0.3 on 2026-10-17 00:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend", "0006_product_search"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="productparameter",
+            index=models.Index(
+                fields=["parameter", "value", "product_info"],
+                name="product_parameter_value_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.0.3 on 2026-10-17 00:12
+
+import re
+from math import isfinite
+
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+# Копия backend.utils.parse_numeric_value на момент миграции: изменения
+# разбора в приложении не должны менять результат миграции
+NUMERIC_VALUE_PATTERN = re.compile(r"^([+-]?\d+(?:[.,]\d+)?)\s*([^\d\s][^\d]*)?$")
+UNIT_MAX_LENGTH = 20
+
+
+def parse_numeric_value(value):
+    match = NUMERIC_VALUE_PATTERN.match(str(value).strip())
+    if not match:
+        return None, ""
+    number = float(match.group(1).replace(",", "."))
+    unit = (match.group(2) or "").strip()
+    if not isfinite(number) or len(unit) > UNIT_MAX_LENGTH:
+        return None, ""
+    return number, unit
+
+
+def fill_numeric_values(apps, schema_editor):
+    """Разбор числовых значений уже загруженных параметров."""
+    product_parameter = apps.get_model("backend", "ProductParameter")
+    batch = []
+    for instance in product_parameter.objects.only("id", "value").iterator(
+        chunk_size=BATCH_SIZE
+    ):
+        instance.value_number, instance.unit = parse_numeric_value(instance.value)
+        if instance.value_number is not None:
+            batch.append(instance)
+        if len(batch) >= BATCH_SIZE:
+            product_parameter.objects.bulk_update(batch, ["value_number", "unit"])
+            batch = []
+    if batch:
+        product_parameter.objects.bulk_update(batch, ["value_number", "unit"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend", "0007_product_parameter_value_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="productparameter",
+            name="unit",
+            field=models.CharField(
+                blank=True,
+                default="",
+                editable=False,
+                max_length=20,
+                verbose_name="Единица измерения",
+            ),
+        ),
+        migrations.AddField(
+            model_name="productparameter",
+            name="value_number",
+            field=models.FloatField(
+                blank=True, editable=False, null=True, verbose_name="Числовое значение"
+            ),
+        ),
+        migrations.RunPython(fill_numeric_values, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="productparameter",
+            index=models.Index(
+                fields=["parameter", "value_number", "product_info"],
+                name="product_parameter_number_idx",
+            ),
+        ),
+    ]
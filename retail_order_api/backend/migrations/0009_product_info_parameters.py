@@ -0,0 +1,68 @@
+# Generated by Django 5.0.3 on 2026-10-17 00:15
+
+from itertools import groupby
+
+from django.contrib.postgres.indexes import GinIndex
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+INDEX_NAME = "product_info_parameters_idx"
+
+
+def fill_parameters(apps, schema_editor):
+    """Заполнение parameters по уже загруженным параметрам товаров."""
+    product_info = apps.get_model("backend", "ProductInfo")
+    product_parameter = apps.get_model("backend", "ProductParameter")
+    rows = (
+        product_parameter.objects.order_by("product_info_id", "id")
+        .values_list("product_info_id", "parameter__name", "value")
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    batch = []
+    for product_info_id, group in groupby(rows, key=lambda row: row[0]):
+        batch.append(
+            product_info(
+                id=product_info_id,
+                parameters={name: value for _, name, value in group},
+            )
+        )
+        if len(batch) >= BATCH_SIZE:
+            product_info.objects.bulk_update(batch, ["parameters"])
+            batch = []
+    if batch:
+        product_info.objects.bulk_update(batch, ["parameters"])
+
+
+def create_index(apps, schema_editor):
+    # Фильтрация по вхождению (@>) с GIN-индексом только в PostgreSQL
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.add_index(
+            apps.get_model("backend", "ProductInfo"),
+            GinIndex(
+                fields=["parameters"], name=INDEX_NAME, opclasses=["jsonb_path_ops"]
+            ),
+        )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend", "0008_product_parameter_number"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="productinfo",
+            name="parameters",
+            field=models.JSONField(
+                blank=True, default=dict, editable=False, verbose_name="Параметры"
+            ),
+        ),
+        migrations.RunPython(fill_parameters, migrations.RunPython.noop),
+        migrations.RunPython(create_index, drop_index),
+    ]
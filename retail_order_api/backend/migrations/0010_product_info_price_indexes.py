@@ -0,0 +1,39 @@
+# Generated by Django 5.0.3 on 2026-10-17 00:19
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backend", "0009_product_info_parameters"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="productinfo",
+            index=models.Index(
+                fields=["shop", "catalog_version", "price", "id"],
+                name="product_info_shop_price_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="productinfo",
+            index=models.Index(fields=["price", "id"], name="product_info_price_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="productinfo",
+            index=models.Index(
+                django.db.models.expressions.CombinedExpression(
+                    models.F("price_rrp"), "-", models.F("price")
+                ),
+                models.F("id"),
+                name="product_info_discount_idx",
+            ),
+        ),
+        migrations.RemoveIndex(
+            model_name="productinfo",
+            name="product_info_version_idx",
+        ),
+    ]
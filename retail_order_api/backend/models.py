@@ -5,12 +5,18 @@ from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from imagekit.models import ImageSpecField
 from imagekit.processors import Adjust, ResizeToFill, ResizeToFit
 from pytils.translit import slugify
 
-from backend.utils import RemoveAfterCloseFileProxy, get_path_upload_product_photo
+from backend.utils import (
+    UNIT_MAX_LENGTH,
+    RemoveAfterCloseFileProxy,
+    get_path_upload_product_photo,
+    parse_numeric_value,
+)
 from retail_order_api import settings
 
 
@@ -150,6 +156,12 @@ class Shop(models.Model):
     name = models.CharField(verbose_name="Название", max_length=100)
     url = models.URLField(verbose_name="Ссылка", null=True, blank=True)
     state = models.BooleanField(verbose_name="Статус получения заказов", default=True)
+    catalog_version = models.PositiveIntegerField(
+        verbose_name="Активная версия каталога", default=0
+    )
+    catalog_updated_at = models.DateTimeField(
+        verbose_name="Дата и время изменения каталога", null=True, blank=True
+    )
     user = models.OneToOneField(
         CustomUser,
         verbose_name="Пользователь",
@@ -167,6 +179,63 @@ class Shop(models.Model):
     def __str__(self):
         return self.name
 
+    def touch_catalog(self):
+        """Отмечает изменение товаров магазина, например, для выгрузок."""
+        self.catalog_updated_at = timezone.now()
+        Shop.objects.filter(id=self.id).update(
+            catalog_updated_at=self.catalog_updated_at
+        )
+
+
+class ShopImportState(models.Model):
+    """
+    Модель для хранения отпечатка последнего успешного импорта магазина.
+    """
+
+    shop = models.OneToOneField(
+        Shop,
+        verbose_name="Магазин",
+        related_name="import_state",
+        on_delete=models.CASCADE,
+    )
+    url = models.URLField(verbose_name="Ссылка на прайс-лист")
+    etag = models.CharField(verbose_name="ETag", max_length=255, blank=True)
+    last_modified = models.CharField(
+        verbose_name="Last-Modified", max_length=64, blank=True
+    )
+    content_hash = models.CharField(
+        verbose_name="Хэш содержимого (SHA-256)", max_length=64, blank=True
+    )
+    imported_at = models.DateTimeField(
+        verbose_name="Дата и время импорта", null=True, blank=True
+    )
+    refresh_interval = models.PositiveIntegerField(
+        verbose_name="Интервал обновления, мин",
+        null=True,
+        blank=True,
+        help_text="Пусто - интервал по умолчанию, 0 - без обновления по расписанию",
+    )
+    next_import_at = models.DateTimeField(
+        verbose_name="Следующий импорт по расписанию",
+        null=True,
+        blank=True,
+        db_index=True,
+    )
+    scheduled_at = models.DateTimeField(
+        verbose_name="Импорт по расписанию запущен", null=True, blank=True
+    )
+    failures = models.PositiveIntegerField(
+        verbose_name="Ошибок импорта подряд", default=0
+    )
+    last_error = models.TextField(verbose_name="Последняя ошибка импорта", blank=True)
+
+    class Meta:
+        verbose_name = "Состояние импорта магазина"
+        verbose_name_plural = "Список состояний импорта магазинов"
+
+    def __str__(self):
+        return f"Импорт {self.shop.name}"
+
 
 class Category(models.Model):
     """
@@ -287,9 +356,45 @@ class Product(models.Model):
         return self.name
 
 
+class ProductInfoQuerySet(models.QuerySet):
+    def active(self):
+        """Товары активной версии каталога своего магазина."""
+        return self.filter(catalog_version=models.F("shop__catalog_version"))
+
+    def rename_parameter(self, old_name, new_name=None):
+        """
+        Переименовывает параметр old_name в ProductInfo.parameters товаров
+        или удаляет его при new_name=None. Товары обновляются пачками
+        по IMPORT_BATCH_SIZE.
+        """
+        batch_size = settings.IMPORT_BATCH_SIZE
+        queryset = self.filter(parameters__has_key=old_name).order_by("id")
+        last_id = 0
+        while batch := list(
+            queryset.filter(id__gt=last_id).only("id", "parameters")[:batch_size]
+        ):
+            for product_info in batch:
+                product_info.parameters = {
+                    new_name if name == old_name else name: value
+                    for name, value in product_info.parameters.items()
+                    if name != old_name or new_name is not None
+                }
+            self.model.objects.bulk_update(batch, ["parameters"])
+            last_id = batch[-1].id
+
+
 class ProductInfo(models.Model):
     """
     Модель для представления информации о продукте в магазине.
+
+    Импорт записывает товары магазина в новую версию каталога
+    (catalog_version) и затем переключает на нее Shop.catalog_version,
+    поэтому покупателям показываются только товары активной версии.
+
+    parameters - копия параметров товара {название: значение} из
+    ProductParameter для вывода без соединения таблиц и фильтрации
+    по вхождению (GIN-индекс в PostgreSQL). Заполняется импортом
+    и админкой (sync_parameters).
     """
 
     model = models.CharField(
@@ -315,6 +420,14 @@ class ProductInfo(models.Model):
         related_name="product_info",
         on_delete=models.CASCADE,
     )
+    catalog_version = models.PositiveIntegerField(
+        verbose_name="Версия каталога", default=0
+    )
+    parameters = models.JSONField(
+        verbose_name="Параметры", default=dict, blank=True, editable=False
+    )
+
+    objects = ProductInfoQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Информация о продукте в магазине"
@@ -322,13 +435,38 @@ class ProductInfo(models.Model):
         ordering = ("product", "shop")
         constraints = [
             models.UniqueConstraint(
-                fields=["product", "shop", "external_id"], name="unique_product_info"
+                fields=["product", "shop", "external_id", "catalog_version"],
+                name="unique_product_info",
+            ),
+        ]
+        indexes = [
+            # Товары версии каталога магазина, отсортированные по цене.
+            # Также используется вместо индекса (shop, catalog_version)
+            models.Index(
+                fields=["shop", "catalog_version", "price", "id"],
+                name="product_info_shop_price_idx",
+            ),
+            # Сортировка по цене и скидке без фильтра по магазину
+            models.Index(fields=["price", "id"], name="product_info_price_idx"),
+            models.Index(
+                models.F("price_rrp") - models.F("price"),
+                "id",
+                name="product_info_discount_idx",
             ),
         ]
 
     def __str__(self):
         return f"{self.product.name} в {self.shop.name}"
 
+    def sync_parameters(self):
+        """Обновляет parameters по параметрам товара в ProductParameter."""
+        self.parameters = dict(
+            self.product_parameters.order_by("id").values_list(
+                "parameter__name", "value"
+            )
+        )
+        self.save(update_fields=["parameters"])
+
 
 class Parameter(models.Model):
     """
@@ -366,6 +504,16 @@ class ProductParameter(models.Model):
         on_delete=models.CASCADE,
     )
     value = models.CharField(verbose_name="Значение параметра", max_length=100)
+    value_number = models.FloatField(
+        verbose_name="Числовое значение", null=True, blank=True, editable=False
+    )
+    unit = models.CharField(
+        verbose_name="Единица измерения",
+        max_length=UNIT_MAX_LENGTH,
+        blank=True,
+        default="",
+        editable=False,
+    )
 
     class Meta:
         verbose_name = "Параметр продукта"
@@ -375,6 +523,28 @@ class ProductParameter(models.Model):
                 fields=["product_info", "parameter"], name="unique_product_parameter"
             )
         ]
+        indexes = [
+            # Фильтры и фасеты по значениям параметров
+            models.Index(
+                fields=["parameter", "value", "product_info"],
+                name="product_parameter_value_idx",
+            ),
+            # Фильтры по диапазону числовых значений
+            models.Index(
+                fields=["parameter", "value_number", "product_info"],
+                name="product_parameter_number_idx",
+            ),
+        ]
+
+    def set_numeric_value(self):
+        """Заполняет value_number и unit по строковому значению."""
+        self.value_number, self.unit = parse_numeric_value(self.value)
+
+    def save(self, *args, update_fields=None, **kwargs):
+        self.set_numeric_value()
+        if update_fields is not None and "value" in update_fields:
+            update_fields = {*update_fields, "value_number", "unit"}
+        super().save(*args, update_fields=update_fields, **kwargs)
 
     def __str__(self):
         return f"{self.product_info.product.name} - {self.parameter.name}: {self.value}"
@@ -1,25 +1,216 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
 
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from ujson import loads as load_json
 
-class ShopPagination(PageNumberPagination):
+
+class KeysetPagination(BasePagination):
+    """
+    Постраничный вывод по ключу сортировки (keyset, seek) без COUNT и OFFSET.
+
+    Порядок берется из order_by queryset (или Meta.ordering модели)
+    и дополняется id для однозначности. Курсор следующей страницы
+    содержит значения ключа последней строки страницы, поэтому
+    следующая страница читается условием вида (price, id) > (x, y)
+    по составному индексу, и ее стоимость не зависит от номера страницы.
+    Курсор передается в параметре cursor, пустое значение - первая
+    страница.
+    """
+
+    cursor_query_param = "cursor"
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    invalid_cursor_message = "Неверный курсор."
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        page_size = self.get_page_size(request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            values = self.decode_cursor(cursor)
+            try:
+                queryset = queryset.filter(self.seek_condition(values))
+            except (ValidationError, ValueError, TypeError):
+                # Значения курсора не приводятся к типам полей
+                raise NotFound(self.invalid_cursor_message)
+        page = list(queryset.order_by(*self.ordering)[: page_size + 1])
+        self.next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = self.encode_cursor(
+                [self.get_value(page[-1], key.lstrip("-")) for key in self.ordering]
+            )
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.next_cursor,
+        )
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    @staticmethod
+    def get_ordering(queryset):
+        """
+        Ключ сортировки: поля или аннотации с необязательным "-", последним
+        идет id. Сортировка по связанной модели (Meta.ordering вида
+        ("product", "shop")) заменяется сортировкой по id.
+        """
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        for key in ordering:
+            if not isinstance(key, str):
+                return ["id"]
+            name = key.lstrip("-")
+            try:
+                if queryset.model._meta.get_field(name).is_relation:
+                    return ["id"]
+            except FieldDoesNotExist:
+                pass
+        if not ordering or ordering[-1].lstrip("-") not in ("id", "pk"):
+            ordering.append("id")
+        return ordering
+
+    def seek_condition(self, values):
+        """Условие "после строки с ключом values" в порядке self.ordering."""
+        first = self.ordering[0]
+        # Нестрогое условие по первому полю ограничивает диапазон индекса
+        bound = Q(
+            **{f"{first.lstrip('-')}__{'lte' if first[0] == '-' else 'gte'}": values[0]}
+        )
+        condition = Q()
+        for index, key in enumerate(self.ordering):
+            lookup = "lt" if key.startswith("-") else "gt"
+            step = Q(**{f"{key.lstrip('-')}__{lookup}": values[index]})
+            for previous, value in zip(self.ordering[:index], values):
+                step &= Q(**{previous.lstrip("-"): value})
+            condition |= step
+        return bound & condition
+
+    def encode_cursor(self, values):
+        data = DjangoJSONEncoder().encode({"o": self.ordering, "v": values})
+        return urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        try:
+            data = load_json(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        except (Base64Error, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if (
+            not isinstance(data, dict)
+            or data.get("o") != self.ordering
+            or not isinstance(data.get("v"), list)
+            or len(data["v"]) != len(self.ordering)
+            or None in data["v"]
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return data["v"]
+
+    @staticmethod
+    def get_value(instance, path):
+        for name in path.split("__"):
+            instance = getattr(instance, name)
+        return instance
+
+
+class CursorPageNumberPagination(PageNumberPagination):
+    """
+    Постраничный вывод по номеру страницы (page) или, если передан
+    параметр cursor, по ключу сортировки через KeysetPagination с теми же
+    размерами страницы.
+    """
+
+    cursor_query_param = KeysetPagination.cursor_query_param
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            self.keyset = None
+            return super().paginate_queryset(queryset, request, view)
+        self.keyset = KeysetPagination()
+        self.keyset.page_size = self.page_size
+        self.keyset.page_size_query_param = self.page_size_query_param
+        self.keyset.max_page_size = self.max_page_size
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append(
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Курсор страницы при выводе по ключу сортировки "
+                "без подсчета количества (пустое значение - первая страница).",
+                "schema": {"type": "string"},
+            }
+        )
+        return parameters
+
+
+class ShopPagination(CursorPageNumberPagination):
     page_size = 10
     page_size_query_param = "page_size"
     max_page_size = 50
 
 
-class CategoryPagination(PageNumberPagination):
+class CategoryPagination(CursorPageNumberPagination):
     page_size = 5
     page_size_query_param = "page_size"
     max_page_size = 60
 
 
-class ProductPagination(PageNumberPagination):
+class ProductPagination(CursorPageNumberPagination):
     page_size = 3
     page_size_query_param = "page_size"
     max_page_size = 65
 
 
-class ProductShopPagination(PageNumberPagination):
+class ProductShopPagination(CursorPageNumberPagination):
     page_size = 2
     page_size_query_param = "page_size"
     max_page_size = 65
+
+
+class ImportChangesPagination(PageNumberPagination):
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
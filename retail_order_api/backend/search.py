@@ -0,0 +1,112 @@
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramWordSimilarity,
+)
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from backend.models import Product
+from retail_order_api import settings
+
+PRODUCT_FTS_TABLE = "backend_product_fts"
+
+_search_features = {}
+
+
+def has_trigram():
+    """Проверяет, установлено ли в PostgreSQL расширение pg_trgm."""
+    key = (connection.alias, "pg_trgm")
+    if key not in _search_features:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _search_features[key] = cursor.fetchone() is not None
+    return _search_features[key]
+
+
+def has_fts():
+    """Проверяет, создана ли в SQLite таблица FTS5 названий продуктов."""
+    key = (connection.alias, "fts5")
+    if key not in _search_features:
+        _search_features[key] = (
+            PRODUCT_FTS_TABLE in connection.introspection.table_names()
+        )
+    return _search_features[key]
+
+
+def search_products(queryset, text, product_path=""):
+    """
+    Фильтрует queryset по поисковой строке и сортирует по релевантности.
+
+    Поиск выполняется по названию продукта.
+    product_path - путь от модели queryset к Product: "" для Product,
+    "product__" для ProductInfo. Релевантность добавляется в аннотацию
+    search_rank.
+
+    PostgreSQL: полнотекстовый поиск (tsvector с конфигурацией SEARCH_CONFIG),
+    поиск подстроки и похожих слов с опечатками через pg_trgm. Для всех
+    условий есть GIN-индексы (миграция 0006_product_search).
+    SQLite: таблица FTS5 с триграммным токенизатором, синхронизируемая
+    триггерами. Прочие СУБД: поиск подстроки без ранжирования.
+    """
+    text = text.strip()
+    if not text:
+        return queryset
+    if connection.vendor == "postgresql":
+        return _search_postgresql(queryset, text, product_path)
+    if connection.vendor == "sqlite" and len(text) >= 3 and has_fts():
+        # Триграммный токенизатор не находит строки короче трех символов
+        return _search_sqlite(queryset, text, product_path)
+    return queryset.filter(**{f"{product_path}name__icontains": text}).annotate(
+        search_rank=Value(0.0, output_field=FloatField())
+    )
+
+
+def _search_postgresql(queryset, text, product_path):
+    config = settings.SEARCH_CONFIG
+    query = SearchQuery(text, config=config, search_type="websearch")
+    trigram = has_trigram()
+
+    # Подзапрос по таблице продуктов, чтобы условия использовали
+    # индексы по названию, а не фильтр по соединению таблиц
+    match = Q(search_vector=query) | Q(name__icontains=text)
+    if trigram:
+        match |= Q(name__trigram_word_similar=text)
+    products = Product.objects.annotate(
+        search_vector=SearchVector("name", config=config)
+    ).filter(match)
+
+    rank = SearchRank(SearchVector(f"{product_path}name", config=config), query)
+    if trigram:
+        rank = rank + TrigramWordSimilarity(text, f"{product_path}name")
+    return (
+        queryset.filter(**{f"{product_path}id__in": products.values("id")})
+        .annotate(search_rank=rank)
+        .order_by("-search_rank", "id")
+    )
+
+
+def _search_sqlite(queryset, text, product_path):
+    phrase = '"{}"'.format(text.replace('"', '""'))
+    # Столбец с id продукта в основной таблице запроса
+    opts = queryset.model._meta
+    column = opts.get_field(product_path[:-2]).column if product_path else "id"
+    matched = RawSQL(
+        f"SELECT rowid FROM {PRODUCT_FTS_TABLE} WHERE {PRODUCT_FTS_TABLE} MATCH %s",
+        (phrase,),
+    )
+    # rank FTS5 (bm25) отрицательный: чем меньше, тем релевантнее
+    rank = RawSQL(
+        f"(SELECT -rank FROM {PRODUCT_FTS_TABLE} "
+        f"WHERE {PRODUCT_FTS_TABLE} MATCH %s "
+        f'AND rowid = "{opts.db_table}"."{column}")',
+        (phrase,),
+        output_field=FloatField(),
+    )
+    return (
+        queryset.filter(**{f"{product_path}id__in": matched})
+        .annotate(search_rank=rank)
+        .order_by("-search_rank", "id")
+    )
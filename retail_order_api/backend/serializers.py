@@ -1,6 +1,7 @@
 from os.path import splitext
 
 from django.core.exceptions import ValidationError
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
 from backend.models import (
@@ -143,7 +144,7 @@ class ProductParameterSerializer(serializers.ModelSerializer):
 
 class ProductInfoSerializer(serializers.ModelSerializer):
     product = ProductWithoutImageSerializer(read_only=True)
-    product_parameters = ProductParameterSerializer(read_only=True, many=True)
+    product_parameters = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductInfo
@@ -160,13 +161,25 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ["id"]
 
+    @extend_schema_field(ProductParameterSerializer(many=True))
+    def get_product_parameters(self, obj):
+        """Параметры из ProductInfo.parameters, без запросов к ProductParameter."""
+        return [
+            {"parameter": name, "value": value}
+            for name, value in obj.parameters.items()
+        ]
+
 
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ["id", "product_info", "quantity", "order"]
         read_only_fields = ["id"]
-        extra_kwargs = {"order": {"write_only": True}}
+        extra_kwargs = {
+            "order": {"write_only": True},
+            # В корзину добавляются только товары активной версии каталога
+            "product_info": {"queryset": ProductInfo.objects.active()},
+        }
 
     def validate(self, data):
         """
@@ -1,7 +1,9 @@
 from django.core.mail import EmailMultiAlternatives
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import Signal, receiver
 
-from backend.models import CustomUser
+from backend.importer import category_names, parameter_names
+from backend.models import Category, CustomUser, Parameter, ProductInfo
 from retail_order_api import settings
 
 new_order = Signal()
@@ -23,3 +25,43 @@ def new_order_signal(user_id, order_id, **kwargs):
         [user.email],
     )
     msg.send()
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Parameter)
+def invalidate_names_signal(sender, created=False, **kwargs):
+    """
+    Сбрасывает словари {name: id} категорий и параметров при переименовании
+    и удалении. Новые объекты не меняют уже известные имена.
+    """
+    if created:
+        return
+    names = category_names if sender is Category else parameter_names
+    names.invalidate()
+
+
+@receiver(pre_save, sender=Parameter)
+def remember_parameter_name_signal(instance, **kwargs):
+    """Запоминает прежнее название параметра для rename_parameter_signal."""
+    instance.previous_name = (
+        Parameter.objects.filter(id=instance.id).values_list("name", flat=True).first()
+        if instance.id
+        else None
+    )
+
+
+@receiver(post_save, sender=Parameter)
+def rename_parameter_signal(instance, created, **kwargs):
+    """
+    Переименовывает параметр в ProductInfo.parameters товаров, по которым
+    в PostgreSQL фильтруются значения параметров.
+    """
+    previous_name = getattr(instance, "previous_name", None)
+    if not created and previous_name and previous_name != instance.name:
+        ProductInfo.objects.rename_parameter(previous_name, instance.name)
+
+
+@receiver(post_delete, sender=Parameter)
+def delete_parameter_signal(instance, **kwargs):
+    """Удаляет параметр из ProductInfo.parameters товаров."""
+    ProductInfo.objects.rename_parameter(instance.name)
@@ -0,0 +1,261 @@
+from django.db import connection, transaction
+from django.db.backends.postgresql.psycopg_any import Jsonb, is_psycopg3
+
+from backend.models import ProductInfo, ProductParameter
+from retail_order_api import settings
+
+PRODUCT_INFO_STAGE = "import_product_info_stage"
+PRODUCT_PARAMETER_STAGE = "import_product_parameter_stage"
+
+
+class CopyLoader:
+    """
+    Загрузка товаров в PostgreSQL через COPY FROM STDIN.
+
+    Строки товаров и параметров потоково копируются во временные таблицы
+    сессии (как и UNLOGGED, они не пишутся в WAL и удаляются вместе
+    с сессией), после чего переносятся в основные таблицы несколькими
+    set-based запросами INSERT ... ON CONFLICT и DELETE.
+
+    Режимы соответствуют CatalogWriter:
+    - replace - товары вставляются в новую версию каталога;
+    - upsert - активная версия каталога сливается с прайс-листом:
+    отсутствующие товары удаляются, новые вставляются, у существующих
+    изменяются только отличающиеся поля и параметры.
+    """
+
+    def __init__(self, shop_id, version, mode):
+        self.shop_id = shop_id
+        self.version = version
+        self.mode = mode
+        self.opened = False
+        quote = connection.ops.quote_name
+        self.tables = {
+            "info": quote(ProductInfo._meta.db_table),
+            "parameter": quote(ProductParameter._meta.db_table),
+            "info_stage": PRODUCT_INFO_STAGE,
+            "parameter_stage": PRODUCT_PARAMETER_STAGE,
+        }
+
+    @staticmethod
+    def is_supported():
+        """COPY используется только для PostgreSQL с драйвером psycopg 3."""
+        return (
+            settings.IMPORT_USE_COPY
+            and connection.vendor == "postgresql"
+            and is_psycopg3
+        )
+
+    def _sql(self, sql):
+        return sql.format(**self.tables)
+
+    def open(self):
+        """
+        Создает или очищает временные таблицы сессии. Ограничения полей
+        проверяются при переносе в основные таблицы, чтобы ошибки данных
+        возникали как IntegrityError и DataError Django.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                self._sql(
+                    "CREATE TEMPORARY TABLE IF NOT EXISTS {info_stage} ("
+                    "external_id bigint, product_id bigint, model text, "
+                    "price numeric, price_rrp numeric, quantity bigint, "
+                    "parameters jsonb); "
+                    "CREATE TEMPORARY TABLE IF NOT EXISTS {parameter_stage} ("
+                    "external_id bigint, product_id bigint, parameter_id bigint, "
+                    "value text, value_number double precision, unit text); "
+                    "TRUNCATE {info_stage}, {parameter_stage}"
+                )
+            )
+        self.opened = True
+
+    def stage(self, info_rows, parameter_rows):
+        """
+        Копирует строки во временные таблицы.
+
+        info_rows - (external_id, product_id, model, price, price_rrp, quantity,
+        parameters),
+        parameter_rows - (external_id, product_id, parameter_id, value,
+        value_number, unit).
+        """
+        if not self.opened:
+            self.open()
+        with connection.cursor() as cursor, connection.wrap_database_errors:
+            for table, columns, rows in (
+                (
+                    PRODUCT_INFO_STAGE,
+                    "external_id, product_id, model, price, price_rrp, quantity, "
+                    "parameters",
+                    # Словарь параметров передается как jsonb
+                    ((*row[:-1], Jsonb(row[-1])) for row in info_rows),
+                ),
+                (
+                    PRODUCT_PARAMETER_STAGE,
+                    "external_id, product_id, parameter_id, value, value_number, unit",
+                    parameter_rows,
+                ),
+            ):
+                with cursor.copy(f"COPY {table} ({columns}) FROM STDIN") as copy:
+                    for row in rows:
+                        copy.write_row(row)
+
+    def merge(self):
+        """
+        Переносит строки из временных таблиц в основные.
+        Возвращает статистику в формате CatalogWriter.stats.
+        """
+        if not self.opened:
+            self.open()
+        params = {"shop_id": self.shop_id, "version": self.version}
+        with transaction.atomic(), connection.cursor() as cursor:
+            if self.mode == "upsert":
+                stats = self._merge_upsert(cursor, params)
+            else:
+                stats = self._merge_replace(cursor, params)
+        self.close()
+        return stats
+
+    def close(self):
+        if not self.opened:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                self._sql("DROP TABLE IF EXISTS {info_stage}, {parameter_stage}")
+            )
+        self.opened = False
+
+    def duplicate_external_id(self):
+        """Возвращает повторяющийся id товара, если он есть."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                self._sql(
+                    "SELECT external_id FROM {info_stage} "
+                    "GROUP BY external_id HAVING COUNT(*) > 1 LIMIT 1"
+                )
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def _merge_replace(self, cursor, params):
+        cursor.execute(
+            self._sql(
+                "INSERT INTO {info} (product_id, shop_id, external_id, model, "
+                "price, price_rrp, quantity, parameters, catalog_version) "
+                "SELECT product_id, %(shop_id)s, external_id, model, price, "
+                "price_rrp, quantity, parameters, %(version)s FROM {info_stage}"
+            ),
+            params,
+        )
+        inserted = cursor.rowcount
+        cursor.execute(
+            self._sql(
+                "INSERT INTO {parameter} (product_info_id, parameter_id, value, "
+                "value_number, unit) "
+                "SELECT pi.id, sp.parameter_id, sp.value, sp.value_number, sp.unit "
+                "FROM {parameter_stage} sp "
+                "JOIN {info} pi ON pi.shop_id = %(shop_id)s "
+                "AND pi.catalog_version = %(version)s "
+                "AND pi.external_id = sp.external_id "
+                "AND pi.product_id = sp.product_id"
+            ),
+            params,
+        )
+        return {"inserted": inserted, "updated": 0, "unchanged": 0, "removed": 0}
+
+    def _merge_upsert(self, cursor, params):
+        # Товары, которых нет в прайс-листе. Удаляются через ORM, так как
+        # каскадное удаление параметров и позиций заказов выполняет Django
+        cursor.execute(
+            self._sql(
+                "SELECT pi.id FROM {info} pi WHERE pi.shop_id = %(shop_id)s "
+                "AND pi.catalog_version = %(version)s AND NOT EXISTS ("
+                "SELECT 1 FROM {info_stage} s WHERE s.external_id = pi.external_id)"
+            ),
+            params,
+        )
+        stale_ids = [row[0] for row in cursor.fetchall()]
+        batch_size = settings.IMPORT_BATCH_SIZE
+        for start in range(0, len(stale_ids), batch_size):
+            end = start + batch_size
+            ProductInfo.objects.filter(id__in=stale_ids[start:end]).delete()
+
+        # Смена продукта у товара с тем же external_id
+        cursor.execute(
+            self._sql(
+                "UPDATE {info} pi SET product_id = s.product_id FROM {info_stage} s "
+                "WHERE pi.shop_id = %(shop_id)s "
+                "AND pi.catalog_version = %(version)s "
+                "AND pi.external_id = s.external_id "
+                "AND pi.product_id <> s.product_id RETURNING pi.id"
+            ),
+            params,
+        )
+        updated_ids = {row[0] for row in cursor.fetchall()}
+
+        # Новые и измененные товары, xmax = 0 у вставленных строк
+        cursor.execute(
+            self._sql(
+                "INSERT INTO {info} AS pi (product_id, shop_id, external_id, model, "
+                "price, price_rrp, quantity, parameters, catalog_version) "
+                "SELECT product_id, %(shop_id)s, external_id, model, price, "
+                "price_rrp, quantity, parameters, %(version)s FROM {info_stage} "
+                "ON CONFLICT (product_id, shop_id, external_id, catalog_version) "
+                "DO UPDATE SET model = EXCLUDED.model, price = EXCLUDED.price, "
+                "price_rrp = EXCLUDED.price_rrp, quantity = EXCLUDED.quantity, "
+                "parameters = EXCLUDED.parameters "
+                "WHERE (pi.model, pi.price, pi.price_rrp, pi.quantity, "
+                "pi.parameters) IS DISTINCT FROM (EXCLUDED.model, EXCLUDED.price, "
+                "EXCLUDED.price_rrp, EXCLUDED.quantity, EXCLUDED.parameters) "
+                "RETURNING pi.id, pi.xmax = 0"
+            ),
+            params,
+        )
+        inserted_ids = set()
+        for pk, inserted in cursor.fetchall():
+            (inserted_ids if inserted else updated_ids).add(pk)
+
+        # Параметры, которых нет в прайс-листе
+        cursor.execute(
+            self._sql(
+                "DELETE FROM {parameter} pp USING {info} pi "
+                "WHERE pp.product_info_id = pi.id AND pi.shop_id = %(shop_id)s "
+                "AND pi.catalog_version = %(version)s AND NOT EXISTS ("
+                "SELECT 1 FROM {parameter_stage} sp "
+                "WHERE sp.external_id = pi.external_id "
+                "AND sp.parameter_id = pp.parameter_id) "
+                "RETURNING pp.product_info_id"
+            ),
+            params,
+        )
+        updated_ids.update(row[0] for row in cursor.fetchall())
+
+        # Новые и измененные параметры
+        cursor.execute(
+            self._sql(
+                "INSERT INTO {parameter} AS pp (product_info_id, parameter_id, value, "
+                "value_number, unit) "
+                "SELECT pi.id, sp.parameter_id, sp.value, sp.value_number, sp.unit "
+                "FROM {parameter_stage} sp "
+                "JOIN {info} pi ON pi.shop_id = %(shop_id)s "
+                "AND pi.catalog_version = %(version)s "
+                "AND pi.external_id = sp.external_id "
+                "ON CONFLICT (product_info_id, parameter_id) "
+                "DO UPDATE SET value = EXCLUDED.value, "
+                "value_number = EXCLUDED.value_number, unit = EXCLUDED.unit "
+                "WHERE pp.value IS DISTINCT FROM EXCLUDED.value "
+                "RETURNING pp.product_info_id"
+            ),
+            params,
+        )
+        updated_ids.update(row[0] for row in cursor.fetchall())
+
+        cursor.execute(self._sql("SELECT COUNT(*) FROM {info_stage}"))
+        total = cursor.fetchone()[0]
+        updated_ids -= inserted_ids
+        return {
+            "inserted": len(inserted_ids),
+            "updated": len(updated_ids),
+            "unchanged": total - len(inserted_ids) - len(updated_ids),
+            "removed": len(stale_ids),
+        }
@@ -1,98 +1,580 @@
-from celery import shared_task
+from contextlib import nullcontext
+from datetime import timedelta
+from decimal import InvalidOperation
+from random import uniform
+
+from celery import chord, shared_task, uuid
 from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
 from django.db import IntegrityError, transaction
-from requests import get
-from yaml import SafeLoader
-from yaml import load as load_yaml
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
 from yaml.error import YAMLError
 
-from backend.models import (
-    Category,
-    Parameter,
-    Product,
-    ProductInfo,
-    ProductParameter,
-    Shop,
+from backend.exports import build_export
+from backend.feeds import (
+    FeedFetcher,
+    open_feed,
+    read_feed_chunk,
+    remove_feed_chunks,
+    write_feed_chunks,
+)
+from backend.importer import (
+    CatalogDiff,
+    CatalogWriter,
+    ImportDataError,
+    ImportProgress,
+    collect_catalog_versions,
 )
+from backend.locks import ImportLock
+from backend.models import Shop, ShopImportState
+from retail_order_api import settings
 
+IMPORT_ERRORS = (YAMLError, ImportDataError, IntegrityError, TypeError, AttributeError)
 
-@shared_task()
-def do_import_celery(url, user_id):
+
+def import_error_result(error):
+    """Формирует результат задачи импорта для перехваченной ошибки."""
+    if isinstance(error, YAMLError):
+        message = "Ошибка при загрузке данных из файла YAML."
+    elif isinstance(error, ImportDataError):
+        message = str(error)
+    else:
+        message = "Не указаны все необходимые аргументы."
+    return {"Status": False, "Errors": message}
+
+
+def publish_import(shop, shop_name, url, fingerprint):
+    """
+    Завершает импорт: обновляет название и URL магазина
+    и сохраняет отпечаток успешно загруженного прайс-листа.
+    """
+    if not shop_name:
+        raise ImportDataError("Не указано название магазина shop_name.")
+    if (shop.name, shop.url) != (shop_name, url):
+        shop.name, shop.url = shop_name, url
+        shop.save(update_fields=["name", "url"])
+    shop.touch_catalog()
+
+    ShopImportState.objects.update_or_create(
+        shop=shop,
+        defaults={"url": url, "imported_at": timezone.now(), **fingerprint},
+    )
+
+
+def import_params(
+    url, user_id, mode=None, force=False, feed_format=None, dry_run=False
+):
+    """Аргументы задачи do_import_celery, по которым сравниваются импорты."""
+    return {
+        "url": url,
+        "user_id": user_id,
+        "mode": mode,
+        "force": force,
+        "feed_format": feed_format,
+        "dry_run": dry_run,
+    }
+
+
+def enqueue_import(url, user_id, **options):
+    """
+    Запускает импорт прайс-листа магазина с учетом блокировки магазина.
+
+    Возвращает (task_id, status), где status:
+    - started - импорт запущен;
+    - joined - такой же импорт уже выполняется, возвращается его task_id;
+    - queued - выполняется другой импорт, запрос отложен до его завершения.
+    Отложенный импорт у магазина один: повторные запросы получают тот же
+    task_id, а задача выполняется с аргументами последнего запроса.
+    Проверка без записи (dry_run) выполняется без блокировки.
+    """
+    params = import_params(url, user_id, **options)
+    if params["dry_run"]:
+        return do_import_celery.apply_async(kwargs=params).id, "started"
+
+    task_id, import_status = ImportLock(user_id).enqueue(uuid(), params)
+    if import_status == "started":
+        do_import_celery.apply_async(kwargs=params, task_id=task_id)
+    return task_id, import_status
+
+
+def release_import(user_id, task_id):
+    """Снимает блокировку импорта и запускает отложенный импорт, если он есть."""
+    pending = ImportLock(user_id).release(task_id)
+    if pending is not None:
+        do_import_celery.apply_async(
+            kwargs=pending["params"], task_id=pending["task_id"]
+        )
+
+
+@shared_task(bind=True)
+def do_import_celery(
+    self, url, user_id, mode=None, force=False, feed_format=None, dry_run=False
+):
+    """
+    Импортирует прайс-лист магазина по URL.
+
+    Одновременно выполняется только один импорт магазина: задача, запущенная
+    при занятой блокировке, откладывается через enqueue_import. При вызове
+    без Celery (нет request.id) блокировка не используется.
+
+    Подробнее об аргументах в run_import.
+    """
+    params = import_params(url, user_id, mode, force, feed_format, dry_run)
+    task_id = self.request.id
+    if dry_run or not task_id:
+        return run_import(self, **params)
+
+    if not ImportLock(user_id).claim(task_id, params):
+        pending_id, _ = enqueue_import(
+            url, user_id, mode=mode, force=force, feed_format=feed_format
+        )
+        return {
+            "Status": True,
+            "Message": "Импорт магазина уже выполняется, запрос отложен.",
+            "result_url": reverse(
+                "backend:task-result", kwargs={"task_id": pending_id}
+            ),
+        }
+
+    release, result = True, None
     try:
-        stream = get(url).content
-        data = load_yaml(stream, Loader=SafeLoader)
-    except YAMLError:
+        result = run_import(self, **params)
+        # Импорт частями снимает блокировку и планирует следующий импорт
+        # в finalize_import_celery
+        release = not (mode == "parallel" and result.get("result_url"))
+        return result
+    finally:
+        if release:
+            release_import(user_id, task_id)
+            reschedule_import(user_id, result)
+
+
+def run_import(
+    task, url, user_id, mode=None, force=False, feed_format=None, dry_run=False
+):
+    """
+    Импортирует прайс-лист магазина по URL.
+
+    Формат файла (yaml, json, ndjson, csv) задается feed_format или
+    определяется по Content-Type ответа и расширению файла.
+
+    Импорт пропускается, если сервер ответил 304 Not Modified или хэш
+    содержимого совпадает с последним успешным импортом (при force=False).
+    В режиме parallel товары записываются частями параллельными задачами.
+    Ход импорта публикуется в состоянии задачи PROGRESS.
+
+    При dry_run=True прайс-лист только проверяется и сравнивается с текущими
+    товарами магазина, в результат попадают сводка и список изменений.
+    """
+    progress = ImportProgress(task)
+    try:
+        download, unchanged = fetch_feed(url, user_id, force or dry_run, progress)
+    except ImportDataError as error:
+        return import_error_result(error)
+    if unchanged:
         return {
-            "Status": False,
-            "Errors": "Ошибка при загрузке данных из файла YAML.",
+            "Status": True,
+            "Message": "Прайс-лист не изменился.",
+            "Unchanged": True,
+            "Fetch": download.metrics,
         }
-    with transaction.atomic():
-        try:
-            # # ОТЛАДКА - чтение файла с ПК
-            # import os
-            # url = "http://www.exmple100.ru"
-            # stream = os.path.join(os.getcwd(), "data/shop_1.yaml")
-            # with open(stream, encoding="utf-8") as file:
-            #     data = load_yaml(file, Loader=SafeLoader)
-            # # ОТЛАДКА - чтение файла с ПК
-
-            # Создание или обновление магазина
-            shop, _ = Shop.objects.update_or_create(
-                user_id=user_id,
-                defaults={"name": data.get("shop_name"), "url": url},
-            )
 
+    try:
+        progress.start("parse")
+        feed = open_feed(download, url, feed_format)
+        if dry_run:
+            result = preview_import(feed, user_id, progress)
+            return {**result, "Fetch": download.metrics}
+        if mode == "parallel":
+            return {
+                **start_parallel_import(
+                    feed, url, user_id, download.fingerprint, progress, task.request.id
+                ),
+                "Fetch": download.metrics,
+            }
+
+        result = write_feed(feed, url, user_id, download.fingerprint, mode, progress)
+    except IMPORT_ERRORS as error:
+        return {**import_error_result(error), "Fetch": download.metrics}
+    finally:
+        download.close()
+
+    return {**result, "Fetch": download.metrics}
+
+
+def fetch_feed(url, user_id, force=False, progress=None):
+    """
+    Загружает прайс-лист условным запросом с ETag и Last-Modified последнего
+    импорта. Возвращает загрузку и признак того, что прайс-лист не изменился
+    (при force=False). Файл неизмененного прайс-листа закрывается.
+    """
+    state = (
+        None
+        if force
+        else ShopImportState.objects.filter(shop__user_id=user_id, url=url).first()
+    )
+    download = FeedFetcher().fetch(
+        url,
+        etag=state.etag if state else "",
+        last_modified=state.last_modified if state else "",
+        progress=progress,
+    )
+    unchanged = download.not_modified or bool(
+        state and state.content_hash == download.content_hash
+    )
+    if unchanged:
+        download.close()
+    return download, unchanged
+
+
+def write_feed(feed, url, user_id, fingerprint, mode=None, progress=None):
+    """
+    Записывает прочитанный прайс-лист в каталог магазина
+    и возвращает результат импорта.
+    """
+    progress = progress or ImportProgress()
+    writer = None
+    try:
+        # Создание магазина, название и URL обновляются при публикации импорта
+        shop, created = Shop.objects.get_or_create(
+            user_id=user_id,
+            defaults={"name": feed.header.get("shop_name", ""), "url": url},
+        )
+        writer = CatalogWriter(shop, mode=mode, progress=progress)
+
+        # Режим upsert изменяет активную версию каталога одной транзакцией,
+        # режим replace записывает новую версию без общей транзакции
+        with transaction.atomic() if writer.mode == "upsert" else nullcontext():
             # Обработка категорий
-            shop.categories.clear()  # Удаление существующих категорий
-            category_name_to_id = {}  # Для создания товаров
-            categories_data = data.get("categories", [])
-            for category_name in categories_data:
-                category_object, _ = Category.objects.get_or_create(name=category_name)
-                category_object.shops.add(shop.id)
-                category_name_to_id[category_name] = category_object.id
+            categories = feed.header.get("categories", [])
+            progress.start("categories", len(categories))
+            writer.write_categories(categories)
+            progress.advance(len(categories))
 
             # Обработка товаров
-            ProductInfo.objects.filter(
-                shop_id=shop.id
-            ).delete()  # Удаление существующих товаров магазина
-            products_data = data.get("goods", [])
-            for product_data in products_data:
-                # Попытка получить товар, если его нет — создание
-                try:
-                    product = Product.objects.get(name=product_data.get("name"))
-                    # Проверка связи категории товара с магазином
-                    if product.category.name not in category_name_to_id:
-                        product.category.shops.add(shop.id)
-                except Product.DoesNotExist:
-                    category_id = category_name_to_id.get(product_data.get("category"))
-                    product = Product.objects.create(
-                        name=product_data.get("name"), category_id=category_id
-                    )
-
-                # Обработка информации о товаре
-                product_info = ProductInfo.objects.create(
-                    product_id=product.id,
-                    shop_id=shop.id,
-                    external_id=product_data.get("id"),
-                    model=product_data.get("model"),
-                    price=product_data.get("price"),
-                    price_rrp=product_data.get("price_rrp"),
-                    quantity=product_data.get("quantity"),
-                )
-
-                # Обработка параметров товара
-                parameters_data = product_data.get("parameters", {})
-                for param_name, param_value in parameters_data.items():
-                    parameter, _ = Parameter.objects.get_or_create(name=param_name)
-                    ProductParameter.objects.create(
-                        product_info_id=product_info.id,
-                        parameter=parameter,
-                        value=param_value,
-                    )
-
-            return {"Status": True, "Message": "Магазин успешно обновлен."}
-        except (IntegrityError, TypeError, AttributeError):
-            return {"Status": False, "Errors": "Не указаны все необходимые аргументы."}
+            progress.start("goods")
+            writer.start()
+            writer.write_goods(feed.goods())
+
+            with transaction.atomic():
+                writer.finish()
+                # Название магазина может следовать в файле после списка товаров
+                publish_import(shop, feed.header.get("shop_name"), url, fingerprint)
+        if writer.mode != "upsert":
+            schedule_catalog_collection(shop.id)
+    except IMPORT_ERRORS as error:
+        if writer is not None:
+            writer.discard()
+            if created and not writer.shop.catalog_version:
+                writer.shop.delete()  # Первый импорт магазина не удался
+        return import_error_result(error)
+
+    return {
+        "Status": True,
+        "Message": "Магазин успешно обновлен.",
+        "Stats": writer.stats,
+    }
+
+
+def preview_import(feed, user_id, progress):
+    """Сравнивает прайс-лист с текущими товарами магазина без записи в БД."""
+    diff = CatalogDiff(Shop.objects.filter(user_id=user_id).first(), progress)
+    changes = diff.compute(feed.header.get("categories", []), feed.goods())
+    result = {
+        "Status": not diff.errors,
+        "DryRun": True,
+        "Summary": diff.summary,
+        "Changes": changes,
+    }
+    if diff.errors:
+        result["Errors"] = diff.errors
+    else:
+        result["Message"] = "Прайс-лист проверен, изменения не записаны."
+    return result
+
+
+def schedule_catalog_collection(shop_id):
+    """Запускает удаление старых версий каталога после фиксации транзакции."""
+    transaction.on_commit(lambda: collect_catalog_versions_celery.delay(shop_id))
+
+
+def start_parallel_import(feed, url, user_id, fingerprint, progress, task_id=None):
+    """
+    Разбивает товары на части по IMPORT_PARALLEL_CHUNK_SIZE и запускает
+    их запись в новую версию каталога параллельными задачами, объединенными
+    в chord с завершающей задачей finalize_import_celery.
+
+    Товары записываются в файл частей (write_feed_chunks), задачи получают
+    путь к файлу и положение своей части, а не сами товары. Файл удаляется
+    после завершения chord.
+    """
+    shop, _ = Shop.objects.get_or_create(
+        user_id=user_id,
+        defaults={"name": feed.header.get("shop_name", ""), "url": url},
+    )
+    writer = CatalogWriter(shop, mode="replace")
+    categories = feed.header.get("categories", [])
+    progress.start("categories", len(categories))
+    writer.write_categories(categories)
+    writer.start()
+
+    progress.start("parse")
+    path, chunks = write_feed_chunks(feed.goods(), settings.IMPORT_PARALLEL_CHUNK_SIZE)
+    chord_result = chord(
+        import_goods_chunk_celery.s(
+            shop.id, writer.category_name_to_id, writer.version, path, offset, count
+        )
+        for offset, count in chunks
+    )(
+        finalize_import_celery.s(
+            shop.id,
+            feed.header.get("shop_name"),
+            url,
+            fingerprint,
+            writer.version,
+            list(writer.linked_category_ids),
+            task_id,
+            path,
+        ).on_error(
+            abort_parallel_import_celery.s(shop.id, writer.version, task_id, path)
+        )
+    )
+    return {
+        "Status": True,
+        "Message": f"Импорт запущен частями: {len(chunks)}.",
+        "result_url": reverse(
+            "backend:task-result", kwargs={"task_id": chord_result.id}
+        ),
+    }
+
+
+@shared_task()
+def import_goods_chunk_celery(
+    shop_id, category_name_to_id, version, path, offset, count
+):
+    """
+    Записывает часть товаров магазина из файла частей path (count товаров
+    начиная со смещения offset) в версию каталога version.
+    """
+    shop = Shop.objects.get(id=shop_id)
+    goods = read_feed_chunk(path, offset, count)
+    writer = CatalogWriter(
+        shop,
+        mode="replace",
+        category_name_to_id=category_name_to_id,
+        version=version,
+    )
+    try:
+        writer.write_goods(goods)
+        writer.flush()
+    except (*IMPORT_ERRORS, ValueError, ValidationError, InvalidOperation) as error:
+        return import_error_result(error)
+
+    return {
+        "Status": True,
+        "Stats": writer.stats,
+        "external_ids": [product_data.get("id") for product_data in goods],
+        "category_ids": list(writer.linked_category_ids),
+    }
+
+
+@shared_task()
+def finalize_import_celery(
+    results,
+    shop_id,
+    shop_name,
+    url,
+    fingerprint,
+    version,
+    category_ids,
+    lock_task_id=None,
+    chunks_path=None,
+):
+    """
+    Завершает импорт частями: переключает магазин на записанную версию
+    каталога и публикует результат импорта. При ошибке в любой из частей
+    записанная версия удаляется, а отпечаток прайс-листа не сохраняется.
+
+    Блокировка импорта, захваченная задачей lock_task_id, снимается,
+    а файл частей chunks_path удаляется в любом случае.
+    """
+    shop = Shop.objects.get(id=shop_id)
+    writer = CatalogWriter(shop, mode="replace", version=version)
+    writer.linked_category_ids.update(category_ids)
+    result = None
+    try:
+        result = finish_parallel_import(results, writer, shop_name, url, fingerprint)
+        return result
+    finally:
+        remove_feed_chunks(chunks_path)
+        if lock_task_id:
+            release_import(shop.user_id, lock_task_id)
+            reschedule_import(shop.user_id, result)
+
+
+@shared_task()
+def abort_parallel_import_celery(
+    request, exc, traceback, shop_id, version, lock_task_id=None, chunks_path=None
+):
+    """
+    Обработчик ошибки chord импорта частями: вызывается, если часть или
+    finalize_import_celery завершились исключением. Удаляет недописанную
+    версию каталога и файл частей и снимает блокировку импорта задачи
+    lock_task_id, если она еще не снята.
+    """
+    remove_feed_chunks(chunks_path)
+    shop = Shop.objects.filter(id=shop_id).first()
+    if shop is None:
+        return
+    CatalogWriter(shop, mode="replace", version=version).discard()
+    # Если упала finalize_import_celery, блокировка уже снята в ней
+    current = ImportLock(shop.user_id).current
+    if lock_task_id and current and current["task_id"] == lock_task_id:
+        release_import(shop.user_id, lock_task_id)
+        reschedule_import(shop.user_id, None)
+
+
+def finish_parallel_import(results, writer, shop_name, url, fingerprint):
+    errors = [result["Errors"] for result in results if not result["Status"]]
+    seen_external_ids = set()
+    for result in results:
+        seen_external_ids.update(result.get("external_ids", []))
+        writer.linked_category_ids.update(result.get("category_ids", []))
+    if sum(len(result.get("external_ids", [])) for result in results) != len(
+        seen_external_ids
+    ):
+        errors.append("Повторяющиеся id товаров в разных частях прайс-листа.")
+    if errors:
+        writer.discard()
+        return {"Status": False, "Errors": errors}
+
+    try:
+        with transaction.atomic():
+            writer.finish()
+            publish_import(writer.shop, shop_name, url, fingerprint)
+    except IMPORT_ERRORS as error:
+        writer.discard()
+        return import_error_result(error)
+    schedule_catalog_collection(writer.shop.id)
+
+    stats = {
+        key: sum(result["Stats"][key] for result in results)
+        for key in ("inserted", "updated", "unchanged")
+    }
+    stats["removed"] = writer.stats["removed"]
+    return {"Status": True, "Message": "Магазин успешно обновлен.", "Stats": stats}
+
+
+def reschedule_import(user_id, result):
+    """
+    Планирует следующий импорт магазина по расписанию по результату текущего.
+
+    После успешного импорта следующий выполняется через интервал магазина,
+    после ошибок интервал удваивается с каждой ошибкой подряд, но не более
+    IMPORT_SCHEDULE_MAX_BACKOFF минут. Время смещается на случайную долю
+    интервала (IMPORT_SCHEDULE_JITTER), чтобы импорты не совпадали.
+    Состояние импорта создается, если первый импорт магазина не удался.
+    """
+    state = ShopImportState.objects.filter(shop__user_id=user_id).first()
+    if state is None:
+        shop = Shop.objects.filter(user_id=user_id).exclude(url__isnull=True).first()
+        if shop is None or not shop.url:
+            return
+        state = ShopImportState.objects.create(shop=shop, url=shop.url)
+    interval = state.refresh_interval
+    if interval is None:
+        interval = settings.IMPORT_SCHEDULE_INTERVAL
+
+    if result is not None and result["Status"]:
+        state.failures, state.last_error = 0, ""
+    else:
+        state.failures += 1
+        state.last_error = (
+            str(result["Errors"]) if result else "Импорт завершился аварийно."
+        )
+        interval = min(
+            interval * 2**state.failures, settings.IMPORT_SCHEDULE_MAX_BACKOFF
+        )
+    jitter = settings.IMPORT_SCHEDULE_JITTER
+    state.next_import_at = timezone.now() + timedelta(
+        minutes=interval * uniform(1 - jitter, 1 + jitter)
+    )
+    state.scheduled_at = None
+    state.save(
+        update_fields=["failures", "last_error", "next_import_at", "scheduled_at"]
+    )
+
+
+@shared_task()
+def schedule_imports_celery():
+    """
+    Запускает импорты магазинов, время обновления которых наступило.
+
+    Задача выполняется Celery beat раз в минуту. Одновременно выполняется
+    не более IMPORT_SCHEDULE_MAX_CONCURRENT импортов по расписанию,
+    остальные магазины ждут следующего запуска в порядке очереди.
+    Магазинам без времени следующего импорта оно назначается случайно
+    в пределах интервала, чтобы распределить нагрузку.
+    """
+    now = timezone.now()
+    # Импорт, не завершившийся за время блокировки, считается прерванным
+    expired = now - timedelta(seconds=settings.IMPORT_LOCK_TIMEOUT)
+    states = (
+        ShopImportState.objects.exclude(refresh_interval=0)
+        .filter(shop__user__isnull=False)
+        .select_related("shop")
+    )
+    for state in states.filter(next_import_at__isnull=True):
+        interval = state.refresh_interval or settings.IMPORT_SCHEDULE_INTERVAL
+        state.next_import_at = now + timedelta(minutes=uniform(0, interval))
+        state.save(update_fields=["next_import_at"])
+
+    with transaction.atomic():
+        running = states.filter(scheduled_at__gt=expired).count()
+        slots = max(settings.IMPORT_SCHEDULE_MAX_CONCURRENT - running, 0)
+        due = list(
+            states.filter(next_import_at__lte=now)
+            .filter(Q(scheduled_at__isnull=True) | Q(scheduled_at__lte=expired))
+            .select_for_update(skip_locked=True, of=("self",))
+            .order_by("next_import_at")[:slots]
+        )
+        for state in due:
+            state.scheduled_at = now
+            state.save(update_fields=["scheduled_at"])
+            url = state.shop.url or state.url
+            transaction.on_commit(
+                lambda url=url, user_id=state.shop.user_id: enqueue_import(url, user_id)
+            )
+    return {"Status": True, "Started": len(due)}
+
+
+@shared_task()
+def collect_catalog_versions_celery(shop_id):
+    """Удаляет товары неактивных версий каталога магазина."""
+    shop = Shop.objects.filter(id=shop_id).first()
+    removed = collect_catalog_versions(shop) if shop else 0
+    return {"Status": True, "Removed": removed}
+
+
+@shared_task(bind=True)
+def export_catalog_celery(self, shop_id, feed_format):
+    """
+    Выгружает каталог магазина в сжатый файл в хранилище файлов.
+    Ссылка на файл возвращается в export_url результата задачи.
+    """
+    shop = Shop.objects.filter(id=shop_id).first()
+    if shop is None:
+        return {"Status": False, "Errors": "Магазин не найден."}
+    path, created = build_export(shop, feed_format, ImportProgress(self))
+    return {
+        "Status": True,
+        "Message": "Каталог выгружен." if created else "Каталог не изменился.",
+        "export_url": default_storage.url(path),
+        "Reused": not created,
+    }
 
 
 @shared_task
@@ -13,6 +13,7 @@ from backend.views import (
     RedirectSocialView,
     ShopDataView,
     ShopDetailView,
+    ShopExportView,
     ShopListView,
     ShopOrderView,
 )
@@ -22,6 +23,7 @@ app_name = "backend"
 shop_urls = [
     path("detail/", ShopDetailView.as_view(), name="shop_detail"),
     path("data/", ShopDataView.as_view(), name="shop_data"),
+    path("data/export/", ShopExportView.as_view(), name="shop_data_export"),
     path("orders/", ShopOrderView.as_view(), name="shop_order"),
 ]
 
@@ -1,4 +1,6 @@
 import os
+import re
+from math import isfinite
 from uuid import uuid4
 
 from django.conf import settings
@@ -114,6 +116,26 @@ def get_path_upload_product_photo(instance, file):
     return f"images/products/{instance.slug}/{file}"
 
 
+NUMERIC_VALUE_PATTERN = re.compile(r"^([+-]?\d+(?:[.,]\d+)?)\s*([^\d\s][^\d]*)?$")
+UNIT_MAX_LENGTH = 20
+
+
+def parse_numeric_value(value):
+    """
+    Разбирает значение параметра товара вида "6.5", "512" или "2,4 ГГц".
+    Возвращает (число, единица измерения) или (None, ""), если значение
+    не является числом с необязательной единицей измерения.
+    """
+    match = NUMERIC_VALUE_PATTERN.match(str(value).strip())
+    if not match:
+        return None, ""
+    number = float(match.group(1).replace(",", "."))
+    unit = (match.group(2) or "").strip()
+    if not isfinite(number) or len(unit) > UNIT_MAX_LENGTH:
+        return None, ""
+    return number, unit
+
+
 class RemoveAfterCloseFileProxy(FileProxyMixin):
     """
     Прокси-объект для работы с файлом, который будет удален после его закрытия.
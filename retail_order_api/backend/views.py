@@ -1,9 +1,11 @@
+from decimal import Decimal, InvalidOperation
+
 from celery.result import AsyncResult
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
 from django.db import IntegrityError, transaction
 from django.db.models import F, Q
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.urls import reverse
 from django.views import View
 from django_filters import rest_framework
@@ -14,7 +16,14 @@ from rest_framework.response import Response
 from social_django.utils import load_backend, load_strategy
 from ujson import loads as load_json
 
-from backend.filters import ProductFilter
+from backend.exports import EXPORT_CONTENT_TYPES, export_catalog
+from backend.filters import (
+    ProductFilter,
+    filter_by_parameters,
+    parameter_facets,
+    parse_parameter_filters,
+)
+from backend.importer import ImportProgress, StockUpdater
 from backend.models import (
     Category,
     Contact,
@@ -22,16 +31,17 @@ from backend.models import (
     OrderItem,
     Product,
     ProductInfo,
-    ProductParameter,
     Shop,
 )
 from backend.pagination import (
     CategoryPagination,
+    ImportChangesPagination,
     ProductPagination,
     ProductShopPagination,
     ShopPagination,
 )
 from backend.permissions import IsBuyerUser, IsShopUser
+from backend.search import search_products
 from backend.serializers import (
     CategoryListSerializer,
     ContactSerializer,
@@ -44,7 +54,11 @@ from backend.serializers import (
     ShopListSerializer,
 )
 from backend.signals import new_order
-from backend.tasks import delete_cached_files_celery, do_import_celery
+from backend.tasks import (
+    delete_cached_files_celery,
+    enqueue_import,
+    export_catalog_celery,
+)
 from retail_order_api import settings
 
 
@@ -80,17 +94,42 @@ class RedirectSocialView(View):
 
 @extend_schema(tags=["Celery результат"])
 class CeleryTaskResultView(views.APIView):
-    """Получение результата задачи celery по идентификатору."""
+    """
+    Получение результата задачи celery по идентификатору.
+
+    Для выполняющегося импорта (статус PROGRESS) в task_progress возвращается
+    текущий этап, количество обработанных элементов, их общее количество
+    и скорость обработки.
+
+    Список изменений проверки прайс-листа (dry_run) возвращается
+    постранично, страница задается параметрами page и page_size.
+    Для выгрузки каталога возвращается полная ссылка на файл в export_url.
+    """
 
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, task_id):
         task_result = AsyncResult(task_id)
+        in_progress = task_result.status == ImportProgress.state
         result = {
             "task_id": task_id,
             "task_status": task_result.status,
-            "task_result": task_result.result,
+            "task_result": None if in_progress else task_result.result,
+            "task_progress": task_result.info if in_progress else None,
         }
+        task_data = result["task_result"]
+        if isinstance(task_data, dict) and "Changes" in task_data:
+            paginator = ImportChangesPagination()
+            changes = paginator.paginate_queryset(
+                task_data["Changes"], request, view=self
+            )
+            result["task_result"] = {**task_data, "Changes": changes}
+            return paginator.get_paginated_response(result)
+        if isinstance(task_data, dict) and "export_url" in task_data:
+            result["task_result"] = {
+                **task_data,
+                "export_url": request.build_absolute_uri(task_data["export_url"]),
+            }
         return Response(result)
 
 
@@ -99,6 +138,7 @@ class ShopListView(generics.ListAPIView):
     """
     Получение списка магазинов с пагинацией
     и фильтрацией с помощью GET-параметра search.
+    С параметром cursor страницы выводятся по курсору без подсчета количества.
     """
 
     queryset = Shop.objects.filter(state=True)
@@ -113,6 +153,7 @@ class CategoryListView(generics.ListAPIView):
     """
     Получение списка категорий с пагинацией
     и фильтрацией с помощью GET-параметра search.
+    С параметром cursor страницы выводятся по курсору без подсчета количества.
     """
 
     queryset = Category.objects.all()
@@ -126,8 +167,9 @@ class CategoryListView(generics.ListAPIView):
 class ProductListView(generics.ListAPIView):
     """
     Получение списка продуктов с пагинацией и фильтрацией с помощью GET-параметров:
-    - product - поиск продуктов по подстроке в их названии;
-    - category - поиск продуктов по подстроке в названии категории.
+    - product - поиск продуктов по названию с сортировкой по релевантности;
+    - category - поиск продуктов по подстроке в названии категории;
+    - cursor - вывод страниц по курсору без подсчета количества.
     """
 
     queryset = Product.objects.all()
@@ -307,6 +349,12 @@ class ShopDataView(views.APIView):
 
     pagination_class = ProductShopPagination
     permission_classes = [IsShopUser]
+    import_messages = {
+        "started": "Начали обрабатывать данные.",
+        "joined": "Такой же импорт уже выполняется.",
+        "queued": "Импорт магазина уже выполняется, запрос отложен до его "
+        "завершения.",
+    }
 
     @staticmethod
     def _process_url(url):
@@ -326,8 +374,59 @@ class ShopDataView(views.APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+    @staticmethod
+    def _get_choice(request, name, choices, default=None):
+        """Возвращает значение параметра запроса из списка допустимых."""
+        value = request.data.get(name) or default
+        if value is not None and value not in dict(choices):
+            return Response(
+                {
+                    "Status": False,
+                    "Errors": f"Недопустимое значение {name}: {value}. "
+                    f"Доступные значения: {', '.join(dict(choices))}.",
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return value
+
+    @staticmethod
+    def _get_flag(request, name):
+        """Возвращает значение логического параметра запроса."""
+        value = request.data.get(name, False)
+        if isinstance(value, str):
+            return value.lower() in ("1", "true", "yes")
+        return bool(value)
+
+    @staticmethod
+    def _export(shop, feed_format):
+        """Потоковая выгрузка каталога магазина в формате прайс-листа."""
+        if feed_format not in EXPORT_CONTENT_TYPES:
+            return Response(
+                {
+                    "Status": False,
+                    "Errors": f"Недопустимое значение feed_format: {feed_format}. "
+                    f"Доступные значения: {', '.join(EXPORT_CONTENT_TYPES)}.",
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        response = StreamingHttpResponse(
+            export_catalog(shop, feed_format),
+            content_type=f"{EXPORT_CONTENT_TYPES[feed_format]}; charset=utf-8",
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="shop_{shop.id}.{feed_format}"'
+        )
+        return response
+
     def get(self, request, *args, **kwargs):
-        """Получает информацию о всех товарах магазина."""
+        """
+        Получает информацию о всех товарах магазина.
+
+        С параметром feed_format (yaml, json или ndjson) весь каталог выгружается
+        потоком в формате прайс-листа, который можно загрузить обратно
+        через POST. Без него товары возвращаются постранично: по номеру
+        страницы или, с параметром cursor, по курсору без подсчета количества.
+        """
 
         shop = (
             Shop.objects.filter(user=request.user)
@@ -341,12 +440,15 @@ class ShopDataView(views.APIView):
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        products_info = ProductInfo.objects.filter(shop=shop).select_related(
-            "product__category"
+        feed_format = request.query_params.get("feed_format")
+        if feed_format:
+            return self._export(shop, feed_format)
+
+        products_info = (
+            ProductInfo.objects.filter(shop=shop, catalog_version=shop.catalog_version)
+            .select_related("product__category")
+            .order_by("id")
         )
-        product_parameters = ProductParameter.objects.filter(
-            product_info__shop=shop
-        ).select_related("parameter")
 
         # Применяем пагинацию
         paginator = self.pagination_class()
@@ -355,20 +457,10 @@ class ShopDataView(views.APIView):
         # Данные для выгрузки
         data = {
             "shop_name": shop.name,
-            "categories": list(shop.categories.values_list("name", flat=True)),
+            "categories": [category.name for category in shop.categories.all()],
             "goods": [],
         }
 
-        # Обработка параметров товара
-        product_parameters_dict = {}
-        for parameter in product_parameters:
-            product_info_id = parameter.product_info_id
-            if product_info_id not in product_parameters_dict:
-                product_parameters_dict[product_info_id] = {}
-            product_parameters_dict[product_info_id][
-                parameter.parameter.name
-            ] = parameter.value
-
         # Обработка информации о товарах
         for product_info in result_page:
             product_data = {
@@ -379,7 +471,7 @@ class ShopDataView(views.APIView):
                 "price": product_info.price,
                 "price_rrp": product_info.price_rrp,
                 "quantity": product_info.quantity,
-                "parameters": product_parameters_dict.get(product_info.id, {}),
+                "parameters": product_info.parameters,
             }
 
             data["goods"].append(product_data)
@@ -388,16 +480,60 @@ class ShopDataView(views.APIView):
         return paginator.get_paginated_response({"Status": True, "Data": data})
 
     def post(self, request, *args, **kwargs):
-        """Загрузить товары магазина из файла .yaml с использованием Celery."""
+        """
+        Загрузить товары магазина из файла с использованием Celery.
+
+        Поддерживаются форматы yaml, json, ndjson и csv. Формат задается
+        параметром feed_format или определяется по Content-Type ответа
+        и расширению файла.
+
+        Параметр mode задает режим импорта:
+        - replace - товары магазина удаляются и создаются заново (по умолчанию);
+        - upsert - изменяются только отличающиеся товары, удаляются только
+        отсутствующие в файле;
+        - parallel - как replace, но товары записываются в новую версию
+        каталога частями параллельными задачами Celery, магазин переключается
+        на нее после записи всех частей.
+
+        Если прайс-лист не изменился с последнего успешного импорта, задача
+        завершается без записи в БД. Параметр force=true отключает проверку.
+
+        Параметр dry_run=true только проверяет прайс-лист и сравнивает его
+        с текущими товарами магазина: результат задачи содержит сводку
+        и постраничный список изменений, БД не изменяется.
+
+        Одновременно выполняется только один импорт магазина. Если такой же
+        импорт уже выполняется, возвращается его result_url, иначе запрос
+        откладывается до завершения текущего импорта. Отложенный импорт
+        один: повторные запросы объединяются, выполняется последний из них.
+        """
         url = request.data.get("url")
         check_url = self._process_url(url)
 
         if isinstance(check_url, Response):
             return check_url
 
-        # Вызов Celery задачи
-        task_result = do_import_celery.delay(url, request.user.id)
-        task_id = task_result.id
+        mode = self._get_choice(
+            request, "mode", settings.IMPORT_MODE_CHOICES, settings.IMPORT_DEFAULT_MODE
+        )
+        if isinstance(mode, Response):
+            return mode
+
+        feed_format = self._get_choice(
+            request, "feed_format", settings.IMPORT_FORMAT_CHOICES
+        )
+        if isinstance(feed_format, Response):
+            return feed_format
+
+        # Вызов Celery задачи с учетом выполняющегося импорта магазина
+        task_id, import_status = enqueue_import(
+            url,
+            request.user.id,
+            mode=mode,
+            force=self._get_flag(request, "force"),
+            feed_format=feed_format,
+            dry_run=self._get_flag(request, "dry_run"),
+        )
 
         # Создание URL для просмотра результатов
         result_url = reverse("backend:task-result", kwargs={"task_id": task_id})
@@ -405,7 +541,92 @@ class ShopDataView(views.APIView):
         return Response(
             {
                 "Status": True,
-                "Message": "Начали обрабатывать данные.",
+                "Message": self.import_messages[import_status],
+                "import_status": import_status,
+                "result_url": result_url,
+            }
+        )
+
+    def patch(self, request, *args, **kwargs):
+        """
+        Изменить остатки и цены отдельных товаров без загрузки прайс-листа.
+
+        Тело запроса - список записей {"external_id": ..., "quantity": ...,
+        "price": ..., "price_rrp": ...}, поля кроме external_id необязательны.
+        Изменяется активная версия каталога магазина. Для каждой записи
+        возвращается результат со статусом updated, unchanged, not_found
+        или error. Выполняющийся импорт прайс-листа перезапишет изменения
+        значениями из файла.
+        """
+        shop = Shop.objects.filter(user=request.user).first()
+        if not shop:
+            return Response(
+                {"Status": False, "Errors": "Магазин не найден."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        records = request.data
+        if not isinstance(records, list) or not records:
+            return Response(
+                {"Status": False, "Errors": "Ожидается непустой список товаров."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(records) > settings.SHOP_DATA_PATCH_MAX_ITEMS:
+            return Response(
+                {
+                    "Status": False,
+                    "Errors": "Количество товаров в запросе превышает "
+                    f"{settings.SHOP_DATA_PATCH_MAX_ITEMS}.",
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        updater = StockUpdater(shop)
+        results = updater.apply(records)
+        return Response(
+            {"Status": True, "Summary": updater.summary, "Results": results}
+        )
+
+
+@extend_schema(tags=["Магазин"])
+class ShopExportView(views.APIView):
+    """Асинхронная выгрузка каталога магазина в сжатый файл."""
+
+    permission_classes = [IsShopUser]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Запустить выгрузку каталога магазина задачей Celery.
+
+        Параметр feed_format задает формат файла: yaml (по умолчанию), json
+        или ndjson. Файл сжимается gzip и сохраняется в media, ссылка на него
+        возвращается в export_url результата задачи. Если каталог
+        не изменился с прошлой выгрузки, используется сохраненный файл.
+        """
+        shop = Shop.objects.filter(user=request.user).first()
+        if not shop:
+            return Response(
+                {"Status": False, "Errors": "Магазин не найден."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        feed_format = request.data.get("feed_format") or "yaml"
+        if feed_format not in EXPORT_CONTENT_TYPES:
+            return Response(
+                {
+                    "Status": False,
+                    "Errors": f"Недопустимое значение feed_format: {feed_format}. "
+                    f"Доступные значения: {', '.join(EXPORT_CONTENT_TYPES)}.",
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        task = export_catalog_celery.delay(shop.id, feed_format)
+        result_url = reverse("backend:task-result", kwargs={"task_id": task.id})
+        return Response(
+            {
+                "Status": True,
+                "Message": "Начали выгрузку каталога.",
                 "result_url": result_url,
             }
         )
@@ -416,37 +637,98 @@ class ProductInShopView(views.APIView, ProductPagination):
 
     pagination_class = ProductPagination
     permission_classes = [permissions.IsAuthenticated]
+    # Сортировки с уникальным ключом для постраничного вывода по курсору
+    orderings = {
+        "price": ("price", "id"),
+        "-price": ("-price", "id"),
+        "name": ("product__name", "id"),
+        "-name": ("-product__name", "id"),
+        "discount": ("discount", "id"),
+        "-discount": ("-discount", "id"),
+    }
 
     def get(self, request, *args, **kwargs):
         """
         Получение подробной информации о товарах в магазинах
         на основе заданных фильтров.
+
+        Параметры товаров фильтруются GET-параметрами вида
+        param[<название>]=<значение>, повторение параметра задает несколько
+        допустимых значений. Числовые параметры фильтруются по диапазону:
+        param[<название>][min]=<число> и param[<название>][max]=<число>.
+        В facets ответа - количество найденных товаров по значениям
+        каждого параметра.
+
+        price_min и price_max ограничивают цену, ordering задает сортировку:
+        price, name, discount (скидка от рекомендуемой розничной цены),
+        с "-" - по убыванию. Без ordering поиск по product сортируется
+        по релевантности. Параметр cursor включает постраничный вывод
+        по ключу сортировки без подсчета количества (см. KeysetPagination):
+        пустое значение - первая страница, далее - ссылка из next.
         """
         query = Q(shop__state=True)
 
         shop_id = request.query_params.get("shop_id")
         category_id = request.query_params.get("category_id")
         product = request.query_params.get("product")
+        ordering = request.query_params.get("ordering")
 
         if shop_id:
             query = query & Q(shop_id=shop_id)
         if category_id:
             query = query & Q(product__category_id=category_id)
-        if product:
-            query = query & Q(product__name__icontains=product)
+        for param, lookup in (("price_min", "gte"), ("price_max", "lte")):
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            try:
+                price = Decimal(value)
+            except InvalidOperation:
+                price = None
+            if price is None or not price.is_finite():
+                return Response(
+                    {"Status": False, "Errors": f"Неверное значение {param}: {value}."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            query = query & Q(**{f"price__{lookup}": price})
+        if ordering and ordering not in self.orderings:
+            return Response(
+                {
+                    "Status": False,
+                    "Errors": f"Недопустимое значение ordering: {ordering}. "
+                    f"Доступные значения: {', '.join(self.orderings)}.",
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
         # Фильтруем и отбрасываем дубликаты
         queryset = (
-            ProductInfo.objects.filter(query)
+            ProductInfo.objects.active()
+            .filter(query)
             .select_related("shop", "product__category")
-            .prefetch_related("product_parameters__parameter")
             .distinct()
         )
+        try:
+            parameter_filters = parse_parameter_filters(request.query_params)
+        except ValueError as error:
+            return Response(
+                {"Status": False, "Errors": str(error)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        queryset = filter_by_parameters(queryset, parameter_filters)
+        if product:
+            # Сортировка по релевантности поиска
+            queryset = search_products(queryset, product, "product__")
+        if ordering:
+            queryset = queryset.annotate(discount=F("price_rrp") - F("price"))
+            queryset = queryset.order_by(*self.orderings[ordering])
 
         # Обработка пагинации
         paginated_queryset = self.paginate_queryset(queryset, request)
         serializer = ProductInfoSerializer(paginated_queryset, many=True)
-        return self.get_paginated_response(serializer.data)
+        response = self.get_paginated_response(serializer.data)
+        response.data["facets"] = parameter_facets(queryset)
+        return response
 
 
 @extend_schema(tags=["Корзина"])
@@ -486,10 +768,7 @@ class BuyerBasketView(views.APIView):
         """Получает список товаров в корзине покупателя."""
         basket = (
             Order.objects.filter(user_id=request.user.id, state="basket")
-            .prefetch_related(
-                "ordered_items__product_info__product__category",
-                "ordered_items__product_info__product_parameters__parameter",
-            )
+            .prefetch_related("ordered_items__product_info__product__category")
             .distinct()
         )
 
@@ -664,10 +943,7 @@ class BuyerOrderView(views.APIView):
         order = (
             Order.objects.filter(user_id=request.user.id)
             .exclude(state="basket")
-            .prefetch_related(
-                "ordered_items__product_info__product__category",
-                "ordered_items__product_info__product_parameters__parameter",
-            )
+            .prefetch_related("ordered_items__product_info__product__category")
             .select_related("contact")
             .distinct()
         )
@@ -709,12 +985,21 @@ class BuyerOrderView(views.APIView):
         # Проверка доступного количества товара у продавца
         with transaction.atomic():
             remaining_items = []  # Товары корзины после проверки наличия
+            # Товары активных версий каталогов магазинов
+            active_ids = set(
+                ProductInfo.objects.active()
+                .filter(ordered_items_info__order=order)
+                .values_list("id", flat=True)
+            )
 
             for order_item in order.ordered_items.all():
                 available_quantity = order_item.product_info.quantity
+                if order_item.product_info_id not in active_ids:
+                    available_quantity = 0
 
                 if available_quantity == 0:
                     # Удаляем товар из корзины, если 0 шт. у магазина
+                    # или товар удален из каталога магазина
                     order_item.delete()
                     continue
 
@@ -731,10 +1016,7 @@ class BuyerOrderView(views.APIView):
                 # Получаем обновленные данные заказа
                 updated_basket = (
                     Order.objects.filter(user_id=request.user.id, state="basket")
-                    .prefetch_related(
-                        "ordered_items__product_info__product__category",
-                        "ordered_items__product_info__product_parameters__parameter",
-                    )
+                    .prefetch_related("ordered_items__product_info__product__category")
                     .select_related("contact")
                     .distinct()
                 )
@@ -787,10 +1069,7 @@ class ShopOrderView(views.APIView):
                 ordered_items__product_info__shop__user_id=request.user.id
             )
             .exclude(state="basket")
-            .prefetch_related(
-                "ordered_items__product_info__product__category",
-                "ordered_items__product_info__product_parameters__parameter",
-            )
+            .prefetch_related("ordered_items__product_info__product__category")
             .select_related("contact")
             .distinct()
         )
@@ -21,6 +21,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "django_filters",
     "backend.apps.BackendConfig",
@@ -208,6 +209,33 @@ SPECTACULAR_SETTINGS = {
 # Celery
 CELERY_RESULT_BACKEND = env.str("CELERY_RESULT_BACKEND", "redis://localhost:6379")
 CELERY_BROKER_URL = env.str("CELERY_BROKER_URL", "redis://localhost:6379")
+CELERY_BEAT_SCHEDULE = {
+    # Запуск импортов магазинов по расписанию
+    "schedule-imports": {
+        "task": "backend.tasks.schedule_imports_celery",
+        "schedule": 60.0,
+    },
+}
+
+# Кэш общий для web и Celery: в нем хранятся блокировки импорта и версии
+# справочников имен, поэтому кэш в памяти процесса не подходит.
+# По умолчанию используется Redis брокера Celery
+CACHES = {
+    "default": {
+        "BACKEND": env.str(
+            "CACHE_BACKEND", "django.core.cache.backends.redis.RedisCache"
+        ),
+        "LOCATION": env.str("CACHE_LOCATION", CELERY_BROKER_URL),
+    }
+}
+
+# Кэш разобранных прайс-листов на диске, пустое значение отключает кэш
+IMPORT_CACHE_DIR = env.str("IMPORT_CACHE_DIR", os.path.join(BASE_DIR, "cache", "feeds"))
+# Файлы частей импорта в режиме parallel, каталог должен быть доступен
+# всем процессам Celery
+IMPORT_PARALLEL_DIR = env.str(
+    "IMPORT_PARALLEL_DIR", os.path.join(BASE_DIR, "cache", "chunks")
+)
 
 # django-baton
 BATON = {
@@ -313,6 +341,48 @@ WHITELISTED_IMAGE_TYPES = {
     ".png": "image/png",
 }
 IMAGE_MAX_SIZE_MB = 3
+IMPORT_BATCH_SIZE = 1000  # Размер пачки товаров при импорте
+IMPORT_MODE_CHOICES = (
+    ("replace", "Полная замена товаров"),
+    ("upsert", "Обновление изменившихся товаров"),
+    ("parallel", "Полная замена товаров с записью частями параллельно"),
+)
+IMPORT_FORMAT_CHOICES = (
+    ("yaml", "YAML"),
+    ("json", "JSON"),
+    ("ndjson", "NDJSON"),
+    ("csv", "CSV"),
+)
+IMPORT_PARALLEL_CHUNK_SIZE = 5000  # Размер части товаров в режиме parallel
+IMPORT_DEFAULT_MODE = "replace"
+IMPORT_PROGRESS_INTERVAL = 1  # Интервал публикации хода импорта, секунды
+IMPORT_FETCH_CONNECT_TIMEOUT = 5  # Таймаут соединения при загрузке прайс-листа, с
+IMPORT_FETCH_READ_TIMEOUT = 30  # Таймаут ожидания данных, с
+IMPORT_FETCH_MAX_DURATION = 600  # Максимальная длительность загрузки, с
+IMPORT_FETCH_MAX_SIZE_MB = 500  # Максимальный размер прайс-листа
+IMPORT_FETCH_RETRIES = 3  # Количество повторных попыток загрузки
+IMPORT_FETCH_BACKOFF = 0.5  # Множитель задержки между попытками, с
+IMPORT_FETCH_POOL_SIZE = 10  # Размер пула соединений на хост
+IMPORT_CHUNK_BYTES = 64 * 1024  # Размер блока при чтении прайс-листа
+IMPORT_SPOOL_MAX_SIZE = 8 * 1024 * 1024  # Прайс-лист больше хранится на диске
+IMPORT_LOCK_TIMEOUT = 60 * 60  # Время жизни блокировки импорта магазина, с
+IMPORT_USE_COPY = True  # Загрузка товаров через COPY при работе с PostgreSQL
+IMPORT_CACHE_MAX_SIZE_MB = 1024  # Размер кэша разобранных прайс-листов
+IMPORT_CACHE_MAX_FEED_SIZE_MB = 100  # Прайс-листы больше не кэшируются
+# Пакетный импорт магазинов (команда import_shops)
+IMPORT_BATCH_FETCH_WORKERS = 8  # Параллельные загрузки прайс-листов
+IMPORT_BATCH_PARSE_WORKERS = None  # Процессы разбора, None - по числу CPU
+IMPORT_BATCH_DB_WORKERS = 2  # Параллельные записи в базу данных
+# Импорт по расписанию (задача schedule_imports_celery)
+IMPORT_SCHEDULE_INTERVAL = 60  # Интервал обновления по умолчанию, мин
+IMPORT_SCHEDULE_JITTER = 0.1  # Случайное отклонение времени импорта, доля интервала
+IMPORT_SCHEDULE_MAX_BACKOFF = 24 * 60  # Максимальная задержка после ошибок, мин
+IMPORT_SCHEDULE_MAX_CONCURRENT = 10  # Одновременные импорты по расписанию
+SHOP_DATA_PATCH_MAX_ITEMS = 10000  # Товаров в запросе изменения остатков и цен
+EXPORT_CHUNK_SIZE = 2000  # Размер части товаров при выгрузке каталога
+EXPORT_DIR = "exports"  # Каталог сжатых выгрузок в хранилище файлов
+SEARCH_CONFIG = "russian"  # Конфигурация полнотекстового поиска PostgreSQL
+FACETS_MAX_VALUES = 50  # Значений параметра в фасетах списка товаров
 
 if DEBUG:
     # debug_toolbar
@@ -1,3 +1,6 @@
+from base64 import urlsafe_b64encode
+from json import dumps
+
 import pytest
 from django.core.exceptions import ObjectDoesNotExist
 from django.urls import reverse
@@ -5,15 +8,19 @@ from model_bakery import baker
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from backend import views
 from backend.models import (
     Category,
     Contact,
     CustomUser,
     Order,
     OrderItem,
+    Parameter,
     Product,
     ProductInfo,
+    ProductParameter,
     Shop,
+    ShopImportState,
 )
 
 
@@ -143,6 +150,47 @@ def test_list_view(client, url_name, model, factory, request):
     assert len(response.data["results"]) == len(instances)
 
 
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "url_name, factory",
+    [
+        ("shops", "shop_factory"),
+        ("categories", "category_factory"),
+        ("products", "product_with_category_factory"),
+    ],
+)
+def test_list_view_cursor_pagination(
+    authenticated_client_buyer, url_name, factory, request
+):
+    client, _ = authenticated_client_buyer
+    url = reverse(f"backend:{url_name}")
+    instances = request.getfixturevalue(factory)(_quantity=5)
+
+    ids = []
+    response = client.get(url, {"cursor": "", "page_size": 2})
+    while True:
+        assert response.status_code == status.HTTP_200_OK
+        assert "count" not in response.data
+        ids += [item["id"] for item in response.data["results"]]
+        if response.data["next"] is None:
+            break
+        response = client.get(response.data["next"])
+
+    assert sorted(ids) == sorted(instance.id for instance in instances)
+
+
+@pytest.mark.django_db
+def test_product_list_search(client, product_with_category_factory):
+    url = reverse("backend:products")
+    product = product_with_category_factory(name="Смартфон Apple iPhone 15")
+    product_with_category_factory(name="Samsung Galaxy")
+
+    response = client.get(url, {"product": "iphone"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [item["id"] for item in response.data["results"]] == [product.id]
+
+
 @pytest.mark.django_db
 class TestBuyerContactsView:
     """Тесты для BuyerContactsView."""
@@ -384,6 +432,217 @@ class TestProductDetailView:
 
         self.assert_response(response, expected_product_info_ids)
 
+    def test_search_products_ordered_by_relevance(
+        self,
+        authenticated_client_buyer,
+        shop_factory,
+        product_with_category_factory,
+        product_info_factory,
+    ):
+        client, _ = authenticated_client_buyer
+        shop = shop_factory(state=True)
+
+        product_1 = product_with_category_factory(name="Кабель USB-C Lightning")
+        product_2 = product_with_category_factory(name="Кабель USB-C - USB-C")
+        product_with_category_factory(name="Зарядное устройство")
+        info_1 = product_info_factory(shop=shop, product=product_1)
+        info_2 = product_info_factory(shop=shop, product=product_2)
+
+        response = client.get(self.url, {"product": "usb"})
+
+        assert response.status_code == status.HTTP_200_OK
+        response_ids = [product_info["id"] for product_info in response.data["results"]]
+        assert response_ids == [info_2.id, info_1.id]
+
+    def test_filter_by_parameters_with_facets(
+        self,
+        authenticated_client_buyer,
+        shop_factory,
+        product_with_category_factory,
+        product_info_factory,
+    ):
+        client, _ = authenticated_client_buyer
+        shop = shop_factory(state=True)
+        color = baker.make(Parameter, name="Цвет")
+        memory = baker.make(Parameter, name="Встроенная память (Гб)")
+
+        products_info = [
+            product_info_factory(shop=shop, product=product_with_category_factory())
+            for _ in range(4)
+        ]
+        for product_info, (color_value, memory_value) in zip(
+            products_info,
+            [("черный", "128"), ("черный", "256"), ("белый", "128"), ("синий", "128")],
+        ):
+            baker.make(
+                ProductParameter,
+                product_info=product_info,
+                parameter=color,
+                value=color_value,
+            )
+            baker.make(
+                ProductParameter,
+                product_info=product_info,
+                parameter=memory,
+                value=memory_value,
+            )
+            product_info.sync_parameters()
+
+        response = client.get(
+            self.url,
+            {
+                "param[Цвет]": ["черный", "белый"],
+                "param[Встроенная память (Гб)]": "128",
+                "page_size": 10,
+            },
+        )
+
+        self.assert_response(response, [products_info[0].id, products_info[2].id])
+        assert response.data["facets"] == {
+            "Встроенная память (Гб)": {"128": 2},
+            "Цвет": {"белый": 1, "черный": 1},
+        }
+
+        response = client.get(self.url, {"param[Вес]": "1"})
+
+        self.assert_response(response, [])
+        assert response.data["facets"] == {}
+
+        response = client.get(
+            self.url,
+            {
+                "param[Встроенная память (Гб)][min]": "200",
+                "param[Встроенная память (Гб)][max]": "512",
+            },
+        )
+
+        self.assert_response(response, [products_info[1].id])
+
+        response = client.get(self.url, {"param[Встроенная память (Гб)][min]": "x"})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data["Status"] is False
+
+    def test_filter_by_renamed_and_deleted_parameter(
+        self,
+        authenticated_client_buyer,
+        shop_factory,
+        product_with_category_factory,
+        product_info_factory,
+    ):
+        client, _ = authenticated_client_buyer
+        shop = shop_factory(state=True)
+        color = baker.make(Parameter, name="Цвет")
+        product_info = product_info_factory(
+            shop=shop, product=product_with_category_factory()
+        )
+        baker.make(
+            ProductParameter, product_info=product_info, parameter=color, value="черный"
+        )
+        product_info.sync_parameters()
+
+        color.name = "Цвет корпуса"
+        color.save()
+
+        response = client.get(self.url, {"param[Цвет корпуса]": "черный"})
+
+        self.assert_response(response, [product_info.id])
+        product_info.refresh_from_db()
+        assert product_info.parameters == {"Цвет корпуса": "черный"}
+
+        color.delete()
+
+        product_info.refresh_from_db()
+        assert product_info.parameters == {}
+
+    def test_price_range_ordering_and_cursor(
+        self,
+        authenticated_client_buyer,
+        shop_factory,
+        product_with_category_factory,
+        product_info_factory,
+    ):
+        client, _ = authenticated_client_buyer
+        shop = shop_factory(state=True)
+        products_info = [
+            product_info_factory(
+                shop=shop,
+                product=product_with_category_factory(),
+                price=price,
+                price_rrp=price_rrp,
+            )
+            for price, price_rrp in [
+                (300, 310),
+                (100, 150),
+                (200, 400),
+                (100, 100),
+                (500, 900),
+            ]
+        ]
+        params = {
+            "price_min": "100",
+            "price_max": "300",
+            "ordering": "-price",
+            "page_size": 2,
+            "cursor": "",
+        }
+
+        response = client.get(self.url, params)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert "count" not in response.data
+        assert [item["id"] for item in response.data["results"]] == [
+            products_info[0].id,
+            products_info[2].id,
+        ]
+
+        response = client.get(response.data["next"])
+
+        assert [item["id"] for item in response.data["results"]] == [
+            products_info[1].id,
+            products_info[3].id,
+        ]
+        assert response.data["next"] is None
+
+        response = client.get(self.url, {"ordering": "-discount", "page_size": 10})
+
+        assert [item["id"] for item in response.data["results"]] == [
+            products_info[index].id for index in (4, 2, 1, 0, 3)
+        ]
+
+    @pytest.mark.parametrize(
+        "params",
+        [
+            {"ordering": "quantity"},
+            {"price_min": "abc"},
+            {"price_max": "NaN"},
+        ],
+    )
+    def test_invalid_price_and_ordering(self, authenticated_client_buyer, params):
+        client, _ = authenticated_client_buyer
+
+        response = client.get(self.url, params)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data["Status"] is False
+
+    def test_invalid_cursor(self, authenticated_client_buyer):
+        client, _ = authenticated_client_buyer
+
+        response = client.get(self.url, {"cursor": "bad", "ordering": "price"})
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    @pytest.mark.parametrize("values", [["abc", 1], [{"a": 1}, 1], [None, 1], [1, "x"]])
+    def test_tampered_cursor(self, authenticated_client_buyer, values):
+        client, _ = authenticated_client_buyer
+        data = dumps({"o": ["price", "id"], "v": values}).encode()
+        cursor = urlsafe_b64encode(data).decode().rstrip("=")
+
+        response = client.get(self.url, {"cursor": cursor, "ordering": "price"})
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
 
 @pytest.mark.django_db
 class TestBuyerBasketView:
@@ -566,6 +825,24 @@ class TestBuyerOrderView:
             == response.data["Errors"]
         )
 
+    def test_post_skips_superseded_products(
+        self, contact_factory, add_products_with_state
+    ):
+        """Товары неактивной версии каталога магазина не попадают в заказ."""
+        client, order, added_product_info_ids = add_products_with_state(state="basket")
+        contact = contact_factory(user=order.user)
+        superseded = ProductInfo.objects.get(id=added_product_info_ids[0])
+        Shop.objects.filter(id=superseded.shop_id).update(
+            catalog_version=superseded.catalog_version + 1
+        )
+
+        response = client.post(self.url, data={"contact_id": contact.id})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert not order.ordered_items.filter(product_info=superseded).exists()
+        superseded.refresh_from_db()
+        assert superseded.quantity == 10  # Количество не уменьшилось
+
     def test_post_more_than_available_products(
         self, contact_factory, add_products_with_state
     ):
@@ -673,3 +950,262 @@ class TestShopOrderView:
         ).values_list("id", flat=True)
         response_order_ids = [order["id"] for order in response.data["Orders"]]
         assert sorted(expected_order_ids) == sorted(response_order_ids)
+
+
+@pytest.mark.django_db
+def test_celery_task_result_progress(authenticated_client_shop, monkeypatch):
+    client, _ = authenticated_client_shop
+    progress = {"phase": "goods", "done": 10, "total": None, "items_per_second": 5}
+
+    class FakeAsyncResult:
+        status = "PROGRESS"
+        info = result = progress
+
+        def __init__(self, task_id):
+            self.id = task_id
+
+    monkeypatch.setattr(views, "AsyncResult", FakeAsyncResult)
+
+    response = client.get(reverse("backend:task-result", args=["task-id"]))
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["task_status"] == "PROGRESS"
+    assert response.data["task_progress"] == progress
+    assert response.data["task_result"] is None
+
+
+@pytest.mark.django_db
+def test_celery_task_result_paginates_changes(authenticated_client_shop, monkeypatch):
+    client, _ = authenticated_client_shop
+    changes = [{"id": index, "action": "insert"} for index in range(5)]
+
+    class FakeAsyncResult:
+        status = "SUCCESS"
+        info = result = {"Status": True, "DryRun": True, "Changes": changes}
+
+        def __init__(self, task_id):
+            self.id = task_id
+
+    monkeypatch.setattr(views, "AsyncResult", FakeAsyncResult)
+
+    response = client.get(
+        reverse("backend:task-result", args=["task-id"]), {"page": 2, "page_size": 2}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["count"] == 5
+    assert response.data["results"]["task_result"]["Changes"] == changes[2:4]
+
+
+@pytest.mark.django_db
+class TestShopDataView:
+    """Тесты для ShopDataView."""
+
+    url = reverse("backend:shop_data")
+
+    def test_post_starts_import(self, authenticated_client_shop, monkeypatch):
+        client, user = authenticated_client_shop
+        calls = []
+
+        def fake_enqueue_import(*args, **kwargs):
+            calls.append((args, kwargs))
+            return "task-id", "queued"
+
+        monkeypatch.setattr(views, "enqueue_import", fake_enqueue_import)
+        data = {
+            "url": "https://example.com/shop.csv",
+            "mode": "upsert",
+            "feed_format": "csv",
+            "force": "true",
+            "dry_run": True,
+        }
+
+        response = client.post(self.url, data, format="json")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["import_status"] == "queued"
+        assert response.data["result_url"] == reverse(
+            "backend:task-result", args=["task-id"]
+        )
+        assert calls == [
+            (
+                ("https://example.com/shop.csv", user.id),
+                {
+                    "mode": "upsert",
+                    "force": True,
+                    "feed_format": "csv",
+                    "dry_run": True,
+                },
+            )
+        ]
+
+    @pytest.mark.parametrize("field", ["mode", "feed_format"])
+    def test_post_invalid_choice(self, authenticated_client_shop, field):
+        client, _ = authenticated_client_shop
+        data = {"url": "https://example.com/shop.yaml", field: "unknown"}
+
+        response = client.post(self.url, data, format="json")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data["Status"] is False
+
+    def test_patch_updates_stock(
+        self,
+        authenticated_client_shop,
+        product_info_factory,
+        product_with_category_factory,
+        django_assert_max_num_queries,
+    ):
+        client, user = authenticated_client_shop
+        shop = baker.make(Shop, user=user)
+        baker.make(ShopImportState, shop=shop, content_hash="hash")
+        for external_id in (1, 2, 3):
+            product_info_factory(
+                shop=shop,
+                product=product_with_category_factory,
+                external_id=external_id,
+                quantity=5,
+                price=100,
+                price_rrp=110,
+            )
+        data = [
+            {"external_id": 1, "quantity": 0, "price": "99.50"},
+            {"external_id": 2, "quantity": 5},
+            {"external_id": 3, "price_rrp": 120},
+            {"external_id": 4, "quantity": 1},
+            {"external_id": 1, "quantity": 2},
+            {"external_id": 5, "quantity": -1},
+        ]
+
+        with django_assert_max_num_queries(7):
+            response = client.patch(self.url, data, format="json")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["Summary"] == {
+            "updated": 2,
+            "unchanged": 1,
+            "not_found": 1,
+            "errors": 2,
+        }
+        results = response.data["Results"]
+        assert [result["status"] for result in results] == [
+            "updated",
+            "unchanged",
+            "updated",
+            "not_found",
+            "error",
+            "error",
+        ]
+        assert results[0]["fields"] == ["price", "quantity"]
+        rows = {row.external_id: row for row in ProductInfo.objects.filter(shop=shop)}
+        assert (rows[1].quantity, str(rows[1].price)) == (0, "99.50")
+        assert (rows[2].quantity, str(rows[3].price_rrp)) == (5, "120.00")
+        assert ShopImportState.objects.get(shop=shop).content_hash == ""
+
+    def test_patch_requires_list(self, authenticated_client_shop):
+        client, user = authenticated_client_shop
+        baker.make(Shop, user=user)
+
+        response = client.patch(self.url, {"external_id": 1}, format="json")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data["Status"] is False
+
+    def test_get_exports_catalog_stream(
+        self,
+        authenticated_client_shop,
+        product_info_factory,
+        product_with_category_factory,
+    ):
+        client, user = authenticated_client_shop
+        shop = baker.make(Shop, user=user)
+        product_info_factory(
+            _quantity=3, shop=shop, product=product_with_category_factory
+        )
+
+        response = client.get(self.url, {"feed_format": "ndjson"})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response["Content-Type"].startswith("application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        assert len(lines) == 4
+        assert '"shop_name"' in lines[0]
+
+    def test_get_cursor_pages(
+        self,
+        authenticated_client_shop,
+        product_info_factory,
+        product_with_category_factory,
+    ):
+        client, user = authenticated_client_shop
+        shop = baker.make(Shop, user=user)
+        products_info = product_info_factory(
+            _quantity=3, shop=shop, product=product_with_category_factory
+        )
+
+        response = client.get(self.url, {"cursor": ""})
+
+        assert response.status_code == status.HTTP_200_OK
+        goods = response.data["results"]["Data"]["goods"]
+        assert [product["id"] for product in goods] == [
+            product_info.external_id for product_info in products_info[:2]
+        ]
+
+        response = client.get(response.data["next"])
+
+        goods = response.data["results"]["Data"]["goods"]
+        assert [product["id"] for product in goods] == [products_info[2].external_id]
+        assert response.data["next"] is None
+
+    def test_get_page_reads_parameters_from_product_info(
+        self,
+        authenticated_client_shop,
+        product_info_factory,
+        product_with_category_factory,
+        django_assert_num_queries,
+    ):
+        client, user = authenticated_client_shop
+        shop = baker.make(Shop, user=user)
+        products_info = product_info_factory(
+            _quantity=5, shop=shop, product=product_with_category_factory
+        )
+        for product_info in products_info:
+            baker.make(
+                ProductParameter,
+                product_info=product_info,
+                parameter=baker.make(Parameter),
+            )
+            product_info.sync_parameters()
+
+        with django_assert_num_queries(4):
+            response = client.get(self.url)
+
+        assert response.status_code == status.HTTP_200_OK
+        goods = response.data["results"]["Data"]["goods"]
+        assert [len(product["parameters"]) for product in goods] == [1, 1]
+
+
+@pytest.mark.django_db
+def test_shop_export_starts_task(authenticated_client_shop, monkeypatch):
+    client, user = authenticated_client_shop
+    shop = baker.make(Shop, user=user)
+    calls = []
+
+    class FakeTask:
+        id = "task-id"
+
+    def fake_delay(*args):
+        calls.append(args)
+        return FakeTask
+
+    monkeypatch.setattr(views.export_catalog_celery, "delay", fake_delay)
+
+    response = client.post(
+        reverse("backend:shop_data_export"), {"feed_format": "ndjson"}, format="json"
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["result_url"] == reverse(
+        "backend:task-result", args=["task-id"]
+    )
+    assert calls == [(shop.id, "ndjson")]
@@ -0,0 +1,1194 @@
+import gzip
+import os
+from csv import DictWriter
+from datetime import timedelta
+from decimal import InvalidOperation
+from io import BytesIO, StringIO
+
+import pytest
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.utils import timezone
+from model_bakery import baker
+from ujson import dumps as dump_json
+from ujson import loads as load_json
+from yaml import CSafeLoader, SafeLoader
+from yaml import dump as dump_yaml
+
+from backend import feeds, tasks
+from backend.exports import build_export, export_catalog
+from backend.feeds import CsvFeedReader, FeedCache, ParsedFeed
+from backend.importer import CatalogWriter, category_names, parameter_names
+from backend.locks import ImportLock
+from backend.models import (
+    Category,
+    CustomUser,
+    OrderItem,
+    Parameter,
+    Product,
+    ProductInfo,
+    ProductParameter,
+    Shop,
+    ShopImportState,
+)
+from backend.staging import CopyLoader
+from backend.utils import parse_numeric_value
+from retail_order_api import celery_app, settings
+
+URL = "https://example.com/shop.yaml"
+
+
+def make_feed(goods_count, shop_name="Магазин", first_id=1):
+    """Формирует данные прайс-листа с указанным количеством товаров."""
+    return {
+        "shop_name": shop_name,
+        "categories": ["Смартфоны", "Ноутбуки"],
+        "goods": [
+            {
+                "id": first_id + index,
+                "category": "Смартфоны" if index % 2 else "Ноутбуки",
+                "name": f"Товар {first_id + index}",
+                "model": f"model/{first_id + index}",
+                "price": 1000 + index,
+                "price_rrp": 1100 + index,
+                "quantity": 10,
+                "parameters": {"Цвет": "черный", "Память (Гб)": 128 + index},
+            }
+            for index in range(goods_count)
+        ],
+    }
+
+
+class FakeResponse:
+    def __init__(self, content, status_code=200, headers=None):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def iter_content(self, chunk_size=1):
+        stream = BytesIO(self.content)
+        while chunk := stream.read(chunk_size):
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def feed_cache_dir(tmp_path, monkeypatch):
+    """Кэш разобранных прайс-листов во временном каталоге теста."""
+    directory = tmp_path / "feed_cache"
+    monkeypatch.setattr(settings, "IMPORT_CACHE_DIR", str(directory))
+    return directory
+
+
+@pytest.fixture(autouse=True)
+def parallel_dir(tmp_path, monkeypatch):
+    """Файлы частей импорта parallel во временном каталоге теста."""
+    directory = tmp_path / "chunks"
+    monkeypatch.setattr(settings, "IMPORT_PARALLEL_DIR", str(directory))
+    return directory
+
+
+@pytest.fixture(autouse=True)
+def name_caches():
+    """Сбрасывает общие словари имен, так как тесты откатывают транзакции."""
+    category_names.invalidate()
+    parameter_names.invalidate()
+
+
+@pytest.fixture
+def shop_user():
+    return baker.make(CustomUser, type="shop")
+
+
+@pytest.fixture
+def serve_content(monkeypatch):
+    """
+    Подменяет загрузку прайс-листа по URL ответом с переданным содержимым.
+    Возвращает список заголовков отправленных запросов.
+    """
+    sent_headers = []
+
+    def _serve_content(content, **response_kwargs):
+        class FakeSession:
+            @staticmethod
+            def get(url, headers=None, **kwargs):
+                sent_headers.append(headers or {})
+                return FakeResponse(content, **response_kwargs)
+
+        monkeypatch.setattr(feeds.FeedFetcher, "_session", FakeSession)
+        return sent_headers
+
+    return _serve_content
+
+
+@pytest.fixture
+def serve_feed(serve_content):
+    """Подменяет загрузку прайс-листа по URL переданными данными."""
+
+    def _serve_feed(feed, sort_keys=True, **response_kwargs):
+        content = dump_yaml(feed, allow_unicode=True, sort_keys=sort_keys).encode()
+        return serve_content(content, **response_kwargs)
+
+    return _serve_feed
+
+
+@pytest.mark.django_db
+class TestDoImportCelery:
+    """Тесты для do_import_celery."""
+
+    def test_import_creates_catalog(self, shop_user, serve_feed):
+        serve_feed(make_feed(5))
+
+        result = tasks.do_import_celery(URL, shop_user.id)
+
+        assert result["Status"] is True
+        shop = Shop.objects.get(user=shop_user)
+        assert shop.name == "Магазин"
+        assert shop.categories.count() == 2
+        assert ProductInfo.objects.filter(shop=shop).count() == 5
+        assert Product.objects.count() == 5
+        assert set(Parameter.objects.values_list("name", flat=True)) == {
+            "Цвет",
+            "Память (Гб)",
+        }
+        assert ProductParameter.objects.filter(product_info__shop=shop).count() == 10
+        assert Product.objects.get(name="Товар 1").slug == "tovar-1"
+        assert ProductInfo.objects.get(external_id=1).parameters == {
+            "Цвет": "черный",
+            "Память (Гб)": "128",
+        }
+
+    def test_import_query_count_does_not_grow(
+        self, shop_user, serve_feed, django_assert_max_num_queries
+    ):
+        serve_feed(make_feed(10))
+        tasks.do_import_celery(URL, shop_user.id)
+
+        serve_feed(make_feed(300, first_id=1000))
+        with django_assert_max_num_queries(32):
+            result = tasks.do_import_celery(URL, shop_user.id)
+
+        assert result["Status"] is True
+        assert ProductInfo.objects.active().count() == 300
+
+    def test_import_reuses_existing_objects(self, shop_user, serve_feed):
+        category = baker.make(Category, name="Смартфоны")
+        baker.make(Product, name="Товар 2", category=category)
+
+        serve_feed(make_feed(2))
+        tasks.do_import_celery(URL, shop_user.id)
+
+        assert Category.objects.filter(name="Смартфоны").count() == 1
+        assert Product.objects.filter(name="Товар 2").count() == 1
+
+    def test_import_unknown_category(self, shop_user, serve_feed):
+        feed = make_feed(2)
+        feed["goods"][0]["category"] = "Неизвестная"
+        serve_feed(feed)
+
+        result = tasks.do_import_celery(URL, shop_user.id)
+
+        assert result["Status"] is False
+        assert not ProductInfo.objects.exists()
+
+    def test_upsert_keeps_product_info_ids(self, shop_user, serve_feed):
+        feed = make_feed(4)
+        serve_feed(feed)
+        tasks.do_import_celery(URL, shop_user.id, "upsert")
+        ids_before = dict(ProductInfo.objects.values_list("external_id", "id"))
+        order_item = baker.make(
+            OrderItem, product_info_id=ids_before[2], order__state="basket"
+        )
+
+        feed["goods"][0]["price"] = 5000  # id=1 - изменена цена
+        feed["goods"][1]["parameters"]["Цвет"] = "белый"  # id=2 - изменен параметр
+        del feed["goods"][2]  # id=3 - удален из прайс-листа
+        feed["goods"].append(make_feed(1, first_id=10)["goods"][0])  # id=10 - новый
+        serve_feed(feed)
+
+        result = tasks.do_import_celery(URL, shop_user.id, "upsert")
+
+        assert result["Stats"] == {
+            "inserted": 1,
+            "updated": 2,
+            "unchanged": 1,
+            "removed": 1,
+        }
+        ids_after = dict(ProductInfo.objects.values_list("external_id", "id"))
+        assert ids_after.keys() == {1, 2, 4, 10}
+        assert all(ids_after[key] == ids_before[key] for key in (1, 2, 4))
+        assert ProductInfo.objects.get(external_id=1).price == 5000
+        assert (
+            ProductParameter.objects.get(
+                product_info__external_id=2, parameter__name="Цвет"
+            ).value
+            == "белый"
+        )
+        assert OrderItem.objects.filter(id=order_item.id).exists()
+
+    @pytest.mark.parametrize("use_copy", [False, True])
+    def test_upsert_with_and_without_copy(
+        self, shop_user, serve_feed, monkeypatch, use_copy
+    ):
+        if use_copy and connection.vendor != "postgresql":
+            pytest.skip("COPY используется только с PostgreSQL.")
+        monkeypatch.setattr(settings, "IMPORT_USE_COPY", use_copy)
+        assert CopyLoader.is_supported() is use_copy
+        feed = make_feed(4)
+        serve_feed(feed)
+        tasks.do_import_celery(URL, shop_user.id, "upsert")
+        ids_before = dict(ProductInfo.objects.values_list("external_id", "id"))
+
+        feed["goods"][0]["name"] = "Новый товар"  # id=1 - изменен продукт
+        del feed["goods"][1]["parameters"]["Цвет"]  # id=2 - удален параметр
+        feed["goods"][2]["quantity"] = 0  # id=3 - изменено количество
+        feed["goods"][3]["parameters"]["Память (Гб)"] = "6,5 Тб"  # id=4
+        serve_feed(feed)
+
+        result = tasks.do_import_celery(URL, shop_user.id, "upsert")
+
+        assert result["Stats"] == {
+            "inserted": 0,
+            "updated": 4,
+            "unchanged": 0,
+            "removed": 0,
+        }
+        assert dict(ProductInfo.objects.values_list("external_id", "id")) == (
+            ids_before
+        )
+        assert ProductInfo.objects.get(external_id=1).product.name == "Новый товар"
+        assert list(
+            ProductParameter.objects.filter(product_info__external_id=2).values_list(
+                "parameter__name", flat=True
+            )
+        ) == ["Память (Гб)"]
+        assert ProductInfo.objects.get(external_id=3).quantity == 0
+        assert ProductInfo.objects.get(external_id=2).parameters == {
+            "Память (Гб)": "129"
+        }
+        assert ProductInfo.objects.get(external_id=4).parameters == {
+            "Цвет": "черный",
+            "Память (Гб)": "6,5 Тб",
+        }
+        assert dict(
+            ProductParameter.objects.filter(parameter__name="Память (Гб)").values_list(
+                "product_info__external_id", "value_number"
+            )
+        ) == {1: 128, 2: 129, 3: 130, 4: 6.5}
+        assert (
+            ProductParameter.objects.get(
+                product_info__external_id=4, parameter__name="Память (Гб)"
+            ).unit
+            == "Тб"
+        )
+
+    def test_dry_run_reports_changes(self, shop_user, serve_feed):
+        feed = make_feed(4)
+        serve_feed(feed)
+        tasks.do_import_celery(URL, shop_user.id)
+        rows_before = list(ProductInfo.objects.values_list("id", "price"))
+
+        feed["goods"][0]["price"] = 5000  # id=1 - изменена цена
+        feed["goods"][1]["parameters"]["Цвет"] = "белый"  # id=2 - изменен параметр
+        del feed["goods"][2]  # id=3 - удален из прайс-листа
+        feed["goods"].append(make_feed(1, first_id=10)["goods"][0])  # id=10 - новый
+        serve_feed(feed)
+
+        result = tasks.do_import_celery(URL, shop_user.id, dry_run=True)
+
+        assert result["Status"] is True
+        assert result["DryRun"] is True
+        assert result["Summary"] == {
+            "inserted": 1,
+            "updated": 2,
+            "unchanged": 1,
+            "removed": 1,
+            "errors": 0,
+        }
+        changes = {change["id"]: change for change in result["Changes"]}
+        assert [change["id"] for change in result["Changes"]] == [1, 2, 3, 10]
+        assert changes[1]["action"] == "update"
+        assert changes[1]["fields"] == {"price": {"old": "1000.00", "new": "5000"}}
+        assert changes[2]["fields"] == {
+            "parameters": {"Цвет": {"old": "черный", "new": "белый"}}
+        }
+        assert changes[3]["action"] == "delete"
+        assert changes[10]["action"] == "insert"
+        assert list(ProductInfo.objects.values_list("id", "price")) == rows_before
+        assert not Product.objects.filter(name="Товар 10").exists()
+
+    def test_dry_run_collects_errors(self, shop_user, serve_feed):
+        feed = make_feed(4)
+        feed["goods"][0]["category"] = "Неизвестная"
+        feed["goods"][1]["price"] = "дорого"
+        feed["goods"][2]["id"] = feed["goods"][3]["id"]
+        serve_feed(feed)
+
+        result = tasks.do_import_celery(URL, shop_user.id, dry_run=True)
+
+        assert result["Status"] is False
+        assert result["Summary"]["errors"] == 3
+        assert result["Summary"]["inserted"] == 1
+        assert [error["id"] for error in result["Errors"]] == [2, 4, 1]
+        assert not Shop.objects.exists()
+
+    def test_dry_run_query_count(
+        self, shop_user, serve_feed, django_assert_max_num_queries
+    ):
+        serve_feed(make_feed(300))
+        tasks.do_import_celery(URL, shop_user.id)
+
+        serve_feed(make_feed(300, first_id=150))
+        with django_assert_max_num_queries(5):
+            result = tasks.do_import_celery(URL, shop_user.id, dry_run=True)
+
+        assert result["Summary"]["unchanged"] == 0
+        assert result["Summary"]["removed"] == 149
+
+    def test_replace_import_flips_catalog_version(
+        self, shop_user, serve_feed, monkeypatch
+    ):
+        serve_feed(make_feed(3))
+        tasks.do_import_celery(URL, shop_user.id)
+        visible_before_flip = []
+        activate = CatalogWriter.activate
+
+        def spy_activate(writer):
+            visible_before_flip.extend(
+                ProductInfo.objects.active().values_list("external_id", flat=True)
+            )
+            activate(writer)
+
+        monkeypatch.setattr(CatalogWriter, "activate", spy_activate)
+        serve_feed(make_feed(2, first_id=10))
+
+        result = tasks.do_import_celery(URL, shop_user.id)
+
+        assert result["Stats"]["removed"] == 3
+        assert sorted(visible_before_flip) == [1, 2, 3]
+        assert Shop.objects.get(user=shop_user).catalog_version == 2
+        assert sorted(
+            ProductInfo.objects.active().values_list("external_id", flat=True)
+        ) == [10, 11]
+
+    def test_failed_replace_import_keeps_active_version(self, shop_user, serve_feed):
+        serve_feed(make_feed(3))
+        tasks.do_import_celery(URL, shop_user.id)
+        feed = make_feed(3, first_id=10)
+        feed["goods"][2]["category"] = "Неизвестная"
+        serve_feed(feed)
+
+        result = tasks.do_import_celery(URL, shop_user.id)
+
+        assert result["Status"] is False
+        assert Shop.objects.get(user=shop_user).catalog_version == 1
+        assert sorted(ProductInfo.objects.values_list("external_id", flat=True)) == [
+            1,
+            2,
+            3,
+        ]
+
+    def test_collect_catalog_versions(self, shop_user, serve_feed):
+        feed = make_feed(3)
+        serve_feed(feed)
+        tasks.do_import_celery(URL, shop_user.id)
+        old = dict(ProductInfo.objects.values_list("external_id", "id"))
+        basket_item = baker.make(
+            OrderItem, product_info_id=old[1], order__state="basket"
+        )
+        ordered_item = baker.make(OrderItem, product_info_id=old[2], order__state="new")
+        feed["goods"][0]["price"] = 5000
+        serve_feed(feed)
+        tasks.do_import_celery(URL, shop_user.id)
+        shop = Shop.objects.get(user=shop_user)
+
+        # Позиция корзины переносится при переключении версии каталога
+        basket_item.refresh_from_db()
+        assert basket_item.product_info.catalog_version == shop.catalog_version
+
+        result = tasks.collect_catalog_versions_celery(shop.id)
+
+        assert result == {"Status": True, "Removed": 2}
+        basket_item.refresh_from_db()
+        assert basket_item.product_info.catalog_version == shop.catalog_version
+        assert basket_item.product_info.price == 5000
+        ordered_item.refresh_from_db()
+        assert ordered_item.product_info_id == old[2]
+        assert ProductInfo.objects.active().count() == 3
+
+    @pytest.mark.parametrize(
+        "keys_order",
+        [
+            ("shop_name", "categories", "goods"),
+            ("goods", "categories", "shop_name"),
+        ],
+    )
+    def test_import_yaml_keys_order(self, shop_user, serve_feed, keys_order):
+        feed = make_feed(3)
+        serve_feed({key: feed[key] for key in keys_order}, sort_keys=False)
+
+        result = tasks.do_import_celery(URL, shop_user.id)
+
+        assert result["Status"] is True
+        assert Shop.objects.get(user=shop_user).name == "Магазин"
+        assert ProductInfo.objects.count() == 3
+
+    def test_import_invalid_yaml(self, shop_user, serve_content):
+        content = dump_yaml(make_feed(3), allow_unicode=True).encode()
+        serve_content(content[:-20] + b"[")
+
+        result = tasks.do_import_celery(URL, shop_user.id)
+
+        assert result["Status"] is False
+        assert not Shop.objects.exists()
+        assert not ProductInfo.objects.exists()
+
+    @pytest.mark.parametrize("mode", ["replace", "upsert"])
+    @pytest.mark.parametrize(
+        "field, value",
+        [("price", "abc"), ("price", 10**12), ("id", "x"), ("quantity", -1)],
+    )
+    def test_import_invalid_values(self, shop_user, serve_feed, mode, field, value):
+        feed = make_feed(3)
+        feed["goods"][1][field] = value
+        serve_feed(feed)
+
+        result = tasks.do_import_celery(URL, shop_user.id, mode)
+
+        assert result["Status"] is False
+        assert "Неверное значение поля" in result["Errors"]
+        assert not ProductInfo.objects.exists()
+
+    @pytest.mark.parametrize("mode", ["replace", "upsert"])
+    def test_import_numeric_names(self, shop_user, serve_feed, mode):
+        feed = make_feed(2)
+        feed["categories"] = [2024]
+        for product_data in feed["goods"]:
+            product_data["category"] = 2024
+        feed["goods"][0]["name"] = 12345
+        feed["goods"][0]["parameters"] = {2019: "да"}
+        serve_feed(feed)
+
+        result = tasks.do_import_celery(URL, shop_user.id, mode)
+
+        assert result["Status"] is True
+        product_info = ProductInfo.objects.get(external_id=1)
+        assert product_info.product.name == "12345"
+        assert product_info.product.category.name == "2024"
+        assert product_info.parameters == {"2019": "да"}
+        assert (
+            ProductParameter.objects.get(
+                product_info=product_info, parameter__name="2019"
+            ).value
+            == "да"
+        )
+
+    def test_import_sends_conditional_headers(self, shop_user, serve_feed):
+        headers = {"ETag": '"v1"', "Last-Modified": "Wed, 21 Oct 2026 07:28:00 GMT"}
+        serve_feed(make_feed(2), headers=headers)
+        tasks.do_import_celery(URL, shop_user.id)
+
+        sent_headers = serve_feed(make_feed(3), status_code=304)
+        result = tasks.do_import_celery(URL, shop_user.id)
+
+        assert sent_headers[-1] == {
+            "If-None-Match": '"v1"',
+            "If-Modified-Since": "Wed, 21 Oct 2026 07:28:00 GMT",
+        }
+        assert result["Unchanged"] is True
+        assert ProductInfo.objects.count() == 2
+
+    def test_import_skips_same_content(
+        self, shop_user, serve_feed, django_assert_max_num_queries
+    ):
+        serve_feed(make_feed(2))
+        tasks.do_import_celery(URL, shop_user.id)
+        ids_before = list(ProductInfo.objects.values_list("id", flat=True))
+
+        with django_assert_max_num_queries(1):
+            result = tasks.do_import_celery(URL, shop_user.id)
+
+        assert result["Unchanged"] is True
+        assert list(ProductInfo.objects.values_list("id", flat=True)) == ids_before
+
+        result = tasks.do_import_celery(URL, shop_user.id, force=True)
+
+        assert result["Stats"]["inserted"] == 2
+
+    def test_parallel_import(self, shop_user, serve_feed, monkeypatch, parallel_dir):
+        monkeypatch.setattr(celery_app.conf, "task_always_eager", True)
+        monkeypatch.setattr(settings, "IMPORT_PARALLEL_CHUNK_SIZE", 2)
+        feed = make_feed(5)
+        serve_feed(feed)
+        tasks.do_import_celery(URL, shop_user.id, "upsert")
+        ids_before = dict(ProductInfo.objects.values_list("external_id", "id"))
+
+        feed["goods"][0]["price"] = 5000
+        del feed["goods"][4]
+        feed["shop_name"] = "Новое название"
+        serve_feed(feed)
+
+        result = tasks.do_import_celery(URL, shop_user.id, "parallel")
+
+        assert result["Message"] == "Импорт запущен частями: 2."
+        shop = Shop.objects.get(user=shop_user)
+        assert shop.catalog_version == 1
+        active = ProductInfo.objects.active()
+        assert set(active.values_list("external_id", flat=True)) == {1, 2, 3, 4}
+        assert active.get(external_id=1).price == 5000
+        assert shop.name == "Новое название"
+        assert shop.import_state.content_hash
+        assert not list(parallel_dir.iterdir())  # Файл частей удален
+
+        tasks.collect_catalog_versions_celery(shop.id)
+
+        assert not ProductInfo.objects.filter(id__in=ids_before.values()).exists()
+
+    @pytest.mark.parametrize(
+        "error", [InvalidOperation(), ValidationError("Неверное значение.")]
+    )
+    def test_parallel_chunk_catches_errors(self, shop_user, monkeypatch, error):
+        shop = baker.make(Shop, user=shop_user)
+
+        def write_goods(self, goods):
+            raise error
+
+        monkeypatch.setattr(CatalogWriter, "write_goods", write_goods)
+
+        path, [(offset, count)] = feeds.write_feed_chunks([{"id": 1}], 10)
+
+        result = tasks.import_goods_chunk_celery(shop.id, {}, 1, path, offset, count)
+
+        assert result["Status"] is False
+
+    def test_parallel_import_error_discards_version(
+        self, shop_user, serve_feed, monkeypatch
+    ):
+        serve_feed(make_feed(2))
+        tasks.do_import_celery(URL, shop_user.id)
+        shop = Shop.objects.get(user=shop_user)
+        baker.make(
+            ProductInfo,
+            shop=shop,
+            product=ProductInfo.objects.first().product,
+            external_id=100,
+            catalog_version=shop.catalog_version + 1,
+        )
+        ImportLock(shop_user.id).acquire("import-task-id", {})
+        released = []
+        monkeypatch.setattr(
+            tasks, "release_import", lambda *args: released.append(args)
+        )
+
+        tasks.abort_parallel_import_celery(
+            None,
+            ValueError(),
+            None,
+            shop.id,
+            shop.catalog_version + 1,
+            "import-task-id",
+        )
+
+        assert set(ProductInfo.objects.values_list("catalog_version", flat=True)) == {
+            shop.catalog_version
+        }
+        assert released == [(shop_user.id, "import-task-id")]
+        shop.import_state.refresh_from_db()
+        assert shop.import_state.failures == 1
+        cache.clear()
+
+    def test_feed_chunks(self):
+        goods = [{"id": index} for index in range(5)]
+
+        path, chunks = feeds.write_feed_chunks(iter(goods), 2)
+
+        assert [count for _, count in chunks] == [2, 2, 1]
+        assert [
+            item for chunk in chunks for item in feeds.read_feed_chunk(path, *chunk)
+        ] == goods
+        feeds.remove_feed_chunks(path)
+        assert not os.path.exists(path)
+
+    def test_import_publishes_progress(self, shop_user, serve_feed, monkeypatch):
+        monkeypatch.setattr(settings, "IMPORT_PROGRESS_INTERVAL", 0)
+        monkeypatch.setattr(settings, "IMPORT_BATCH_SIZE", 2)
+        published = []
+        monkeypatch.setattr(
+            tasks.do_import_celery,
+            "update_state",
+            lambda state, meta: published.append((state, meta)),
+        )
+        serve_feed(make_feed(5))
+
+        tasks.do_import_celery.push_request(id="import-task-id")
+        try:
+            tasks.do_import_celery.run(URL, shop_user.id)
+        finally:
+            tasks.do_import_celery.pop_request()
+
+        assert {state for state, _ in published} == {"PROGRESS"}
+        phases = [meta["phase"] for _, meta in published]
+        assert phases[0] == "fetch"
+        assert {"parse", "categories", "goods"} <= set(phases)
+        assert {"parameters", "merge"} & set(phases)  # merge при загрузке через COPY
+        assert published[-1][1]["done"] == 5
+        assert published[-1][1]["items_per_second"] > 0
+
+    def test_import_rejects_too_large_feed(self, shop_user, serve_feed, monkeypatch):
+        monkeypatch.setattr(settings, "IMPORT_FETCH_MAX_SIZE_MB", 0.001)
+        serve_feed(make_feed(20))
+
+        result = tasks.do_import_celery(URL, shop_user.id)
+
+        assert result == {
+            "Status": False,
+            "Errors": "Размер прайс-листа превышает 0.001 МБ.",
+        }
+        assert not Shop.objects.exists()
+
+    @pytest.mark.parametrize("content_length", ["abc", "-5"])
+    def test_import_ignores_invalid_content_length(
+        self, shop_user, serve_feed, content_length
+    ):
+        serve_feed(make_feed(2), headers={"Content-Length": content_length})
+
+        result = tasks.do_import_celery(URL, shop_user.id)
+
+        assert result["Status"] is True
+        assert ProductInfo.objects.count() == 2
+
+    def test_import_records_fetch_metrics(self, shop_user, serve_feed):
+        serve_feed(make_feed(2))
+
+        result = tasks.do_import_celery(URL, shop_user.id)
+
+        assert result["Fetch"]["status"] == 200
+        assert result["Fetch"]["bytes"] > 0
+        assert result["Fetch"]["duration"] >= 0
+
+    @pytest.mark.parametrize(
+        "feed_format, response_kwargs",
+        [
+            ("json", {"headers": {"Content-Type": "application/json"}}),
+            ("ndjson", {"headers": {"Content-Type": "application/x-ndjson"}}),
+            ("csv", {}),
+        ],
+    )
+    def test_import_alternative_formats(
+        self, shop_user, serve_content, feed_format, response_kwargs
+    ):
+        feed = make_feed(3)
+        serve_content(dump_feed(feed, feed_format), **response_kwargs)
+        url = URL.replace(".yaml", ".csv") if feed_format == "csv" else URL
+
+        result = tasks.do_import_celery(url, shop_user.id)
+
+        assert result["Status"] is True
+        shop = Shop.objects.get(user=shop_user)
+        assert shop.name == "Магазин"
+        assert set(shop.categories.values_list("name", flat=True)) == {
+            "Смартфоны",
+            "Ноутбуки",
+        }
+        product_info = ProductInfo.objects.get(external_id=2)
+        assert (product_info.price, product_info.quantity) == (1001, 10)
+        assert dict(
+            product_info.product_parameters.values_list("parameter__name", "value")
+        ) == {"Цвет": "черный", "Память (Гб)": "129"}
+
+
+def dump_feed(feed, feed_format):
+    """Сериализует прайс-лист в формат json, ndjson или csv."""
+    if feed_format == "json":
+        return dump_json(feed).encode()
+    if feed_format == "ndjson":
+        header = {key: value for key, value in feed.items() if key != "goods"}
+        lines = [dump_json(item) for item in [header, *feed["goods"]]]
+        return "\n".join(lines).encode()
+
+    stream = StringIO()
+    parameters = list(feed["goods"][0]["parameters"])
+    writer = DictWriter(
+        stream, fieldnames=[*CsvFeedReader.item_fields, "shop_name", *parameters]
+    )
+    writer.writeheader()
+    for item in feed["goods"]:
+        row = {key: value for key, value in item.items() if key != "parameters"}
+        writer.writerow({**row, **item["parameters"], "shop_name": feed["shop_name"]})
+    return stream.getvalue().encode()
+
+
+@pytest.mark.parametrize(
+    "url, content_type, expected",
+    [
+        (URL, "application/json; charset=utf-8", "json"),
+        ("https://example.com/feed.jsonl", "text/plain", "ndjson"),
+        ("https://example.com/feed.CSV?v=1", "", "csv"),
+        ("https://example.com/feed", "", "yaml"),
+    ],
+)
+def test_detect_feed_format(url, content_type, expected):
+    assert feeds.detect_feed_format(url, content_type) == expected
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (512, (512, "")),
+        ("6.5", (6.5, "")),
+        ("-2,4 ГГц", (-2.4, "ГГц")),
+        ("1920x1080", (None, "")),
+        ("черный", (None, "")),
+        ("5 " + "x" * 30, (None, "")),
+    ],
+)
+def test_parse_numeric_value(value, expected):
+    assert parse_numeric_value(value) == expected
+
+
+def test_feed_fetcher_session():
+    session = feeds.FeedFetcher.get_session()
+
+    adapter = session.get_adapter(URL)
+    assert feeds.FeedFetcher.get_session() is session
+    assert adapter.max_retries.total == settings.IMPORT_FETCH_RETRIES
+    assert adapter.max_retries.backoff_factor == settings.IMPORT_FETCH_BACKOFF
+    assert session.headers["Accept-Encoding"] == "gzip, deflate"
+
+
+@pytest.mark.parametrize("loader", [CSafeLoader, SafeLoader])
+def test_yaml_feed_reader_streams_goods(monkeypatch, loader):
+    monkeypatch.setattr(feeds, "FeedLoader", loader)
+    feed = make_feed(3)
+    content = dump_yaml(feed, allow_unicode=True).encode()
+
+    reader = feeds.YamlFeedReader(BytesIO(content))
+    goods = reader.goods()
+
+    # shop_name расположен после goods и еще не прочитан
+    assert reader.header == {"categories": feed["categories"]}
+    assert next(goods) == feed["goods"][0]
+    assert list(goods) == feed["goods"][1:]
+    assert reader.header["shop_name"] == feed["shop_name"]
+
+
+@pytest.mark.django_db
+class TestExportCatalog:
+    """Тесты для выгрузки каталога магазина."""
+
+    @pytest.mark.parametrize("feed_format", ["yaml", "ndjson"])
+    def test_export_round_trips_into_import(
+        self, shop_user, serve_feed, serve_content, feed_format, monkeypatch
+    ):
+        monkeypatch.setattr(settings, "EXPORT_CHUNK_SIZE", 2)
+        feed = make_feed(5)
+        feed["goods"][0]["price"] = "99.90"
+        serve_feed(feed)
+        tasks.do_import_celery(URL, shop_user.id)
+        shop = Shop.objects.get(user=shop_user)
+
+        content = b"".join(export_catalog(shop, feed_format))
+        serve_content(content)
+        result = tasks.do_import_celery(
+            URL, shop_user.id, feed_format=feed_format, dry_run=True
+        )
+
+        assert result["Summary"] == {
+            "inserted": 0,
+            "updated": 0,
+            "unchanged": 5,
+            "removed": 0,
+            "errors": 0,
+        }
+
+    @pytest.fixture
+    def media_root(self, settings, tmp_path):
+        """Хранилище файлов во временном каталоге теста."""
+        settings.MEDIA_ROOT = str(tmp_path)
+        return tmp_path
+
+    def test_build_export_reuses_unchanged_catalog(
+        self, shop_user, serve_feed, media_root
+    ):
+        serve_feed(make_feed(3))
+        tasks.do_import_celery(URL, shop_user.id)
+        shop = Shop.objects.get(user=shop_user)
+
+        path, created = build_export(shop, "json")
+        reused_path, reused = build_export(Shop.objects.get(id=shop.id), "json")
+
+        assert (created, reused, reused_path) == (True, False, path)
+        with gzip.open(media_root / path) as file:
+            data = load_json(file.read())
+        assert data["shop_name"] == "Магазин"
+        assert [product["id"] for product in data["goods"]] == [1, 2, 3]
+
+        shop.touch_catalog()
+        new_path, created = build_export(shop, "json")
+
+        assert created and new_path != path
+        assert not (media_root / path).exists()
+
+    def test_export_task_returns_artifact_url(self, shop_user, media_root):
+        shop = baker.make(Shop, user=shop_user, name="Магазин")
+
+        result = tasks.export_catalog_celery(shop.id, "yaml")
+
+        assert result["Status"] is True and result["Reused"] is False
+        assert result["export_url"].startswith(f"/media/exports/shop_{shop.id}/")
+
+    def test_export_empty_catalog(self, shop_user):
+        shop = baker.make(Shop, user=shop_user, name="Магазин")
+
+        content = b"".join(export_catalog(shop, "yaml")).decode()
+
+        assert content.endswith("goods: []\n")
+
+
+@pytest.mark.django_db
+class TestNameCache:
+    """Тесты для общих словарей имен категорий и параметров."""
+
+    def test_resolves_known_names_without_queries(
+        self, django_capture_on_commit_callbacks, django_assert_num_queries
+    ):
+        with django_capture_on_commit_callbacks(execute=True):
+            created = parameter_names.resolve(["Цвет", "Вес"])
+
+        with django_assert_num_queries(0):
+            assert parameter_names.resolve(["Вес", "Цвет"]) == created
+
+    def test_rename_invalidates_names(self, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            category_id = category_names.resolve(["Смартфоны"])["Смартфоны"]
+
+        Category.objects.filter(id=category_id).first().delete()
+
+        assert category_names.resolve(["Смартфоны"], create=False) == {}
+
+    def test_rolled_back_names_are_not_remembered(
+        self, django_capture_on_commit_callbacks, django_assert_num_queries
+    ):
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            with pytest.raises(RuntimeError), transaction.atomic():
+                category_names.resolve(["Ноутбуки"])
+                raise RuntimeError
+
+        assert not callbacks
+        with django_assert_num_queries(1):
+            assert category_names.resolve(["Ноутбуки"], create=False) == {}
+
+
+@pytest.mark.django_db
+class TestFeedCache:
+    """Тесты для кэша разобранных прайс-листов."""
+
+    def test_repeat_import_skips_parsing(
+        self, shop_user, serve_feed, feed_cache_dir, monkeypatch
+    ):
+        serve_feed(make_feed(3))
+        assert tasks.do_import_celery(URL, shop_user.id)["Status"] is True
+        assert len(list(feed_cache_dir.glob("*.yaml.pickle"))) == 1
+
+        def fail(stream):
+            raise AssertionError("Прайс-лист разбирается повторно")
+
+        monkeypatch.setitem(feeds.FEED_READERS, "yaml", fail)
+        result = tasks.do_import_celery(URL, shop_user.id, force=True)
+        preview = tasks.do_import_celery(URL, shop_user.id, dry_run=True)
+
+        assert result["Status"] is True
+        assert ProductInfo.objects.active().filter(shop__user=shop_user).count() == 3
+        assert preview["Summary"]["unchanged"] == 3
+
+    def test_failed_parse_is_not_cached(self, shop_user, serve_content, feed_cache_dir):
+        serve_content(b"goods: [")
+
+        assert tasks.do_import_celery(URL, shop_user.id)["Status"] is False
+        assert not list(feed_cache_dir.glob("*.pickle"))
+
+    def test_partially_read_feed_is_not_cached(self, serve_feed, feed_cache_dir):
+        serve_feed(make_feed(3))
+        download = feeds.FeedFetcher().fetch(URL)
+        feed = feeds.open_feed(download, URL)
+
+        goods = feed.goods()
+        assert next(goods)["id"] == 1
+        goods.close()
+        download.close()
+
+        assert not list(feed_cache_dir.iterdir())
+
+    def test_skips_too_large_feed(self, feed_cache_dir, monkeypatch):
+        monkeypatch.setattr(settings, "IMPORT_CACHE_MAX_FEED_SIZE_MB", 0.001)
+        cache = FeedCache()
+        goods = [{"id": index, "name": f"{index:0100}"} for index in range(20)]
+
+        cache.put("a", "yaml", ParsedFeed({}, goods))
+
+        assert not list(feed_cache_dir.iterdir())
+
+    def test_evicts_least_recently_used(self, feed_cache_dir, monkeypatch):
+        monkeypatch.setattr(settings, "IMPORT_CACHE_MAX_SIZE_MB", 1)
+        cache = FeedCache()
+        goods = [{"id": index, "name": f"{index:01000}"} for index in range(300)]
+        for number, content_hash in enumerate(("a", "b", "c")):
+            cache.put(content_hash, "yaml", ParsedFeed({}, goods))
+            path = cache.path(content_hash, "yaml")
+            os.utime(path, (number, number))
+        cache.get("a", "yaml")  # Обновляет время использования
+        cache.put("d", "yaml", ParsedFeed({}, goods))
+
+        assert cache.get("b", "yaml") is None
+        assert cache.get("d", "yaml").header == {}
+        feed = cache.get("a", "yaml")
+        assert len(feed) == 300
+        assert list(feed.goods()) == goods
+
+
+@pytest.mark.django_db
+class TestImportSchedule:
+    """Тесты для импорта по расписанию."""
+
+    @pytest.fixture
+    def started(self, monkeypatch):
+        started = []
+        monkeypatch.setattr(
+            tasks, "enqueue_import", lambda url, user_id: started.append(user_id)
+        )
+        return started
+
+    @staticmethod
+    def make_state(**kwargs):
+        shop = baker.make(Shop, user=baker.make(CustomUser, type="shop"), url=URL)
+        return baker.make(ShopImportState, shop=shop, url=URL, **kwargs)
+
+    def test_reschedule_backs_off_after_failures(self):
+        state = self.make_state(refresh_interval=30)
+
+        for _ in range(2):
+            tasks.reschedule_import(
+                state.shop.user_id, {"Status": False, "Errors": "x"}
+            )
+        state.refresh_from_db()
+        delay = state.next_import_at - timezone.now()
+        assert state.failures == 2 and state.last_error == "x"
+        assert timedelta(minutes=107) < delay <= timedelta(minutes=132)
+
+        tasks.reschedule_import(state.shop.user_id, {"Status": True})
+        state.refresh_from_db()
+        delay = state.next_import_at - timezone.now()
+        assert state.failures == 0
+        assert timedelta(minutes=26) < delay <= timedelta(minutes=33)
+
+    def test_reschedule_creates_state_after_failed_import(self, shop_user):
+        shop = baker.make(Shop, user=shop_user, url=URL)
+
+        tasks.reschedule_import(shop_user.id, {"Status": False, "Errors": "x"})
+
+        state = ShopImportState.objects.get(shop=shop)
+        assert state.url == URL
+        assert state.failures == 1
+        assert state.next_import_at > timezone.now()
+
+    def test_schedule_respects_concurrency_cap(
+        self, monkeypatch, started, django_capture_on_commit_callbacks
+    ):
+        monkeypatch.setattr(settings, "IMPORT_SCHEDULE_MAX_CONCURRENT", 2)
+        past = timezone.now() - timedelta(minutes=1)
+        self.make_state(next_import_at=past, scheduled_at=past)  # Выполняется
+        first = self.make_state(next_import_at=past - timedelta(minutes=1))
+        self.make_state(next_import_at=past)
+        self.make_state(next_import_at=past, refresh_interval=0)
+        spread = self.make_state()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            result = tasks.schedule_imports_celery()
+
+        assert result["Started"] == 1
+        assert started == [first.shop.user_id]
+        spread.refresh_from_db()
+        assert spread.next_import_at > timezone.now()
+
+    def test_import_task_reschedules_shop(self, shop_user, serve_feed, monkeypatch):
+        monkeypatch.setattr(tasks, "release_import", lambda *args: None)
+        monkeypatch.setattr(
+            tasks.do_import_celery, "update_state", lambda state, meta: None
+        )
+        serve_feed(make_feed(2))
+        tasks.do_import_celery(URL, shop_user.id)
+        ShopImportState.objects.update(scheduled_at=timezone.now())
+
+        tasks.do_import_celery.push_request(id="import-task-id")
+        try:
+            tasks.do_import_celery.run(URL, shop_user.id, force=True)
+        finally:
+            tasks.do_import_celery.pop_request()
+
+        state = ShopImportState.objects.get(shop__user=shop_user)
+        assert state.scheduled_at is None
+        assert state.next_import_at > timezone.now()
+
+
+@pytest.mark.django_db
+class TestImportLock:
+    """Тесты для блокировки и объединения импортов магазина."""
+
+    @pytest.fixture(autouse=True)
+    def started(self, monkeypatch):
+        """Подменяет запуск задачи, возвращает список запущенных задач."""
+        cache.clear()
+        started = []
+
+        def fake_apply_async(kwargs, task_id=None):
+            started.append((task_id, kwargs))
+            return type("FakeResult", (), {"id": task_id})
+
+        monkeypatch.setattr(tasks.do_import_celery, "apply_async", fake_apply_async)
+        monkeypatch.setattr(
+            tasks.do_import_celery, "update_state", lambda state, meta: None
+        )
+        yield started
+        cache.clear()
+
+    def test_enqueue_import_coalesces_requests(self, shop_user, started):
+        task_id, import_status = tasks.enqueue_import(URL, shop_user.id)
+        assert import_status == "started"
+
+        assert tasks.enqueue_import(URL, shop_user.id) == (task_id, "joined")
+
+        pending_id, import_status = tasks.enqueue_import(
+            URL, shop_user.id, mode="upsert"
+        )
+        assert import_status == "queued"
+        assert tasks.enqueue_import(URL, shop_user.id, force=True) == (
+            pending_id,
+            "queued",
+        )
+        assert [started_id for started_id, _ in started] == [task_id]
+
+        tasks.release_import(shop_user.id, task_id)
+
+        assert started[-1][0] == pending_id
+        assert started[-1][1]["force"] is True  # Выполняется последний запрос
+        assert started[-1][1]["mode"] is None
+        assert ImportLock(shop_user.id).current["task_id"] == pending_id
+        assert ImportLock(shop_user.id).pending is None
+
+        tasks.release_import(shop_user.id, pending_id)
+
+        assert ImportLock(shop_user.id).current is None
+        assert len(started) == 2
+
+    def test_release_rechecks_pending_after_delete(self, shop_user, monkeypatch):
+        lock = ImportLock(shop_user.id)
+        lock.acquire("import-task-id", {})
+        delete = cache.delete
+
+        def delete_and_enqueue(key, *args, **kwargs):
+            # Отложенный импорт записан сразу после удаления блокировки
+            result = delete(key, *args, **kwargs)
+            if key == lock.lock_key:
+                lock._set_pending("next-task-id", {"url": URL})
+            return result
+
+        monkeypatch.setattr(cache, "delete", delete_and_enqueue)
+
+        pending = lock.release("import-task-id")
+
+        assert pending["task_id"] == "next-task-id"
+        assert lock.current["task_id"] == "next-task-id"
+        assert lock.pending is None
+
+    def test_dry_run_ignores_lock(self, shop_user, started):
+        tasks.enqueue_import(URL, shop_user.id)
+
+        _, import_status = tasks.enqueue_import(URL, shop_user.id, dry_run=True)
+
+        assert import_status == "started"
+        assert ImportLock(shop_user.id).pending is None
+
+    def test_import_task_defers_when_locked(self, shop_user, serve_feed, started):
+        ImportLock(shop_user.id).acquire("other-task-id", {})
+        serve_feed(make_feed(2))
+
+        tasks.do_import_celery.push_request(id="import-task-id")
+        try:
+            result = tasks.do_import_celery.run(URL, shop_user.id)
+        finally:
+            tasks.do_import_celery.pop_request()
+
+        pending = ImportLock(shop_user.id).pending
+        assert result["result_url"].endswith(f"{pending['task_id']}/")
+        assert not ProductInfo.objects.exists()
+        assert not started
+
+    def test_import_task_releases_lock(self, shop_user, serve_feed, started):
+        serve_feed(make_feed(2))
+        ImportLock(shop_user.id).acquire("import-task-id", {})
+        ImportLock(shop_user.id).set_pending("next-task-id", {"url": URL})
+
+        tasks.do_import_celery.push_request(id="import-task-id")
+        try:
+            result = tasks.do_import_celery.run(URL, shop_user.id)
+        finally:
+            tasks.do_import_celery.pop_request()
+
+        assert result["Status"] is True
+        assert started == [("next-task-id", {"url": URL})]
+        assert ImportLock(shop_user.id).current["task_id"] == "next-task-id"
+
+
+@pytest.mark.django_db(transaction=True)
+class TestImportShopsCommand:
+    """Тесты для команды import_shops."""
+
+    @pytest.fixture(autouse=True)
+    def eager_celery(self, monkeypatch):
+        cache.clear()
+        monkeypatch.setattr(celery_app.conf, "task_always_eager", True)
+
+    def test_imports_shops_from_manifest(self, tmp_path, serve_feed, feed_cache_dir):
+        users = baker.make(CustomUser, type="shop", _quantity=2)
+        locked_user = baker.make(CustomUser, type="shop")
+        ImportLock(locked_user.id).acquire("other-task-id", {})
+        manifest = tmp_path / "manifest.yaml"
+        manifest.write_text(
+            dump_yaml(
+                [
+                    {"user": users[0].email, "url": URL},
+                    {"user": users[1].id, "url": URL, "mode": "upsert"},
+                    {"user": locked_user.email, "url": URL},
+                ]
+            )
+        )
+        serve_feed(make_feed(5))
+        out = StringIO()
+
+        call_command(
+            "import_shops", str(manifest), parse_workers=1, db_workers=1, stdout=out
+        )
+
+        for user in users:
+            assert ProductInfo.objects.active().filter(shop__user=user).count() == 5
+            assert ImportLock(user.id).current is None
+        assert not Shop.objects.filter(user=locked_user).exists()
+        output = out.getvalue()
+        assert "Магазин успешно обновлен." in output
+        assert "Импорт магазина уже выполняется." in output
+        assert "Итого: магазинов 2 из 3, товаров 10" in output
+        assert len(list(feed_cache_dir.glob("*.yaml.pickle"))) == 1
+
+    def test_rejects_unknown_user(self, tmp_path):
+        manifest = tmp_path / "manifest.yaml"
+        manifest.write_text(dump_yaml([{"user": "nobody@example.com", "url": URL}]))
+
+        with pytest.raises(CommandError, match="не найден"):
+            call_command("import_shops", str(manifest))